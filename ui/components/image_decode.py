@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Файл: ui/components/image_decode.py
+Описание: Декодирование изображений сразу в уменьшенном размере и чтение
+размеров из заголовка без полного декодирования.
+"""
+
+import logging
+
+from PySide6.QtCore import Qt, QSize
+from PySide6.QtGui import QImage, QImageReader, QPixmap
+
+try:
+    from PIL import Image
+
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+def read_image_size(path):
+    """Размеры изображения (ширина, высота) из заголовка файла"""
+    reader = QImageReader(path)
+    size = reader.size()
+    if size.isValid():
+        return size.width(), size.height()
+
+    if PIL_AVAILABLE:
+        try:
+            # Image.open читает только заголовок, пиксели не декодируются
+            with Image.open(path) as img:
+                return img.width, img.height
+        except Exception as e:
+            logger.error(f"Ошибка чтения размеров {path}: {e}")
+    return 0, 0
+
+
+def _target_size(src_w, src_h, w, h, mode):
+    """Целевой размер с учётом режима пропорций, без увеличения"""
+    target = QSize(src_w, src_h).scaled(w, h, mode)
+    if target.width() >= src_w or target.height() >= src_h:
+        return None
+    return target
+
+
+def pil_open_reduced(path, w, h, mode=Qt.KeepAspectRatio):
+    """
+    Открывает изображение через PIL с уменьшением на этапе декодирования:
+    draft для JPEG (масштабирование DCT) и reduce для остальных форматов.
+    """
+    img = Image.open(path)
+    target = _target_size(img.width, img.height, w, h, mode)
+    if target is None:
+        img.load()
+        return img
+
+    tw, th = target.width(), target.height()
+    if img.format == "JPEG":
+        img.draft("RGB", (tw, th))
+    factor = min(img.width // tw, img.height // th)
+    if factor >= 2:
+        img = img.reduce(factor)
+    if img.size != (tw, th):
+        img = img.resize((tw, th), Image.LANCZOS)
+    return img
+
+
+def _pil_to_qimage(img):
+    """Конвертация PIL.Image в QImage (копия данных)"""
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+    fmt = QImage.Format_RGBA8888 if img.mode == "RGBA" else QImage.Format_RGB888
+    data = img.tobytes()
+    bpl = img.width * (4 if img.mode == "RGBA" else 3)
+    return QImage(data, img.width, img.height, bpl, fmt).copy()
+
+
+def read_scaled_image(path, w, h, mode=Qt.KeepAspectRatio):
+    """
+    Декодирует изображение сразу в размер w×h (с учётом mode).
+    Безопасно вызывать из рабочих потоков.
+    """
+    reader = QImageReader(path)
+    reader.setAutoTransform(True)
+    size = reader.size()
+    if size.isValid():
+        target = _target_size(size.width(), size.height(), w, h, mode)
+        if target is not None:
+            reader.setScaledSize(target)
+    img = reader.read()
+    if not img.isNull():
+        return img
+
+    if PIL_AVAILABLE:
+        try:
+            return _pil_to_qimage(pil_open_reduced(path, w, h, mode))
+        except Exception as e:
+            logger.error(f"Ошибка декодирования {path}: {e}")
+    else:
+        logger.error(f"Ошибка декодирования {path}: {reader.errorString()}")
+    return QImage()
+
+
+def load_scaled_pixmap(path, w, h, mode=Qt.KeepAspectRatio):
+    """Уменьшенный QPixmap для превью (только GUI-поток)"""
+    img = read_scaled_image(path, w, h, mode)
+    if img.isNull():
+        return QPixmap()
+    return QPixmap.fromImage(img)
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+Файл: ui/components/model_registry.py
+Описание: Общий реестр AI-моделей (YOLO, LaMa) с фоновой загрузкой и прогревом.
+Модели разделяются между окнами и главами и выгружаются при нехватке памяти.
+"""
+
+import os
+import gc
+import time
+import logging
+import threading
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PySide6.QtCore import QObject, Signal
+
+from ui.components.stage_timer import get_stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Состояния модели
+ST_NONE, ST_LOADING, ST_READY, ST_FAILED = "none", "loading", "ready", "failed"
+# Сколько моделей держать загруженными (сверх - выгружаются давно не использованные)
+MAX_MODELS = 4
+# Минимум свободной памяти, МБ: при меньшем значении неиспользуемые модели выгружаются
+MIN_FREE_RAM_MB = 1024
+MIN_FREE_VRAM_MB = 512
+# Сколько памяти должна освободить выгрузка, чтобы продолжать выгружать при нехватке, МБ
+MIN_FREED_MB = 64
+# Размер изображения для прогрева моделей
+WARMUP_SIZE = 64
+
+_cuda_ready = None
+
+
+def package_available(name):
+    """Установлен ли пакет (без его импорта)"""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def get_device():
+    """Доступное устройство; при первом вызове включает CUDA и cuDNN"""
+    global _cuda_ready
+    if _cuda_ready is None:
+        try:
+            import torch
+            _cuda_ready = torch.cuda.is_available()
+            if _cuda_ready:
+                torch.backends.cudnn.enabled = True
+                torch.backends.cudnn.benchmark = True
+                logger.info(f"CUDA: {torch.cuda.device_count()} устройств, {torch.cuda.get_device_name(0)}")
+            else:
+                logger.info("CUDA недоступна")
+        except Exception as e:
+            logger.error(f"Ошибка CUDA: {str(e)}")
+            _cuda_ready = False
+    return 'cuda' if _cuda_ready else 'cpu'
+
+
+def _load_yolo(path):
+    if not path or not os.path.exists(path):
+        raise FileNotFoundError(f"Модель не найдена: {path}")
+    from ultralytics import YOLO
+    device = get_device()
+    model = YOLO(path)
+    # Прогрев: первая инференция инициализирует слои, fuse и ядра CUDA
+    dummy = np.zeros((WARMUP_SIZE, WARMUP_SIZE, 3), dtype=np.uint8)
+    model.predict(dummy, device=device, half=device == 'cuda', verbose=False)
+    logger.info(f"Модель {os.path.basename(path)} загружена на {device}")
+    return model
+
+
+def _load_lama(path):
+    from simple_lama_inpainting import SimpleLama
+    lama = SimpleLama()
+    model = getattr(lama, 'model', None)
+    device = getattr(lama, 'device', None)
+    if model is not None and device is not None:
+        import torch
+        with torch.inference_mode():
+            img = torch.zeros((1, 3, WARMUP_SIZE, WARMUP_SIZE), device=device)
+            model(img, torch.zeros((1, 1, WARMUP_SIZE, WARMUP_SIZE), device=device))
+    logger.info("SimpleLama успешно инициализирован")
+    return lama
+
+
+# Загрузчики по типу модели: (путь) -> модель
+LOADERS = {
+    'yolo': _load_yolo,
+    'lama': _load_lama,
+}
+
+
+def _free_memory_mb():
+    """(свободная RAM, свободная VRAM) в МБ; None, если узнать нельзя"""
+    ram = vram = None
+    try:
+        import psutil
+        ram = psutil.virtual_memory().available // (1024 * 1024)
+    except Exception:
+        pass
+    if _cuda_ready:
+        try:
+            import torch
+            vram = torch.cuda.mem_get_info()[0] // (1024 * 1024)
+        except Exception:
+            pass
+    return ram, vram
+
+
+def _memory_low(ram, vram):
+    return (ram is not None and ram < MIN_FREE_RAM_MB) or (vram is not None and vram < MIN_FREE_VRAM_MB)
+
+
+def _freed(before, after):
+    """Выгрузка заметно освободила память"""
+    return before is not None and after is not None and after - before >= MIN_FREED_MB
+
+
+class _Entry:
+    __slots__ = ("kind", "path", "state", "model", "future", "error", "last_used", "pins")
+
+    def __init__(self, kind, path):
+        self.kind = kind
+        self.path = path
+        self.state = ST_NONE
+        self.model = None
+        self.future = None
+        self.error = ""
+        self.last_used = 0.0
+        self.pins = 0  # сколько владельцев запретили выгрузку
+
+
+class ModelRegistry(QObject):
+    """
+    Модели загружаются и прогреваются в одном фоновом потоке (импорт
+    torch/ultralytics тоже там), GUI получает состояние через state_changed.
+    get() из рабочих потоков дожидается загрузки. Закрепленные (pin)
+    модели не выгружаются.
+    """
+    state_changed = Signal(str, str)  # ключ модели, состояние
+
+    def __init__(self, max_models=MAX_MODELS, parent=None):
+        super().__init__(parent)
+        self.max_models = max_models
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="models")
+        self.lock = threading.RLock()
+        self.entries = {}  # ключ -> _Entry
+
+    @staticmethod
+    def key(kind, path=None):
+        return f"{kind}:{os.path.abspath(path)}" if path else kind
+
+    def _entry(self, kind, path):
+        key = self.key(kind, path)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = _Entry(kind, path)
+        return key, entry
+
+    def _set_state(self, key, entry, state):
+        entry.state = state
+        self.state_changed.emit(key, state)
+
+    def request(self, kind, path=None):
+        """Ставит модель в фоновую загрузку (если она еще не загружена); возвращает Future"""
+        with self.lock:
+            key, entry = self._entry(kind, path)
+            if entry.future is None or entry.state in (ST_NONE, ST_FAILED):
+                self._set_state(key, entry, ST_LOADING)
+                entry.future = self.pool.submit(self._load, key, entry)
+            return entry.future
+
+    def preload(self, models):
+        """Фоновая загрузка набора моделей: [(тип, путь)]; недоступные пропускаются"""
+        for kind, path in models:
+            if kind == 'yolo' and (not path or not os.path.exists(path)):
+                continue
+            if kind == 'lama' and not package_available('simple_lama_inpainting'):
+                continue
+            self.request(kind, path)
+
+    def _load(self, key, entry):
+        self.trim(reserve=1)
+        start = time.perf_counter()
+        try:
+            model = LOADERS[entry.kind](entry.path)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки модели {key}: {str(e)}")
+            with self.lock:
+                entry.error = str(e)
+                self._set_state(key, entry, ST_FAILED)
+            raise
+        elapsed = time.perf_counter() - start
+        get_stage_timer().add(f"model.load.{entry.kind}", elapsed)
+        with self.lock:
+            entry.model = model
+            entry.last_used = time.monotonic()
+            self._set_state(key, entry, ST_READY)
+        logger.info(f"Модель {key} готова за {elapsed:.2f} с")
+        return model
+
+    def get(self, kind, path=None, timeout=None):
+        """
+        Модель, дожидаясь загрузки (вызывать из рабочих потоков).
+        None, если загрузить не удалось.
+        """
+        future = self.request(kind, path)
+        try:
+            model = future.result(timeout)
+        except Exception:
+            return None
+        with self.lock:
+            entry = self.entries.get(self.key(kind, path))
+            if entry is not None:
+                entry.last_used = time.monotonic()
+        return model
+
+    def peek(self, kind, path=None):
+        """Загруженная модель или None (без ожидания)"""
+        with self.lock:
+            entry = self.entries.get(self.key(kind, path))
+            return entry.model if entry is not None and entry.state == ST_READY else None
+
+    def state(self, kind, path=None):
+        with self.lock:
+            entry = self.entries.get(self.key(kind, path))
+            return entry.state if entry is not None else ST_NONE
+
+    def error(self, kind, path=None):
+        with self.lock:
+            entry = self.entries.get(self.key(kind, path))
+            return entry.error if entry is not None else ""
+
+    def pin(self, kind, path=None):
+        with self.lock:
+            self._entry(kind, path)[1].pins += 1
+
+    def unpin(self, kind, path=None):
+        with self.lock:
+            entry = self.entries.get(self.key(kind, path))
+            if entry is not None and entry.pins > 0:
+                entry.pins -= 1
+
+    def evict(self, key):
+        """Выгружает модель (закрепленные и загружающиеся не трогаются)"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry.pins or entry.state != ST_READY:
+                return False
+            del self.entries[key]
+            entry.model = None
+            self.state_changed.emit(key, ST_NONE)
+        gc.collect()
+        if _cuda_ready:
+            import torch
+            torch.cuda.empty_cache()
+        logger.info(f"Модель {key} выгружена")
+        return True
+
+    def trim(self, reserve=0):
+        """
+        Выгружает давно не использованные модели сверх лимита количества
+        и при нехватке памяти. reserve - места под загружаемые модели.
+        При нехватке памяти модели выгружаются по одной, пока память не
+        освободится; если выгрузка не дала памяти (ее занимают не модели),
+        остальные модели не трогаются.
+        """
+        with self.lock:
+            loaded = sorted((e.last_used, k) for k, e in self.entries.items()
+                            if e.state == ST_READY and not e.pins)
+            over = len([e for e in self.entries.values() if e.state == ST_READY]) + reserve - self.max_models
+        for _, key in loaded:
+            if over > 0:
+                if self.evict(key):
+                    over -= 1
+                continue
+            ram, vram = _free_memory_mb()
+            if not _memory_low(ram, vram):
+                break
+            if not self.evict(key):
+                continue
+            new_ram, new_vram = _free_memory_mb()
+            logger.info(f"Мало свободной памяти: RAM {ram} -> {new_ram} МБ, VRAM {vram} -> {new_vram} МБ")
+            if not (_freed(ram, new_ram) or _freed(vram, new_vram)):
+                break
+
+
+_instance = None
+
+
+def get_model_registry():
+    """Общий экземпляр реестра (создается при первом обращении)"""
+    global _instance
+    if _instance is None:
+        _instance = ModelRegistry()
+    return _instance
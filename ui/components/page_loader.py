@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Файл: ui/components/page_loader.py
+Описание: Общий загрузчик страниц. Декодирует QImage в пуле потоков,
+передаёт результаты в GUI пакетами (не чаще раза в кадр) и создаёт
+QPixmap только в GUI-потоке.
+"""
+
+import os
+import logging
+import threading
+
+from PySide6.QtCore import QObject, Signal, QTimer
+from PySide6.QtGui import QPixmap, QImageReader
+from PySide6.QtWidgets import QApplication
+
+logger = logging.getLogger(__name__)
+
+FRAME_MS = 16
+
+
+def get_load_order(total, priority_index, neighbours=3):
+    """
+    Порядок загрузки: приоритетная страница, затем соседние (±neighbours),
+    затем все остальные по порядку
+    """
+    if total <= 0:
+        return []
+    priority_index = max(0, min(priority_index, total - 1))
+    load_order = [priority_index]
+
+    for offset in range(1, neighbours + 1):
+        if priority_index + offset < total:
+            load_order.append(priority_index + offset)
+        if priority_index - offset >= 0:
+            load_order.append(priority_index - offset)
+
+    seen = set(load_order)
+    load_order.extend(i for i in range(total) if i not in seen)
+    return load_order
+
+
+def decode_image(path):
+    """Декодирование файла в QImage (безопасно для рабочих потоков)"""
+    reader = QImageReader(path)
+    reader.setAutoTransform(True)
+    img = reader.read()
+    if img.isNull():
+        logger.error(f"Ошибка загрузки {path}: {reader.errorString()}")
+    return img
+
+
+class PageLoader(QObject):
+    """
+    Загрузчик страниц с приоритетным порядком, многопоточным декодированием
+    и отменой. Рабочие потоки создают только QImage, пакет готовых страниц
+    забирается таймером в GUI-потоке и отдаётся в порядке приоритета.
+    """
+    image_loaded = Signal(int, QPixmap, str)  # индекс, изображение, имя файла
+    loading_progress = Signal(int, int, str)  # загружено, всего, имя файла
+    loading_complete = Signal()
+    loading_cancelled = Signal()
+
+    _results_ready = Signal()  # внутренний: из рабочих потоков в GUI
+
+    # Событие, отправляемое активному окну после загрузки всех страниц
+    all_loaded_event = None
+
+    def __init__(self, image_paths, thread_pool):
+        super().__init__()
+        self.image_paths = image_paths
+        self.thread_pool = thread_pool
+        self.cancel_loading = False
+        self.loaded_count = 0
+        self.total_count = len(image_paths) if image_paths else 0
+
+        self._lock = threading.Lock()
+        self._ready = []  # (ранг, индекс, QImage, имя файла)
+        self._rank = {}
+        self._futures = []
+        self._processed = 0
+        self._finished = False
+
+        self._flush_timer = QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.setInterval(FRAME_MS)
+        self._flush_timer.timeout.connect(self._flush)
+        self._results_ready.connect(self._schedule_flush)
+
+    def start_loading(self, priority_index=0):
+        """Запуск загрузки, priority_index загружается первым"""
+        load_order = get_load_order(len(self.image_paths), priority_index)
+
+        self.cancel_loading = False
+        self.loaded_count = 0
+        self._processed = 0
+        self._finished = False
+        self.total_count = len(load_order)
+        self._rank = {idx: rank for rank, idx in enumerate(load_order)}
+        self.loading_progress.emit(0, self.total_count, "")
+
+        if not load_order:
+            self._finish()
+            return
+
+        # Пул берёт задачи по порядку отправки, поэтому приоритет сохраняется
+        self._futures = [self.thread_pool.submit(self._decode, idx) for idx in load_order]
+
+    def _decode(self, idx):
+        """Декодирование одной страницы (рабочий поток)"""
+        if self.cancel_loading:
+            return
+        path = self.image_paths[idx]
+        img = None
+        try:
+            img = decode_image(path)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки изображения {idx}: {str(e)}")
+
+        with self._lock:
+            was_empty = not self._ready
+            self._ready.append((self._rank.get(idx, idx), idx, img, os.path.basename(path)))
+        if was_empty and not self.cancel_loading:
+            self._results_ready.emit()
+
+    def _schedule_flush(self):
+        """Планирует выдачу пакета на ближайший кадр"""
+        if not self._flush_timer.isActive():
+            self._flush_timer.start()
+
+    def _flush(self):
+        """Выдача накопленных страниц в GUI-потоке"""
+        with self._lock:
+            batch, self._ready = self._ready, []
+        if self.cancel_loading or not batch:
+            return
+
+        batch.sort(key=lambda item: item[0])
+        last_file = ""
+        for _, idx, img, current_file in batch:
+            self._processed += 1
+            if img is None or img.isNull():
+                continue
+            self._emit_image(idx, img, current_file)
+            self.loaded_count += 1
+            last_file = current_file
+
+        self._emit_progress(self.loaded_count, self.total_count, last_file)
+
+        if self._processed >= self.total_count:
+            self._finish()
+
+    def _finish(self):
+        """Завершение загрузки"""
+        if self._finished:
+            return
+        self._finished = True
+        self._emit_complete()
+        app = QApplication.instance()
+        if self.all_loaded_event is not None and app and app.activeWindow():
+            QApplication.postEvent(app.activeWindow(), self.all_loaded_event())
+
+    # Точки расширения для загрузчиков с другими именами сигналов
+    def _emit_image(self, idx, img, current_file):
+        self.image_loaded.emit(idx, QPixmap.fromImage(img), current_file)
+
+    def _emit_progress(self, loaded, total, current_file):
+        self.loading_progress.emit(loaded, total, current_file)
+
+    def _emit_complete(self):
+        self.loading_complete.emit()
+
+    def _emit_cancelled(self):
+        self.loading_cancelled.emit()
+
+    def cancel(self):
+        """Отмена загрузки изображений"""
+        self.cancel_loading = True
+        for future in self._futures:
+            future.cancel()
+        self._flush_timer.stop()
+        with self._lock:
+            self._ready = []
+        logger.debug("Загрузка изображений отменена")
+        if not self._finished:
+            self._finished = True
+            self._emit_cancelled()
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Файл: ui/components/stage_timer.py
+Описание: Сбор времени выполнения этапов обработки (инференс, конвертации,
+GUI) с перцентилями и экспортом в JSON.
+"""
+
+import os
+import json
+import math
+import time
+import logging
+import threading
+import functools
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних замеров хранится на этап
+MAX_SAMPLES = 5000
+PERCENTILES = (50, 90, 99)
+
+
+def _percentile(sorted_vals, p):
+    """Перцентиль по ближайшему рангу"""
+    if not sorted_vals:
+        return 0.0
+    k = max(0, math.ceil(p * len(sorted_vals) / 100) - 1)
+    return sorted_vals[min(k, len(sorted_vals) - 1)]
+
+
+class _Span:
+    __slots__ = ("timer", "stage", "items", "start")
+
+    def __init__(self, timer, stage, items):
+        self.timer = timer
+        self.stage = stage
+        self.items = items
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.timer.add(self.stage, time.perf_counter() - self.start, self.items)
+        return False
+
+
+class StageTimer:
+    """
+    Потокобезопасный сборщик замеров по этапам. Замер - длительность вызова
+    и число обработанных элементов (страниц, окон), чтобы считать время на элемент.
+    """
+
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self.max_samples = max_samples
+        self.enabled = True
+        self.lock = threading.Lock()
+        self.samples = {}  # этап -> deque[(секунды, элементов)]
+        self.started = time.time()
+
+    def measure(self, stage, items=1):
+        """Контекстный менеджер замера: with timer.measure('clean.lama', len(batch)): ..."""
+        return _Span(self, stage, items)
+
+    def add(self, stage, seconds, items=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            buf = self.samples.get(stage)
+            if buf is None:
+                buf = self.samples[stage] = deque(maxlen=self.max_samples)
+            buf.append((seconds, items))
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.started = time.time()
+
+    def summary(self):
+        """{этап: {count, items, total, mean, per_item, p50, p90, p99, max}} (секунды)"""
+        with self.lock:
+            snapshot = {stage: list(buf) for stage, buf in self.samples.items()}
+        result = {}
+        for stage, samples in snapshot.items():
+            durations = sorted(s for s, _ in samples)
+            total = sum(durations)
+            items = sum(n for _, n in samples)
+            stats = {
+                "count": len(durations),
+                "items": items,
+                "total": total,
+                "mean": total / len(durations),
+                "per_item": total / items if items else 0.0,
+                "max": durations[-1],
+            }
+            for p in PERCENTILES:
+                stats[f"p{p}"] = _percentile(durations, p)
+            result[stage] = stats
+        return result
+
+    def export_json(self, path, meta=None):
+        """Атомарная запись сводки в JSON; возвращает путь или None при ошибке"""
+        data = {
+            "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+            "finished": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "meta": meta or {},
+            "stages": self.summary(),
+        }
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=4)
+            os.replace(tmp, path)
+            return path
+        except Exception as e:
+            logger.error(f"Ошибка экспорта замеров {path}: {e}")
+            return None
+
+    def report(self):
+        """Текстовая таблица сводки (для логов и консоли)"""
+        rows = sorted(self.summary().items(), key=lambda kv: -kv[1]["total"])
+        lines = [f"{'этап':<20}{'вызовов':>8}{'всего, с':>10}{'p50, мс':>9}{'p90, мс':>9}{'p99, мс':>9}"]
+        for stage, st in rows:
+            lines.append(f"{stage:<20}{st['count']:>8}{st['total']:>10.2f}"
+                         f"{st['p50'] * 1000:>9.1f}{st['p90'] * 1000:>9.1f}{st['p99'] * 1000:>9.1f}")
+        return "\n".join(lines)
+
+
+_instance = None
+
+
+def get_stage_timer():
+    """Общий экземпляр сборщика"""
+    global _instance
+    if _instance is None:
+        _instance = StageTimer()
+    return _instance
+
+
+def timed(stage):
+    """Декоратор: замер каждого вызова функции в общем сборщике"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with get_stage_timer().measure(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Файл: ui/components/thumb_cache.py
+Описание: Общий дисковый кэш миниатюр для панелей предпросмотра всех этапов.
+"""
+
+import os
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import shiboken6
+from PySide6.QtCore import Qt, QObject, Signal
+from PySide6.QtGui import QImage, QPixmap, QImageWriter
+
+from ui.components.image_decode import read_scaled_image
+
+logger = logging.getLogger(__name__)
+
+THUMB_W, THUMB_H = 150, 300
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".manga_localizer_cache", "thumbs")
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Версия формата миниатюр (смена инвалидирует весь кэш)
+CACHE_VER = 1
+
+
+def _source_signature(path):
+    """Сигнатура исходника: абсолютный путь, размер и время изменения"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+
+
+class ThumbCache(QObject):
+    """
+    Кэш миниатюр на диске. Ключ — хэш сигнатуры исходного файла и размера,
+    поэтому изменённый файл автоматически получает новую миниатюру.
+    Генерация выполняется в фоновом пуле, готовые миниатюры
+    доставляются в GUI через сигнал.
+    """
+    thumb_ready = Signal(str, QImage)  # ключ, миниатюра
+
+    def __init__(self, cache_dir=CACHE_DIR, max_workers=None, parent=None):
+        super().__init__(parent)
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        fmts = [bytes(f).decode().lower() for f in QImageWriter.supportedImageFormats()]
+        self.ext = "webp" if "webp" in fmts else "png"
+
+        workers = max_workers or min(4, os.cpu_count() or 2)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbs")
+        self.lock = threading.Lock()
+        self.pending = set()  # ключи в работе
+        self.waiting = {}  # ключ -> список QLabel (проверяются shiboken6.isValid перед выдачей)
+
+        self.thumb_ready.connect(self._on_thumb_ready)
+        self.pool.submit(self.prune)
+
+    def thumb_key(self, path, w=THUMB_W, h=THUMB_H):
+        """Ключ миниатюры или None, если файл недоступен"""
+        sig = _source_signature(path)
+        if sig is None:
+            return None
+        return hashlib.sha1(f"{sig}|{w}x{h}|v{CACHE_VER}".encode("utf-8")).hexdigest()
+
+    def _cache_file(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.{self.ext}")
+
+    def get(self, path, w=THUMB_W, h=THUMB_H):
+        """Возвращает миниатюру из кэша (QPixmap) или None"""
+        key = self.thumb_key(path, w, h)
+        if key is None:
+            return None
+        cache_file = self._cache_file(key)
+        if not os.path.exists(cache_file):
+            return None
+        pm = QPixmap(cache_file)
+        return None if pm.isNull() else pm
+
+    def request(self, path, w=THUMB_W, h=THUMB_H):
+        """Ставит генерацию миниатюры в фоновый пул, возвращает ключ"""
+        key = self.thumb_key(path, w, h)
+        if key is None:
+            return None
+        with self.lock:
+            if key in self.pending:
+                return key
+            self.pending.add(key)
+        self.pool.submit(self._generate, path, w, h, key)
+        return key
+
+    def set_label_thumb(self, label, path, w=THUMB_W, h=THUMB_H):
+        """
+        Устанавливает миниатюру в QLabel: сразу из кэша, если есть,
+        иначе после фоновой генерации. Возвращает True при попадании в кэш.
+        """
+        pm = self.get(path, w, h)
+        if pm is not None:
+            label.setPixmap(pm)
+            return True
+        key = self.request(path, w, h)
+        if key is not None:
+            self._forget(label)
+            self.waiting.setdefault(key, []).append(label)
+        return False
+
+    def set_label_pixmap(self, label, path, img, w=THUMB_W, h=THUMB_H):
+        """
+        Устанавливает миниатюру в QLabel из уже загруженной страницы
+        (без повторного чтения с диска). Отложенная выдача из пула для
+        этого QLabel отменяется, чтобы не затереть более свежую картинку.
+        """
+        pm = self.store(path, img, w, h)
+        if pm is None:
+            return False
+        self._forget(label)
+        label.setPixmap(pm)
+        return True
+
+    def store(self, path, img, w=THUMB_W, h=THUMB_H):
+        """Сохраняет миниатюру из уже загруженного изображения (QImage/QPixmap), запись — в пуле"""
+        key = self.thumb_key(path, w, h)
+        if key is None or img is None or img.isNull():
+            return None
+        if isinstance(img, QPixmap):
+            img = img.toImage()
+        thumb = img.scaled(w, h, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        self.pool.submit(self._write, key, thumb)
+        return QPixmap.fromImage(thumb)
+
+    def _forget(self, label):
+        """Убирает QLabel из всех очередей ожидания (и удалённые виджеты заодно)"""
+        for key in list(self.waiting):
+            labels = [lbl for lbl in self.waiting[key] if lbl is not label and shiboken6.isValid(lbl)]
+            if labels:
+                self.waiting[key] = labels
+            else:
+                del self.waiting[key]
+
+    def _write(self, key, thumb):
+        """Атомарная запись миниатюры в кэш"""
+        cache_file = self._cache_file(key)
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp = f"{cache_file}.{threading.get_ident()}.tmp"
+        if thumb.save(tmp, self.ext.upper()):
+            os.replace(tmp, cache_file)
+        else:
+            logger.warning(f"Не удалось сохранить миниатюру {cache_file}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _generate(self, path, w, h, key):
+        """Генерация миниатюры (выполняется в пуле)"""
+        try:
+            thumb = read_scaled_image(path, w, h)
+            if thumb.isNull():
+                logger.warning(f"Не удалось загрузить {path} для миниатюры")
+            else:
+                self._write(key, thumb)
+        except Exception as e:
+            logger.error(f"Ошибка генерации миниатюры {path}: {e}")
+            thumb = QImage()
+        finally:
+            with self.lock:
+                self.pending.discard(key)
+        # Пустая миниатюра тоже отправляется, чтобы снять ожидающих
+        self.thumb_ready.emit(key, thumb)
+
+    def _on_thumb_ready(self, key, thumb):
+        """Раздача готовой миниатюры ожидающим QLabel (GUI-поток)"""
+        labels = self.waiting.pop(key, [])
+        if not labels or thumb.isNull():
+            return
+        pm = QPixmap.fromImage(thumb)
+        for label in labels:
+            # Панель могла быть пересоздана, пока миниатюра генерировалась
+            if shiboken6.isValid(label):
+                label.setPixmap(pm)
+
+    def prune(self, max_bytes=CACHE_MAX_BYTES):
+        """Удаляет самые старые миниатюры при превышении лимита"""
+        try:
+            entries = []
+            total = 0
+            for root, _, files in os.walk(self.cache_dir):
+                for f in files:
+                    fp = os.path.join(root, f)
+                    try:
+                        st = os.stat(fp)
+                    except OSError:
+                        continue
+                    entries.append((st.st_atime, st.st_size, fp))
+                    total += st.st_size
+            if total <= max_bytes:
+                return
+            entries.sort()
+            for _, size, fp in entries:
+                if total <= max_bytes:
+                    break
+                try:
+                    os.remove(fp)
+                    total -= size
+                except OSError:
+                    pass
+            logger.info(f"Кэш миниатюр очищен до {total // (1024 * 1024)} МБ")
+        except Exception as e:
+            logger.error(f"Ошибка очистки кэша миниатюр: {e}")
+
+
+_instance = None
+
+
+def get_thumb_cache():
+    """Общий экземпляр кэша (создаётся в GUI-потоке при первом обращении)"""
+    global _instance
+    if _instance is None:
+        _instance = ThumbCache()
+    return _instance
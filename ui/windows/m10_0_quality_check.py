@@ -19,6 +19,7 @@ from PySide6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel, QPushB
 
 # Импортируем наши модули
 from ui.components.gradient_widget import GradientBackgroundWidget
+from ui.components.thumb_cache import get_thumb_cache, THUMB_W, THUMB_H
 from ui.windows.m10_1_image_viewer import ImageViewer
 from ui.windows.m9_2_utils import (get_images_from_folder, show_message, PageChangeSignal)
 from ui.windows.m9_3_ui_components import (ImageLoader, LoadingOverlay,
@@ -870,8 +871,9 @@ class QualityCheckWindow(QDialog):
         self.thumbnail_labels = []
         self.index_labels = []
 
-        thumbnail_width = 150
-        thumbnail_height = thumbnail_width * 2
+        thumbnail_width = THUMB_W
+        thumbnail_height = THUMB_H
+        thumbs = get_thumb_cache()
 
         for i, path in enumerate(self.image_paths):
             thumb_container = QWidget()
@@ -880,14 +882,9 @@ class QualityCheckWindow(QDialog):
             thumb_layout.setSpacing(0)
 
             thumb_label = QLabel()
-            pm = QPixmap(path)
-            if not pm.isNull():
-                scaled_pix = pm.scaled(
-                    thumbnail_width, thumbnail_height,
-                    Qt.KeepAspectRatio, Qt.SmoothTransformation
-                )
-                thumb_label.setPixmap(scaled_pix)
-                thumb_label.setAlignment(Qt.AlignCenter)
+            # Миниатюра из кэша или фоновая генерация
+            thumbs.set_label_thumb(thumb_label, path, thumbnail_width, thumbnail_height)
+            thumb_label.setAlignment(Qt.AlignCenter)
 
             thumb_label.setStyleSheet("""
                 QLabel {
@@ -16,6 +16,7 @@ from PySide6.QtWidgets import (
 )
 
 from ui.components.gradient_widget import GradientBackgroundWidget
+from ui.components.image_decode import load_scaled_pixmap
 from .m1_2_tile_widget import TileWidget
 
 
@@ -990,7 +991,8 @@ class MainWindow(QMainWindow):
                     break
 
             if cover_path:
-                pixmap = QPixmap(cover_path)
+                # Обложка декодируется сразу под максимальный масштаб плитки (x2)
+                pixmap = load_scaled_pixmap(cover_path, 149 * 2, 213 * 2, Qt.KeepAspectRatioByExpanding)
                 if pixmap.isNull():
                     cover_path = None
 
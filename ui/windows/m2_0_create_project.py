@@ -16,6 +16,8 @@ from PySide6.QtWidgets import (
     QCompleter, QListWidget, QListWidgetItem, QMenu, QToolTip
 )
 
+from ui.components.image_decode import load_scaled_pixmap
+
 
 # Функция естественной сортировки строк с числами
 def natural_sort_key(s):
@@ -138,7 +140,7 @@ class ImagePreviewLabel(QLabel):
 
     def set_image(self, image_path):
         """Загрузка и подготовка изображения для предпросмотра"""
-        pixmap = QPixmap(image_path)
+        pixmap = load_scaled_pixmap(image_path, self.width(), self.height(), Qt.KeepAspectRatioByExpanding)
         if not pixmap.isNull():
             self.image_path = image_path
 
@@ -16,6 +16,7 @@ from PySide6.QtWidgets import (
     QGraphicsBlurEffect
 )
 from ui.components.gradient_widget import GradientBackgroundWidget
+from ui.components.image_decode import load_scaled_pixmap
 # from .edit_project.edit_project_window import open_edit_project_window
 
 ##############################################################################
@@ -955,7 +956,7 @@ class ProjectDetailWindow(QWidget):  # Изменено с QMainWindow на QWid
         if folder_name and cover_file:
             path_ = os.path.join(self.project_path, cover_file)
             if os.path.isfile(path_):
-                pm = QPixmap(path_)
+                pm = load_scaled_pixmap(path_, 273, 390, Qt.KeepAspectRatioByExpanding)
             else:
                 pm = QPixmap(273, 390)  # заглушка
                 pm.fill(QColor(60, 60, 90))
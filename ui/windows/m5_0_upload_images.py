@@ -31,6 +31,8 @@ try:
 except ImportError:
     PIL_AVAILABLE = False
 
+from ui.components.image_decode import read_scaled_image
+
 
 ##############################################################################
 # Вспомогательные функции
@@ -237,8 +239,8 @@ class ImageLoaderWorker(QObject):
                     img = QImage(self.target_size, QImage.Format_RGB32)
                     img.fill(Qt.darkGray)
                 else:
-                    # Загружаем картинку
-                    img = QImage(full_path)
+                    # Декодируем сразу в размер миниатюры
+                    img = read_scaled_image(full_path, self.target_size.width(), self.target_size.height())
                     if img.isNull():
                         print(f"[ImageLoaderWorker] Не удалось загрузить {full_path}, формируем заглушку.")
                         img = QImage(self.target_size, QImage.Format_RGB32)
@@ -16,6 +16,7 @@ from PySide6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel, QPushB
 
 # Импортируем наши модули
 from ui.components.gradient_widget import GradientBackgroundWidget
+from ui.components.thumb_cache import get_thumb_cache, THUMB_W, THUMB_H
 from ui.windows.m6_1_image_viewer import ImageViewer
 from ui.windows.m6_2_enhancement import EnhancementWorker
 from ui.windows.m6_3_utils import (get_images_from_folder, prepare_images_and_folders,
@@ -25,6 +26,7 @@ from ui.windows.m6_3_utils import (get_images_from_folder, prepare_images_and_fo
                                    get_folder_state, sync_enhanced_images, copy_images)
 from ui.windows.m6_4_ui_components import (ImageLoader, LoadingOverlay,
                                            ImageLoadedEvent, AllImagesLoadedEvent)
+from ui.windows.m6_5_save_result import SaveWorker
 
 # Настройка логгера
 logging.basicConfig(
@@ -126,6 +128,7 @@ class PreprocessingWindow(QDialog):
         self._closing = False
         # Активный воркер
         self.enhancement_worker = None
+        self.save_worker = None
         self.active_timers = []
         self.scale_warning_shown = False
 
@@ -435,7 +438,7 @@ class PreprocessingWindow(QDialog):
         has_enhanced = check_enhanced_availability(self.image_paths, self.enhanced_folder)
 
         if hasattr(self, 'enhanced_radio'):
-            self.enhanced_radio.setEnabled(has_enhanced)
+            self._set_enhanced_available(has_enhanced)
 
         # Сигнализируем о завершении загрузки
         if self.is_loading_complete:
@@ -464,12 +467,9 @@ class PreprocessingWindow(QDialog):
             if self.viewer.current_page == idx:
                 self.viewer.displayCurrentPage()
 
-            # Обновляем миниатюру
+            # Миниатюра из уже загруженной страницы, без повторного чтения файла
             if self.preview_scroll_area and 0 <= idx < len(self.thumbnail_labels):
-                tw = 150
-                th = tw * 2
-                scaled_pix = pixmap.scaled(tw, th, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                self.thumbnail_labels[idx].setPixmap(scaled_pix)
+                get_thumb_cache().set_label_pixmap(self.thumbnail_labels[idx], self.image_paths[idx], pixmap)
 
         # Отправляем событие загрузки изображения
         QApplication.postEvent(self, ImageLoadedEvent(idx))
@@ -654,8 +654,9 @@ class PreprocessingWindow(QDialog):
         self.thumbnail_labels = []
         self.index_labels = []
 
-        thumbnail_width = 150
-        thumbnail_height = thumbnail_width * 2
+        thumbnail_width = THUMB_W
+        thumbnail_height = THUMB_H
+        thumbs = get_thumb_cache()
 
         # Создаем миниатюры для каждого изображения
         for i, path in enumerate(self.image_paths):
@@ -666,14 +667,9 @@ class PreprocessingWindow(QDialog):
 
             # Миниатюра изображения
             thumb_label = QLabel()
-            pm = QPixmap(path)
-            if not pm.isNull():
-                scaled_pix = pm.scaled(
-                    thumbnail_width, thumbnail_height,
-                    Qt.KeepAspectRatio, Qt.SmoothTransformation
-                )
-                thumb_label.setPixmap(scaled_pix)
-                thumb_label.setAlignment(Qt.AlignCenter)
+            # Миниатюра из кэша или фоновая генерация
+            thumbs.set_label_thumb(thumb_label, path, thumbnail_width, thumbnail_height)
+            thumb_label.setAlignment(Qt.AlignCenter)
 
             thumb_label.setStyleSheet("""
                 QLabel {
@@ -857,7 +853,7 @@ class PreprocessingWindow(QDialog):
 
         # Включаем опцию Улучшенное если есть хоть одно улучшенное изображение
         if has_any_enhanced:
-            self.enhanced_radio.setEnabled(True)
+            self._set_enhanced_available(True)
 
         # Обновляем информацию о проекте
         self.update_project_info()
@@ -1020,8 +1016,9 @@ class PreprocessingWindow(QDialog):
         # Создаем новые миниатюры
         container_layout = self.preview_scroll_area.widget().layout()
 
-        thumbnail_width = 150
-        thumbnail_height = thumbnail_width * 2
+        thumbnail_width = THUMB_W
+        thumbnail_height = THUMB_H
+        thumbs = get_thumb_cache()
 
         for i, path in enumerate(self.image_paths):
             thumb_container = QWidget()
@@ -1031,14 +1028,9 @@ class PreprocessingWindow(QDialog):
 
             # Миниатюра изображения
             thumb_label = QLabel()
-            pm = QPixmap(path)
-            if not pm.isNull():
-                scaled_pix = pm.scaled(
-                    thumbnail_width, thumbnail_height,
-                    Qt.KeepAspectRatio, Qt.SmoothTransformation
-                )
-                thumb_label.setPixmap(scaled_pix)
-                thumb_label.setAlignment(Qt.AlignCenter)
+            # Миниатюра из кэша или фоновая генерация
+            thumbs.set_label_thumb(thumb_label, path, thumbnail_width, thumbnail_height)
+            thumb_label.setAlignment(Qt.AlignCenter)
 
             thumb_label.setStyleSheet("""
                 QLabel {
@@ -1152,22 +1144,28 @@ class PreprocessingWindow(QDialog):
         self.image_type_group = QButtonGroup(self)
         self.original_radio = QRadioButton("Оригинал")
         self.enhanced_radio = QRadioButton("Улучшенное")
+        self.compare_radio = QRadioButton("Сравнение")
+        self.compare_radio.setToolTip("Оригинал слева, улучшенное справа. Линию можно перетаскивать.")
 
         self.original_radio.setStyleSheet("color: white;")
         self.enhanced_radio.setStyleSheet("color: white;")
+        self.compare_radio.setStyleSheet("color: white;")
 
         self.original_radio.setChecked(True)
         self.image_type_group.addButton(self.original_radio)
         self.image_type_group.addButton(self.enhanced_radio)
+        self.image_type_group.addButton(self.compare_radio)
 
         has_enhanced = check_enhanced_availability(self.image_paths, self.enhanced_folder)
-        self.enhanced_radio.setEnabled(has_enhanced)
+        self._set_enhanced_available(has_enhanced)
 
         self.original_radio.toggled.connect(self.onImageTypeChanged)
         self.enhanced_radio.toggled.connect(self.onImageTypeChanged)
+        self.compare_radio.toggled.connect(self.onImageTypeChanged)
 
         image_type_layout.addWidget(self.original_radio)
         image_type_layout.addWidget(self.enhanced_radio)
+        image_type_layout.addWidget(self.compare_radio)
         image_type_group.setLayout(image_type_layout)
         right_layout.addWidget(image_type_group)
 
@@ -1497,6 +1495,13 @@ class PreprocessingWindow(QDialog):
 
         # Обновляем информацию о проекте
         self.update_project_info()
+    def _set_enhanced_available(self, available):
+        """Доступность режимов Улучшенное и Сравнение (без улучшенных - возврат к оригиналу)"""
+        self.enhanced_radio.setEnabled(available)
+        self.compare_radio.setEnabled(available)
+        if not available and not self.original_radio.isChecked():
+            self.original_radio.setChecked(True)
+
     def onImageTypeChanged(self, checked):
         """Обработчик изменения типа изображения"""
         if not checked:
@@ -1506,14 +1511,15 @@ class PreprocessingWindow(QDialog):
         if not btn:
             return
 
-        if btn.text() == "Оригинал":
-            self.viewer.set_enhanced(False)
-            self.show_enhanced = False
-            logger.debug("Переключение на ОРИГИНАЛ")
-        else:
-            self.viewer.set_enhanced(True)
-            self.show_enhanced = True
-            logger.debug("Переключение на УЛУЧШЕННОЕ")
+        if btn is self.compare_radio:
+            self.viewer.set_view_mode(self.show_enhanced, True)
+            logger.debug("Переключение на СРАВНЕНИЕ")
+            return
+
+        # Один вызов: выход из сравнения и смена режима - одна перерисовка
+        self.show_enhanced = btn is self.enhanced_radio
+        self.viewer.set_view_mode(self.show_enhanced, False)
+        logger.debug(f"Переключение на {'УЛУЧШЕННОЕ' if self.show_enhanced else 'ОРИГИНАЛ'}")
 
         # Обновляем информацию о проекте
         self.update_project_info()
@@ -1791,13 +1797,12 @@ class PreprocessingWindow(QDialog):
 
                 if not has_more_enhanced:
                     # Если это было последнее улучшенное изображение
-                    self.enhanced_radio.setEnabled(False)
-                    self.original_radio.setChecked(True)
-                    self.viewer.set_enhanced(False)
+                    self._set_enhanced_available(False)
+                    self.viewer.set_view_mode(False, False)
                     self.show_enhanced = False
                 else:
-                    # Если текущий режим - показ улучшенных, переключаемся на оригинал для этой страницы
-                    if self.show_enhanced:
+                    # В режимах улучшенного и сравнения страница показывается заново (уже как оригинал)
+                    if self.show_enhanced or self.viewer.compare_mode:
                         self.viewer.displayCurrentPage()
 
                 # Обновляем информацию
@@ -1823,9 +1828,8 @@ class PreprocessingWindow(QDialog):
             count = delete_all_enhanced(self.enhanced_folder)
 
             # Обновляем интерфейс
-            self.enhanced_radio.setEnabled(False)
-            self.original_radio.setChecked(True)
-            self.viewer.set_enhanced(False)
+            self._set_enhanced_available(False)
+            self.viewer.set_view_mode(False, False)
             self.show_enhanced = False
 
             # Обновляем информацию
@@ -1955,9 +1959,9 @@ class PreprocessingWindow(QDialog):
         self.viewer.updateImages()
 
         # Включаем опцию "Улучшенное" и переключаемся на нее
-        self.enhanced_radio.setEnabled(True)
+        self._set_enhanced_available(True)
         self.enhanced_radio.setChecked(True)
-        self.viewer.set_enhanced(True)
+        self.viewer.set_view_mode(True, False)
         self.show_enhanced = True
 
         # Статус "В работе"
@@ -1987,9 +1991,9 @@ class PreprocessingWindow(QDialog):
         self.viewer.updateImages()
 
         # Включаем опцию "Улучшенное" и переключаемся на нее
-        self.enhanced_radio.setEnabled(True)
+        self._set_enhanced_available(True)
         self.enhanced_radio.setChecked(True)
-        self.viewer.set_enhanced(True)
+        self.viewer.set_view_mode(True, False)
         self.show_enhanced = True
 
         # Статус "В работе"
@@ -2067,9 +2071,9 @@ class PreprocessingWindow(QDialog):
         self.viewer.updateImages()
 
         # Включаем опцию "Улучшенное" и переключаемся на нее
-        self.enhanced_radio.setEnabled(True)
+        self._set_enhanced_available(True)
         self.enhanced_radio.setChecked(True)
-        self.viewer.set_enhanced(True)
+        self.viewer.set_view_mode(True, False)
         self.show_enhanced = True
 
         # Статус "В работе"
@@ -2167,23 +2171,13 @@ class PreprocessingWindow(QDialog):
         QApplication.processEvents()
 
     def saveResult(self):
-        """Сохранение результата обработки в папку Save"""
+        """Сохранение результата обработки в папку Save (в фоне)"""
         # Блокируем интерфейс во время операции
         self.lockInterface("Сохранение результата")
+        self.enh_btn.setEnabled(False)
 
         try:
-            # Создаем папку Save
             save_folder = os.path.join(self.ch_paths["preproc"], "Save")
-            os.makedirs(save_folder, exist_ok=True)
-
-            # Очищаем папку Save
-            for file in os.listdir(save_folder):
-                file_path = os.path.join(save_folder, file)
-                if os.path.isfile(file_path):
-                    try:
-                        os.remove(file_path)
-                    except Exception as e:
-                        logger.error(f"Ошибка при удалении файла {file_path}: {e}")
 
             # Проверяем наличие файлов
             files = [f for f in os.listdir(self.originals_folder) if
@@ -2192,10 +2186,11 @@ class PreprocessingWindow(QDialog):
 
             if not files:
                 show_message(self, "Предупреждение", "Нет файлов для сохранения!")
+                self.unlockInterface()
                 return
 
-            # Подсчитываем улучшенные изображения
-            enhanced_count = 0
+            # Формируем задания: улучшенное, если есть, иначе оригинал
+            jobs = []
             missing_enhanced = []
 
             for f in files:
@@ -2204,15 +2199,17 @@ class PreprocessingWindow(QDialog):
                 enh_file = f"{base}_enhanced{ext}"
                 enh_path = os.path.join(self.enhanced_folder, enh_file)
 
+                # Путь назначения в папке Save (без суффикса _enhanced)
                 if os.path.exists(enh_path):
-                    enhanced_count += 1
+                    jobs.append((enh_path, f, True))
                 else:
+                    jobs.append((os.path.join(self.originals_folder, f), f, False))
                     missing_enhanced.append(f)
 
             # Если не все изображения улучшены - показываем предупреждение
             if missing_enhanced:
                 message = f"Внимание! Не все изображения были улучшены.\n\n"
-                message += f"Улучшено: {enhanced_count} из {len(files)}\n"
+                message += f"Улучшено: {len(files) - len(missing_enhanced)} из {len(files)}\n"
                 message += f"Будут сохранены оригиналы для {len(missing_enhanced)} изображений."
 
                 msg = QMessageBox(self)
@@ -2222,78 +2219,75 @@ class PreprocessingWindow(QDialog):
                 msg.setStandardButtons(QMessageBox.Ok)
                 msg.exec()
 
-            # Копируем файлы согласно алгоритму
-            copied_count = 0
-            errors = []
+            # Показываем прогресс-бар
+            self.enh_prog.setVisible(True)
+            self.enh_prog.setValue(0)
 
-            for f in files:
-                base = os.path.splitext(f)[0]
-                ext = os.path.splitext(f)[1]
-
-                # Проверяем наличие улучшенного изображения
-                enh_file = f"{base}_enhanced{ext}"
-                enh_path = os.path.join(self.enhanced_folder, enh_file)
-
-                # Путь назначения в папке Save (без суффикса _enhanced)
-                dst_path = os.path.join(save_folder, f)
-
-                try:
-                    if os.path.exists(enh_path):
-                        # Если есть улучшенное - копируем его
-                        import shutil
-                        shutil.copy2(enh_path, dst_path)
-                        logger.debug(f"Скопировано улучшенное: {enh_file} -> {f}")
-                    else:
-                        # Если нет улучшенного - копируем оригинал
-                        src_path = os.path.join(self.originals_folder, f)
-                        import shutil
-                        shutil.copy2(src_path, dst_path)
-                        logger.debug(f"Скопирован оригинал: {f}")
-
-                    copied_count += 1
-
-                except Exception as e:
-                    error_msg = f"Ошибка при копировании {f}: {e}"
-                    logger.error(error_msg)
-                    errors.append(error_msg)
-
-            # Статус "Завершен"
-            self.status_done.setChecked(True)
-            self.onStatusChanged()
-
-            # Показываем результат
-            if errors:
-                error_text = "\n".join(errors[:5])  # Показываем первые 5 ошибок
-                show_message(
-                    self, "Сохранение завершено с ошибками",
-                    f"Сохранено {copied_count} из {len(files)} файлов.\n\nОшибки:\n{error_text}",
-                    QMessageBox.Warning
-                )
-            else:
-                show_message(
-                    self, "Готово",
-                    f"Результат успешно сохранен в папку Save!\n"
-                    f"Сохранено файлов: {copied_count}\n"
-                    f"Из них улучшенных: {enhanced_count}"
-                )
+            worker = SaveWorker(jobs, save_folder)
+            worker.signals.progress.connect(self._updateSaveProgress)
+            worker.signals.finished.connect(self._onSaveFinished)
+            worker.signals.error.connect(self._onSaveError)
+            self.save_worker = worker
+            self.q_thread_pool.start(worker)
 
         except Exception as e:
             show_message(self, "Ошибка", f"Произошла ошибка при сохранении результата: {str(e)}", QMessageBox.Critical)
-        finally:
-            # Разблокируем интерфейс
             self.unlockInterface()
 
+    def _updateSaveProgress(self, done, total, current_file):
+        """Обновление прогресса сохранения"""
+        if total > 0:
+            self.enh_prog.setValue(int(done * 100 / total))
+
+    def _onSaveFinished(self, stats):
+        """Обработка завершения сохранения"""
+        self.save_worker = None
+        self.enh_prog.setValue(100)
+        self._createDelayedAction(3000, lambda: self.enh_prog.setVisible(False) if hasattr(self,
+                                                                                           'enh_prog') and self.enh_prog else None)
+
+        # Статус "Завершен"
+        self.status_done.setChecked(True)
+        self.onStatusChanged()
+        self.unlockInterface()
+
+        # Показываем результат
+        errors = stats["errors"]
+        if errors:
+            error_text = "\n".join(errors[:5])  # Показываем первые 5 ошибок
+            show_message(
+                self, "Сохранение завершено с ошибками",
+                f"Сохранено {stats['saved']} из {stats['total']} файлов.\n\nОшибки:\n{error_text}",
+                QMessageBox.Warning
+            )
+        else:
+            show_message(
+                self, "Готово",
+                f"Результат успешно сохранен в папку Save!\n"
+                f"Сохранено файлов: {stats['saved']} (без изменений: {stats['skipped']})\n"
+                f"Из них улучшенных: {stats['enhanced']}"
+            )
+
+    def _onSaveError(self, error_msg):
+        """Обработка ошибки сохранения"""
+        self.save_worker = None
+        self.enh_prog.setVisible(False)
+        self.unlockInterface()
+        show_message(self, "Ошибка", f"Произошла ошибка при сохранении результата: {error_msg}", QMessageBox.Critical)
+
     def keyPressEvent(self, event):
         """Обработчик нажатий клавиш"""
         if event.key() == Qt.Key_Space:
             # Переключение между оригиналом и улучшенным
             self.show_enhanced = not self.show_enhanced
+            if self.show_enhanced and not self.enhanced_radio.isEnabled():
+                self.show_enhanced = False
             if self.show_enhanced:
                 self.enhanced_radio.setChecked(True)
             else:
                 self.original_radio.setChecked(True)
 
-            self.viewer.set_enhanced(self.show_enhanced)
+            self.viewer.set_view_mode(self.show_enhanced, False)
             state = "Улучшенное" if self.show_enhanced else "Оригинал"
             logger.debug(f"Переключено на {state}.")
 
@@ -2382,6 +2376,21 @@ class PreprocessingWindow(QDialog):
             self.image_loader.cancel()
             QApplication.processEvents()
 
+        # Сохранение результата: оставшиеся файлы не копируются, сигналы в закрытое окно не идут
+        if getattr(self, 'save_worker', None) is not None:
+            self.save_worker.cancel()
+            for signal in (self.save_worker.signals.progress, self.save_worker.signals.finished,
+                           self.save_worker.signals.error):
+                try:
+                    signal.disconnect()
+                except (RuntimeError, TypeError):
+                    pass
+            self.save_worker = None
+
+        # Фоновое построение уровней детализации
+        if hasattr(self, 'viewer') and self.viewer:
+            self.viewer.mip_pool.shutdown(wait=False, cancel_futures=True)
+
         # Закрываем пул потоков с ожиданием
         if hasattr(self, 'thread_pool') and self.thread_pool:
             try:
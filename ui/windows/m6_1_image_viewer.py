@@ -3,19 +3,114 @@
 
 import os
 import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from PySide6.QtWidgets import (QGraphicsView, QGraphicsScene, QGraphicsPixmapItem,
-                               QGraphicsTextItem, QGraphicsRectItem)
+                               QGraphicsTextItem, QGraphicsRectItem, QGraphicsItem,
+                               QStyleOptionGraphicsItem)
 from PySide6.QtGui import QPainter, QPixmap, QFont, QColor, QPen, QBrush, QTransform, QCursor
-from PySide6.QtCore import Qt, QRectF, QEvent, QTimer, QPointF
+from PySide6.QtCore import Qt, QRectF, QEvent, QTimer, QPointF, QSizeF, Signal
+
+from ui.components.image_decode import read_image_size
+from ui.components.page_loader import decode_image
 
 logger = logging.getLogger(__name__)
 
+MIPMAP_MIN_SIZE = 256  # Минимальная сторона самого мелкого уровня
+ENH_CACHE_SIZE = 3  # Сколько страниц с уровнями улучшенного держать в памяти
+ORIG_CACHE_SIZE = 3  # То же для уровней оригинала
+
+
+def build_mipmaps(image, min_size=MIPMAP_MIN_SIZE):
+    """
+    Уровни детализации: исходное изображение и его уменьшения в 2, 4, 8... раз.
+    Для QImage безопасно в рабочем потоке.
+    """
+    levels = [image]
+    while levels[-1].width() // 2 >= min_size and levels[-1].height() // 2 >= min_size:
+        prev = levels[-1]
+        levels.append(prev.scaled(prev.width() // 2, prev.height() // 2,
+                                  Qt.IgnoreAspectRatio, Qt.SmoothTransformation))
+    return levels
+
+
+class MipmapCompareItem(QGraphicsItem):
+    """
+    Элемент сцены для улучшенного изображения и режима сравнения.
+    Рисует только видимую часть из уровня детализации, близкого к
+    текущему масштабу, поэтому большой pixmap не пересэмплируется при каждой отрисовке.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)
+        self.logical_size = QSizeF()
+        self.orig_levels = []
+        self.enh_levels = []
+        self.split = None  # None - только улучшенное, иначе доля ширины (0..1)
+
+    def set_images(self, orig_levels, enh_levels, logical_size):
+        """Устанавливает уровни оригинала и улучшенного в координатах оригинала"""
+        self.prepareGeometryChange()
+        self.orig_levels = orig_levels
+        self.enh_levels = enh_levels
+        self.logical_size = QSizeF(logical_size)
+        self.update()
+
+    def set_split(self, split):
+        self.split = None if split is None else max(0.0, min(1.0, split))
+        self.update()
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.logical_size.width(), self.logical_size.height())
+
+    def _pick_level(self, levels, lod):
+        """Самый мелкий уровень, не уступающий требуемому разрешению"""
+        need_w = self.logical_size.width() * lod
+        for pm in reversed(levels):
+            if pm.width() >= need_w:
+                return pm
+        return levels[0]
+
+    def _draw_part(self, painter, levels, rect, lod):
+        if not levels or rect.isEmpty():
+            return
+        pm = self._pick_level(levels, lod)
+        sx = pm.width() / self.logical_size.width()
+        sy = pm.height() / self.logical_size.height()
+        source = QRectF(rect.x() * sx, rect.y() * sy, rect.width() * sx, rect.height() * sy)
+        painter.drawPixmap(rect, pm, source)
+
+    def paint(self, painter, option, widget=None):
+        if self.logical_size.isEmpty():
+            return
+        lod = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        exposed = option.exposedRect.intersected(self.boundingRect())
+
+        if self.split is None:
+            self._draw_part(painter, self.enh_levels, exposed, lod)
+            return
+
+        x = self.logical_size.width() * self.split
+        left = exposed.intersected(QRectF(0, 0, x, self.logical_size.height()))
+        right = exposed.intersected(QRectF(x, 0, self.logical_size.width() - x, self.logical_size.height()))
+        self._draw_part(painter, self.orig_levels, left, lod)
+        self._draw_part(painter, self.enh_levels, right, lod)
+
+        # Линия разделения
+        pen = QPen(QColor(255, 255, 255, 220), 2)
+        pen.setCosmetic(True)
+        painter.setPen(pen)
+        painter.drawLine(QPointF(x, 0), QPointF(x, self.logical_size.height()))
+
 
 class ImageViewer(QGraphicsView):
     """
     Просмотрщик изображений для режима постраничного просмотра.
     Поддерживает отображение оригинальных и улучшенных изображений.
     """
+    # Внутренний: уровни детализации (QImage) построены в фоне
+    _mipmaps_ready = Signal(object, object)  # ключ кэша, [QImage]
 
     def __init__(self, pixmap_paths, output_folder, parent=None):
         super().__init__(parent)
@@ -42,8 +137,19 @@ class ImageViewer(QGraphicsView):
         self.pages = pixmap_paths
         self.current_page = 0
         self.show_enhanced = False
+        self.compare_mode = False
+        self.split_pos = 0.5
+        self.dragging_split = False
         self.scale_factor = 1.0
 
+        # Уровни детализации (LRU): оригиналы по индексу, улучшенные по пути.
+        # Строятся в фоновом потоке, до готовности показывается полный pixmap
+        self.orig_mipmaps = OrderedDict()
+        self.enh_mipmaps = OrderedDict()
+        self.mip_pending = set()
+        self.mip_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mipmaps")
+        self._mipmaps_ready.connect(self._on_mipmaps_ready)
+
         # Смещение для информационных блоков слева
         self.info_width = 240
 
@@ -53,6 +159,12 @@ class ImageViewer(QGraphicsView):
         self.page_pixmap_item.setPos(self.info_width, 0)
         self.scene_.addItem(self.page_pixmap_item)
 
+        # Элемент для улучшенного изображения и режима сравнения
+        self.mip_item = MipmapCompareItem()
+        self.mip_item.setPos(self.info_width, 0)
+        self.mip_item.setVisible(False)
+        self.scene_.addItem(self.mip_item)
+
         # Информационные элементы
         self.info_blocks = []
 
@@ -69,6 +181,7 @@ class ImageViewer(QGraphicsView):
     def reloadOriginalPixmaps(self):
         """Перезагружает оригинальные изображения"""
         self.original_pixmaps = [QPixmap(p) for p in self.pages if os.path.isfile(p)]
+        self.orig_mipmaps.clear()
         # Отображаем текущую страницу только если есть все необходимые элементы интерфейса
         if hasattr(self, 'page_pixmap_item') and self.page_pixmap_item:
             self.displayCurrentPage()
@@ -82,7 +195,6 @@ class ImageViewer(QGraphicsView):
         if self.current_page < 0 or self.current_page >= len(self.pages):
             return
 
-        orig_path = self.pages[self.current_page]
         if self.current_page >= len(self.original_pixmaps):
             return
 
@@ -90,24 +202,25 @@ class ImageViewer(QGraphicsView):
         if orig_pm.isNull():
             return
 
-        if self.show_enhanced:
-            # Пробуем загрузить улучшенное изображение
-            base = os.path.splitext(os.path.basename(orig_path))[0]
-            ext = os.path.splitext(orig_path)[1]
-            enh_name = f"{base}_enhanced{ext}"
-            enh_path = os.path.join(self.output_folder, enh_name)
-
-            if os.path.isfile(enh_path):
-                enh_pm = QPixmap(enh_path)
-                if not enh_pm.isNull():
-                    self.page_pixmap_item.setPixmap(enh_pm)
-                    # Адаптируем размер улучшенного изображения к размеру оригинала
-                    self._fitEnhancedImageToOriginalSize(orig_pm, enh_pm)
-                    # Обновляем информацию
-                    self.createInfoBlocks()
-                    return
+        if self.show_enhanced or self.compare_mode:
+            # Улучшенное (пока декодируется в фоне - показывается оригинал)
+            enh_levels = self._get_enhanced_mipmaps(self._current_enhanced_path())
+            if enh_levels:
+                # Улучшенное выводится в координатах оригинала через уровни детализации
+                self.mip_item.set_images(self._get_original_mipmaps(self.current_page),
+                                         enh_levels, orig_pm.size())
+                self.mip_item.set_split(self.split_pos if self.compare_mode else None)
+                self.mip_item.setVisible(True)
+                self.page_pixmap_item.setVisible(False)
+                self._setSceneRectWithMargin(
+                    QRectF(0, 0, self.info_width + orig_pm.width(), orig_pm.height()), margin=80)
+                # Обновляем информацию
+                self.createInfoBlocks()
+                return
 
         # Если нет улучшенного или show_enhanced=False, показываем оригинал
+        self.mip_item.setVisible(False)
+        self.page_pixmap_item.setVisible(True)
         self.page_pixmap_item.setPixmap(orig_pm)
         self.page_pixmap_item.setTransform(QTransform())  # Используем QTransform вместо Qt.transform()
         self.page_pixmap_item.setPos(self.info_width, 0)
@@ -119,24 +232,89 @@ class ImageViewer(QGraphicsView):
         # Обновляем информационные блоки
         self.createInfoBlocks()
 
-    def _fitEnhancedImageToOriginalSize(self, orig_pm, enh_pm):
-        """Подгоняет улучшенное изображение под размер оригинала"""
-        orig_w, orig_h = orig_pm.width(), orig_pm.height()
-        ew, eh = enh_pm.width(), enh_pm.height()
-
-        if ew > 0 and eh > 0:
-            sx = orig_w / ew
-            sy = orig_h / eh
-
-            transform = QTransform()  # Используем QTransform вместо Qt.transform()
-            transform.scale(sx, sy)
-            self.page_pixmap_item.setTransform(transform)
-
-            # Настраиваем позицию
-            self.page_pixmap_item.setPos(self.info_width, 0)
+    def _get_original_mipmaps(self, page_idx):
+        """
+        Уровни детализации оригинала (LRU по странице и cacheKey pixmap).
+        Пока уровни строятся в фоне, возвращается только полный pixmap.
+        """
+        pm = self.original_pixmaps[page_idx]
+        key = ('orig', page_idx, pm.cacheKey())
+        cached = self.orig_mipmaps.get(page_idx)
+        if cached is not None and cached[0] == key:
+            self.orig_mipmaps.move_to_end(page_idx)
+            return cached[1]
+        # QImage копируется в GUI-потоке, уменьшения строятся в фоне
+        self._request_mipmaps(key, pm.toImage)
+        return [pm]
+
+    def _get_enhanced_mipmaps(self, enh_path):
+        """
+        Уровни детализации улучшенного изображения (LRU по пути и времени изменения).
+        None, если файла нет или он еще декодируется в фоне.
+        """
+        if not os.path.isfile(enh_path):
+            return None
+        key = ('enh', enh_path, os.path.getmtime(enh_path))
+        if key in self.enh_mipmaps:
+            self.enh_mipmaps.move_to_end(key)
+            return self.enh_mipmaps[key]
+        self._request_mipmaps(key, None)
+        return None
+
+    def _request_mipmaps(self, key, image_fn):
+        """Ставит построение уровней в фоновый поток (image_fn - QImage из GUI, иначе чтение файла)"""
+        if key in self.mip_pending:
+            return
+        self.mip_pending.add(key)
+        image = image_fn() if image_fn is not None else None
+        self.mip_pool.submit(self._build_mipmaps_job, key, image)
 
-            # Устанавливаем sceneRect
-            self._setSceneRectWithMargin(QRectF(0, 0, self.info_width + orig_w, orig_h), margin=80)
+    def _build_mipmaps_job(self, key, image):
+        """Рабочий поток: декодирование (для улучшенного) и уменьшения"""
+        levels = None
+        try:
+            if image is None:
+                image = decode_image(key[1])
+            if not image.isNull():
+                levels = build_mipmaps(image)
+        except Exception as e:
+            logger.error(f"Ошибка построения уровней {key[1]}: {e}")
+        try:
+            self._mipmaps_ready.emit(key, levels)
+        except RuntimeError:
+            pass  # просмотрщик уже удален
+
+    def _on_mipmaps_ready(self, key, levels):
+        """GUI-поток: QPixmap из готовых уровней, запись в кэш и перерисовка"""
+        self.mip_pending.discard(key)
+        if not levels:
+            return
+        pixmaps = [QPixmap.fromImage(img) for img in levels]
+        if key[0] == 'orig':
+            page_idx = key[1]
+            if page_idx >= len(self.original_pixmaps) or self.original_pixmaps[page_idx].cacheKey() != key[2]:
+                return
+            # Полный уровень - сам pixmap оригинала (без второй копии в памяти)
+            pixmaps[0] = self.original_pixmaps[page_idx]
+            self.orig_mipmaps[page_idx] = (key, pixmaps)
+            while len(self.orig_mipmaps) > ORIG_CACHE_SIZE:
+                self.orig_mipmaps.popitem(last=False)
+            if page_idx == self.current_page and self.compare_mode and self.mip_item.isVisible():
+                self.mip_item.orig_levels = pixmaps
+                self.mip_item.update()
+        else:
+            self.enh_mipmaps[key] = pixmaps
+            while len(self.enh_mipmaps) > ENH_CACHE_SIZE:
+                self.enh_mipmaps.popitem(last=False)
+            if (self.show_enhanced or self.compare_mode) and self._current_enhanced_path() == key[1]:
+                self.displayCurrentPage()
+
+    def _current_enhanced_path(self):
+        if not 0 <= self.current_page < len(self.pages):
+            return None
+        orig_path = self.pages[self.current_page]
+        base, ext = os.path.splitext(os.path.basename(orig_path))
+        return os.path.join(self.output_folder, f"{base}_enhanced{ext}")
 
     def createInfoBlocks(self):
         """Создает информационные блоки с данными о текущем изображении"""
@@ -239,13 +417,8 @@ class ImageViewer(QGraphicsView):
 
     def _get_image_dimensions(self, file_path):
         """Возвращает размеры изображения (ширина x высота)"""
-        try:
-            from PIL import Image
-            with Image.open(file_path) as img:
-                return img.width, img.height
-        except Exception as e:
-            logger.error(f"Ошибка при получении размера изображения {file_path}: {e}")
-            return 0, 0
+        # Читается только заголовок файла
+        return read_image_size(file_path)
 
     def set_enhanced(self, show_enhanced):
         """Переключение между оригинальными и улучшенными изображениями"""
@@ -255,9 +428,47 @@ class ImageViewer(QGraphicsView):
         self.show_enhanced = show_enhanced
         self.displayCurrentPage()
 
+    def set_compare_mode(self, enabled):
+        """Включение режима сравнения (оригинал слева, улучшенное справа)"""
+        if self.compare_mode == enabled:
+            return
+
+        self.compare_mode = enabled
+        self.displayCurrentPage()
+
+    def set_view_mode(self, show_enhanced, compare):
+        """Одновременная смена режимов с одной перерисовкой"""
+        if self.show_enhanced == show_enhanced and self.compare_mode == compare:
+            return
+
+        self.show_enhanced = show_enhanced
+        self.compare_mode = compare
+        self.displayCurrentPage()
+
+    def set_split_pos(self, pos):
+        """Положение линии сравнения (доля ширины страницы)"""
+        self.split_pos = max(0.0, min(1.0, pos))
+        if self.compare_mode and self.mip_item.isVisible():
+            self.mip_item.set_split(self.split_pos)
+
+    def _split_pos_at(self, view_pos):
+        """Доля ширины страницы для точки вьюпорта"""
+        item_pos = self.mip_item.mapFromScene(self.mapToScene(view_pos.toPoint()))
+        width = self.mip_item.logical_size.width()
+        return item_pos.x() / width if width > 0 else self.split_pos
+
+    def _is_near_split(self, view_pos):
+        """Проверяет, что курсор рядом с линией сравнения (в пикселях экрана)"""
+        if not (self.compare_mode and self.mip_item.isVisible()):
+            return False
+        split_x = self.mip_item.logical_size.width() * self.split_pos
+        line_pos = self.mapFromScene(self.mip_item.mapToScene(QPointF(split_x, 0)))
+        return abs(line_pos.x() - view_pos.x()) <= 8
+
     def updateImages(self):
         """Обновляет отображение после создания новых улучшенных изображений"""
         logger.debug("Обновление изображений")
+        self.enh_mipmaps.clear()
         self.displayCurrentPage()
         self.createInfoBlocks()
 
@@ -275,6 +486,13 @@ class ImageViewer(QGraphicsView):
 
     def mousePressEvent(self, event):
         """Обработка нажатия кнопки мыши"""
+        # В режиме сравнения линию можно перетаскивать
+        if event.button() == Qt.LeftButton and self._is_near_split(event.position()):
+            self.dragging_split = True
+            self.setCursor(Qt.SplitHCursor)
+            event.accept()
+            return
+
         # Если нажата левая кнопка мыши, активируем режим перемещения
         if event.button() == Qt.LeftButton:
             self.panning = True
@@ -286,6 +504,11 @@ class ImageViewer(QGraphicsView):
 
     def mouseMoveEvent(self, event):
         """Обработка перемещения мыши"""
+        if self.dragging_split:
+            self.set_split_pos(self._split_pos_at(event.position()))
+            event.accept()
+            return
+
         if self.panning:
             # Если режим перемещения активен, перемещаем видимую область холста
             delta = event.position() - self.last_pan_point
@@ -301,6 +524,12 @@ class ImageViewer(QGraphicsView):
 
     def mouseReleaseEvent(self, event):
         """Обработка отпускания кнопки мыши"""
+        if event.button() == Qt.LeftButton and self.dragging_split:
+            self.dragging_split = False
+            self.setCursor(Qt.OpenHandCursor)
+            event.accept()
+            return
+
         if event.button() == Qt.LeftButton and self.panning:
             self.panning = False
             self.setCursor(Qt.OpenHandCursor)  # Возвращаем курсор "открытая рука"
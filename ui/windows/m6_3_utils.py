@@ -7,6 +7,8 @@ import logging
 from PySide6.QtCore import QObject, Signal
 from PySide6.QtWidgets import QMessageBox
 
+from ui.components.image_decode import read_image_size
+
 # Настройка логгера
 logging.basicConfig(
     level=logging.DEBUG,
@@ -232,23 +234,12 @@ def detect_folder_changes(current_files, previous_files):
     current_info = {}  # {filename: (size, width, height, path)}
     previous_info = {}
 
-    try:
-        from PIL import Image
-    except ImportError:
-        Image = None
-
     # Собираем информацию о текущих файлах
     for path in current_files:
         if os.path.exists(path):
             name = os.path.basename(path)
             size = os.path.getsize(path)
-            width, height = 0, 0
-            if Image:
-                try:
-                    with Image.open(path) as img:
-                        width, height = img.size
-                except:
-                    pass
+            width, height = read_image_size(path)
             current_info[name] = (size, width, height, path)
 
     # Собираем информацию о предыдущих файлах
@@ -256,13 +247,7 @@ def detect_folder_changes(current_files, previous_files):
         if os.path.exists(path):
             name = os.path.basename(path)
             size = os.path.getsize(path)
-            width, height = 0, 0
-            if Image:
-                try:
-                    with Image.open(path) as img:
-                        width, height = img.size
-                except:
-                    pass
+            width, height = read_image_size(path)
             previous_info[name] = (size, width, height, path)
 
     current_names = set(current_info.keys())
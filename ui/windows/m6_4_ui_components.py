@@ -1,17 +1,14 @@
 # -*- coding: utf-8 -*-
 # ui/windows/m6_4_ui_components.py
 
-import os
-import time
-import threading
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from PySide6.QtCore import Qt, Signal, QObject, QEvent, QPointF
+from PySide6.QtCore import Qt, QEvent, QPointF
 from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel,
                                QPushButton, QProgressBar, QGraphicsProxyWidget,QGroupBox)
-from PySide6.QtGui import QFont, QPixmap
-from PySide6.QtWidgets import QApplication
+from PySide6.QtGui import QFont
+
+from ui.components.page_loader import PageLoader
 
 logger = logging.getLogger(__name__)
 
@@ -34,143 +31,12 @@ class AllImagesLoadedEvent(QEvent):
         super().__init__(AllImagesLoadedEvent.EventType)
 
 
-class ImageLoader(QObject):
+class ImageLoader(PageLoader):
     """
     Загрузчик изображений с поддержкой оптимизированного порядка загрузки,
     многопоточности и отмены загрузки.
     """
-    image_loaded = Signal(int, QPixmap, str)  # индекс, изображение, имя файла
-    loading_progress = Signal(int, int, str)  # загружено, всего, имя файла
-    loading_complete = Signal()
-    loading_cancelled = Signal()
-
-    def __init__(self, image_paths, thread_pool):
-        """
-        Инициализация загрузчика изображений
-
-        Args:
-            image_paths: Список путей к изображениям
-            thread_pool: ThreadPoolExecutor для многопоточной загрузки
-        """
-        super().__init__()
-        self.image_paths = image_paths
-        self.thread_pool = thread_pool
-        self.cancel_loading = False
-        self.loaded_count = 0
-        self.total_count = len(image_paths) if image_paths else 0
-
-    def start_loading(self, priority_index=0):
-        """
-        Запуск загрузки изображений
-
-        Args:
-            priority_index: Индекс изображения, которое нужно загрузить первым
-        """
-        # Определяем порядок загрузки: сначала текущая, потом соседние, потом остальные
-        load_order = self._get_load_order(priority_index)
-
-        self.loaded_count = 0
-        self.total_count = len(self.image_paths)
-        self.loading_progress.emit(0, self.total_count, "")
-
-        # Запускаем загрузку в отдельном потоке
-        thread = threading.Thread(target=self._load_thread, args=(load_order,), daemon=True)
-        thread.start()
-
-    def _get_load_order(self, priority_index):
-        """
-        Определяет оптимальный порядок загрузки изображений:
-        1. Сначала приоритетное
-        2. Затем соседние с приоритетным (±3)
-        3. Затем все остальные по порядку
-        """
-        load_order = [priority_index]
-
-        # Добавляем соседние страницы
-        for offset in range(1, 4):
-            if priority_index + offset < len(self.image_paths):
-                load_order.append(priority_index + offset)
-            if priority_index - offset >= 0:
-                load_order.append(priority_index - offset)
-
-        # Добавляем оставшиеся страницы
-        for i in range(len(self.image_paths)):
-            if i not in load_order:
-                load_order.append(i)
-
-        return load_order
-
-    def _load_image(self, idx):
-        """Загрузка одного изображения"""
-        if self.cancel_loading:
-            return None, idx, ""
-
-        try:
-            path = self.image_paths[idx]
-            current_file = os.path.basename(path)
-            pixmap = QPixmap(path)
-
-            if not pixmap.isNull():
-                return pixmap, idx, current_file
-        except Exception as e:
-            logger.error(f"Ошибка загрузки изображения {idx}: {str(e)}")
-
-        return None, idx, ""
-
-    def _load_thread(self, load_order):
-        """Поток загрузки изображений"""
-        try:
-            futures = []
-
-            # Создаем задачи для загрузки всех изображений
-            for idx in load_order:
-                if self.cancel_loading:
-                    break
-
-                future = self.thread_pool.submit(self._load_image, idx)
-                futures.append(future)
-
-                # Небольшая задержка чтобы не блокировать GUI
-                time.sleep(0.01)  # Уменьшить с 0.05 до 0.01
-
-            # Обрабатываем результаты по мере их завершения
-            for future in as_completed(futures):
-                if self.cancel_loading:
-                    # Отменяем оставшиеся futures
-                    for f in futures:
-                        f.cancel()
-                    break
-
-                try:
-                    result = future.result(timeout=1.0)  # Добавить таймаут
-                    if result and result[0] is not None:
-                        pixmap, idx, current_file = result
-                        # Проверяем, что приложение еще работает
-                        if QApplication.instance():
-                            self.image_loaded.emit(idx, pixmap, current_file)
-                            self.loaded_count += 1
-                            self.loading_progress.emit(self.loaded_count, self.total_count, current_file)
-                except Exception as e:
-                    logger.error(f"Ошибка при получении результата: {e}")
-
-            # Сигнализируем о завершении загрузки
-            if not self.cancel_loading and QApplication.instance():
-                self.loading_complete.emit()
-                active_window = QApplication.instance().activeWindow()
-                if active_window:
-                    QApplication.postEvent(active_window, AllImagesLoadedEvent())
-            else:
-                self.loading_cancelled.emit()
-
-        except Exception as e:
-            logger.error(f"Ошибка в процессе загрузки: {str(e)}")
-            if not self.cancel_loading:
-                self.loading_cancelled.emit()
-
-    def cancel(self):
-        """Отмена загрузки изображений"""
-        self.cancel_loading = True
-        logger.debug("Загрузка изображений отменена")
+    all_loaded_event = AllImagesLoadedEvent
 
 
 class LoadingProgressItem(QGraphicsProxyWidget):
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# ui/windows/m6_5_save_result.py
+
+import os
+import sys
+import shutil
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from PySide6.QtCore import QRunnable, QObject, Signal
+
+logger = logging.getLogger(__name__)
+
+# ioctl FICLONE (Linux: btrfs, xfs и др.)
+FICLONE = 0x40049409
+
+
+class SaveSignals(QObject):
+    """Сигналы процесса сохранения результата"""
+    progress = Signal(int, int, str)  # обработано, всего, имя файла
+    finished = Signal(dict)  # итоговая статистика
+    error = Signal(str)
+
+
+def _is_up_to_date(src, dst):
+    """Проверяет, что dst - независимая копия src с той же сигнатурой"""
+    if not os.path.exists(dst):
+        return False
+    try:
+        if os.path.samefile(src, dst):
+            # Тот же путь - копировать нечего; жесткая ссылка прошлых версий
+            # заменяется настоящей копией, чтобы правки источника не меняли Save
+            return os.path.normcase(os.path.abspath(src)) == os.path.normcase(os.path.abspath(dst))
+        s_st, d_st = os.stat(src), os.stat(dst)
+    except OSError:
+        return False
+    # copy2/copystat сохраняют время изменения с наносекундами
+    return s_st.st_size == d_st.st_size and s_st.st_mtime_ns == d_st.st_mtime_ns
+
+
+def _reflink(src, dst):
+    """Копирование с разделением блоков (copy-on-write), если ФС поддерживает"""
+    if not sys.platform.startswith("linux"):
+        return False
+    import fcntl
+    with open(src, "rb") as fs, open(dst, "wb") as fd:
+        try:
+            fcntl.ioctl(fd.fileno(), FICLONE, fs.fileno())
+        except OSError:
+            return False
+    shutil.copystat(src, dst)
+    return True
+
+
+def link_or_copy(src, dst):
+    """
+    Помещает src в dst через временный файл: reflink (copy-on-write),
+    иначе обычное копирование. Жесткие ссылки не используются: запись
+    в источник на месте изменила бы и сохраненный результат.
+    Возвращает использованный способ.
+    """
+    tmp = f"{dst}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+
+    method = "copy"
+    try:
+        if _reflink(src, tmp):
+            method = "reflink"
+    except OSError:
+        pass
+
+    if method == "copy":
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        shutil.copy2(src, tmp)
+
+    os.replace(tmp, dst)
+    return method
+
+
+class SaveWorker(QRunnable):
+    """
+    Worker сохранения результата предобработки в папку Save.
+    Заменяет только изменившиеся файлы, лишние удаляет, копирует параллельно.
+    """
+
+    def __init__(self, jobs, save_folder, max_workers=None):
+        """
+        Args:
+            jobs: Список (источник, имя файла в Save, улучшенное ли)
+            save_folder: Папка назначения
+        """
+        super().__init__()
+        self.jobs = jobs
+        self.save_folder = save_folder
+        self.max_workers = max_workers or min(8, (os.cpu_count() or 2) * 2)
+        self.signals = SaveSignals()
+        self.cancelled = False
+
+    def cancel(self):
+        """Отмена (при закрытии окна): начатые файлы дописываются, остальные пропускаются"""
+        self.cancelled = True
+
+    def _save_one(self, src, name):
+        if self.cancelled:
+            return "cancelled"
+        dst = os.path.join(self.save_folder, name)
+        if _is_up_to_date(src, dst):
+            return "skip"
+        return link_or_copy(src, dst)
+
+    def run(self):
+        stats = {"total": len(self.jobs), "saved": 0, "skipped": 0,
+                 "enhanced": 0, "removed": 0, "errors": []}
+        try:
+            os.makedirs(self.save_folder, exist_ok=True)
+
+            # Удаляем файлы, которых больше нет в наборе
+            expected = {name for _, name, _ in self.jobs}
+            for f in os.listdir(self.save_folder):
+                file_path = os.path.join(self.save_folder, f)
+                if f not in expected and os.path.isfile(file_path):
+                    try:
+                        os.remove(file_path)
+                        stats["removed"] += 1
+                    except Exception as e:
+                        logger.error(f"Ошибка при удалении файла {file_path}: {e}")
+
+            done = 0
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                futures = {pool.submit(self._save_one, src, name): (src, name, is_enh)
+                           for src, name, is_enh in self.jobs}
+                for future in as_completed(futures):
+                    src, name, is_enh = futures[future]
+                    try:
+                        method = future.result()
+                        if method == "cancelled":
+                            continue
+                        if method == "skip":
+                            stats["skipped"] += 1
+                        else:
+                            logger.debug(f"Сохранено ({method}): {os.path.basename(src)} -> {name}")
+                        stats["saved"] += 1
+                        if is_enh:
+                            stats["enhanced"] += 1
+                    except Exception as e:
+                        error_msg = f"Ошибка при копировании {name}: {e}"
+                        logger.error(error_msg)
+                        stats["errors"].append(error_msg)
+                    done += 1
+                    if not self.cancelled:
+                        self.signals.progress.emit(done, stats["total"], name)
+
+            if self.cancelled:
+                logger.info(f"Сохранение отменено: сохранено {stats['saved']} из {stats['total']}")
+                return
+            self.signals.finished.emit(stats)
+        except Exception as e:
+            logger.error(f"Ошибка в SaveWorker: {repr(e)}")
+            self.signals.error.emit(str(e))
@@ -18,6 +18,7 @@ from PySide6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel, QPushB
 from PySide6.QtCore import QTimer
 # Импортируем наши модули
 from ui.components.gradient_widget import GradientBackgroundWidget
+from ui.components.thumb_cache import get_thumb_cache, THUMB_W, THUMB_H
 from ui.windows.m7_1_image_viewer import (ImageViewer, NotesModifiedSignal,
                                           NoteItem, MovableRectItem, AnchorPointItem)
 from ui.windows.m7_2_utils import (get_images_from_folder, show_message, PageChangeSignal)
@@ -532,10 +533,7 @@ class TranslationWindow(QDialog):
 
                     # Обновляем миниатюру
                     if 0 <= current_page < len(self.thumbnail_labels):
-                        tw = 150
-                        th = tw * 2
-                        scaled_pix = pm.scaled(tw, th, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                        self.thumbnail_labels[current_page].setPixmap(scaled_pix)
+                        get_thumb_cache().set_label_pixmap(self.thumbnail_labels[current_page], dst_path, pm)
 
             self.unlockInterface()
 
@@ -617,11 +615,9 @@ class TranslationWindow(QDialog):
             if self.viewer.current_page == idx:
                 self.viewer.displayCurrentPage()
 
+            # Миниатюра из уже загруженной страницы, без повторного чтения файла
             if self.preview_scroll_area and 0 <= idx < len(self.thumbnail_labels):
-                tw = 150
-                th = tw * 2
-                scaled_pix = pixmap.scaled(tw, th, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                self.thumbnail_labels[idx].setPixmap(scaled_pix)
+                get_thumb_cache().set_label_pixmap(self.thumbnail_labels[idx], self.image_paths[idx], pixmap)
 
         QApplication.postEvent(self, ImageLoadedEvent(idx))
 
@@ -752,8 +748,9 @@ class TranslationWindow(QDialog):
         self.thumbnail_labels = []
         self.index_labels = []
 
-        thumbnail_width = 150
-        thumbnail_height = thumbnail_width * 2
+        thumbnail_width = THUMB_W
+        thumbnail_height = THUMB_H
+        thumbs = get_thumb_cache()
 
         for i, path in enumerate(self.image_paths):
             thumb_container = QWidget()
@@ -762,14 +759,9 @@ class TranslationWindow(QDialog):
             thumb_layout.setSpacing(0)
 
             thumb_label = QLabel()
-            pm = QPixmap(path)
-            if not pm.isNull():
-                scaled_pix = pm.scaled(
-                    thumbnail_width, thumbnail_height,
-                    Qt.KeepAspectRatio, Qt.SmoothTransformation
-                )
-                thumb_label.setPixmap(scaled_pix)
-                thumb_label.setAlignment(Qt.AlignCenter)
+            # Миниатюра из кэша или фоновая генерация
+            thumbs.set_label_thumb(thumb_label, path, thumbnail_width, thumbnail_height)
+            thumb_label.setAlignment(Qt.AlignCenter)
 
             thumb_label.setStyleSheet("""
                 QLabel {
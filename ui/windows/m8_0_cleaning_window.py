@@ -1,18 +1,29 @@
 # -*- coding: utf-8 -*-
 import os, json, numpy as np, cv2, logging, time
-from PIL import Image
-from threading import Thread
-from PySide6.QtCore import Qt, Signal, QEvent, QTimer, QPointF, QRectF, QThread, QBuffer
+from concurrent.futures import ThreadPoolExecutor
+from PySide6.QtCore import Qt, Signal, QEvent, QTimer, QPointF, QRectF, QThreadPool
 from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton,
                                QScrollArea, QSplitter, QGroupBox, QRadioButton, QButtonGroup,
                                QMessageBox, QCheckBox, QSlider, QProgressBar, QApplication,
-                               QComboBox, QGridLayout,QGraphicsScene)
-from PySide6.QtGui import QPixmap, QColor, QPainter, QImage
+                               QComboBox, QGridLayout,QGraphicsScene, QProgressDialog)
+from PySide6.QtGui import QPixmap, QColor, QPainter, QImage, QShortcut, QKeySequence
 
+from ui.components.page_loader import PageLoader
+from ui.components.thumb_cache import get_thumb_cache
+from ui.components.model_registry import get_model_registry, package_available, ST_LOADING, ST_READY, ST_FAILED
+from ui.components.stage_timer import get_stage_timer, timed
 from ui.windows.m8_1_graphics_items import SelectionEvent, EditableMask, EditablePolygonMask, BrushStroke
 from ui.windows.m8_2_image_viewer import CustomImageViewer, DrawingMode, PageChangeSignal
-from ui.windows.m8_3_utils import DetectionManager, enable_cuda_cudnn
-import io
+from ui.windows.m8_3_utils import DetectionManager, retire_thread
+from ui.windows.m8_4_mask_engine import PageMaskModel
+from ui.windows.m8_5_detection import image_signature
+from ui.windows.m8_6_inpaint import InpaintWorker, InpaintJob, qimage_to_rgb, rgb_to_qimage
+from ui.windows.m8_7_history import PageHistory
+from ui.windows.m8_9_save import PageSaveWorker, write_json_atomic, PNG_QUALITY_DEF, PNG_QUALITY_FAST
+from ui.windows.m8_10_mask_store import MaskStore, page_fingerprint, snapshot_page
+from ui.windows.m8_11_timing_panel import TimingPanel, default_timing_path
+from ui.windows.m8_8_clean_engine import (default_classes, get_imgs_from_folder, load_clean_settings,
+                                          save_clean_settings, apply_clean_settings, record_done_pages)
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -22,94 +33,12 @@ THUMB_W, THUMB_H = 150, 300
 MIN_BRUSH, MAX_BRUSH, DEF_BRUSH = 1, 50, 5
 PROG_HIDE_MS = 5000
 MASK_EXP_DEF = 10
-
-class ImgCleanWorker(QThread):
-    """Воркер для очистки изображения"""
-    prog = Signal(int, int, str)
-    err = Signal(str)
-    done_img = Signal(int, QPixmap)  # page_idx, result_pixmap
-
-    def __init__(self, lama, pixmap, mask, page_idx):
-        super().__init__()
-        self.lama = lama
-        self.pixmap = pixmap
-        self.mask = mask
-        self.page_idx = page_idx
-
-    def run(self):
-        try:
-            self.prog.emit(0, 1, f"Подготовка очистки страницы {self.page_idx + 1}...")
-
-            # Проверка маски
-            mask_px = np.sum(self.mask > 0)
-            if mask_px == 0:
-                self.err.emit(f"Ошибка: Маска пуста для страницы {self.page_idx + 1}")
-                return
-
-            logger.info(f"Запуск очистки для страницы {self.page_idx + 1}, маска содержит {mask_px} пикселей")
-
-            # Конвертация QPixmap в PIL
-            try:
-                qimg = self.pixmap.toImage()
-                buffer = QBuffer()
-                buffer.open(QBuffer.ReadWrite)
-                qimg.save(buffer, "PNG")
-                buffer.seek(0)
-                img = Image.open(io.BytesIO(buffer.data())).convert('RGB')
-            except Exception as e:
-                self.err.emit(f"Ошибка конвертации QPixmap в PIL Image: {str(e)}")
-                import traceback
-                logger.error(traceback.format_exc())
-                return
-
-            img_w, img_h = img.size
-
-            # Подготовка маски
-            mask_arr = self.mask.copy()
-            mask_arr[mask_arr > 0] = 255
-
-            # Проверка размеров
-            if mask_arr.shape[0] != img_h or mask_arr.shape[1] != img_w:
-                logger.warning(f"Коррекция размеров маски: {mask_arr.shape} -> {(img_h, img_w)}")
-                fixed_mask = np.zeros((img_h, img_w), dtype=np.uint8)
-                h = min(mask_arr.shape[0], img_h)
-                w = min(mask_arr.shape[1], img_w)
-                fixed_mask[:h, :w] = mask_arr[:h, :w]
-                mask_arr = fixed_mask
-
-            # Конвертация в PIL
-            mask_pil = Image.fromarray(mask_arr).convert('L')
-
-            self.prog.emit(0, 1, f"Запуск LaMa инпейнтинга для страницы {self.page_idx + 1}...")
-
-            # Очистка с LaMa
-            result = self.lama(img, mask_pil)
-
-            # QPixmap из результата
-            try:
-                buffer = io.BytesIO()
-                result.save(buffer, format="PNG")
-                buffer.seek(0)
-                bytes_data = buffer.getvalue()
-
-                res_pixmap = QPixmap()
-                res_pixmap.loadFromData(bytes_data)
-
-                if res_pixmap.isNull():
-                    raise ValueError("Не удалось создать QPixmap из результата")
-            except Exception as e:
-                self.err.emit(f"Ошибка создания превью: {str(e)}")
-                return
-
-            self.prog.emit(1, 1, "Очистка успешно завершена")
-            self.done_img.emit(self.page_idx, res_pixmap)
-
-        except Exception as e:
-            logger.error(f"Ошибка очистки изображения {self.page_idx}: {str(e)}")
-            import traceback
-            logger.error(traceback.format_exc())
-            self.err.emit(f"Ошибка очистки: {str(e)}")
-
+# Сколько страниц одновременно находится в очереди инпейнтинга
+CLEAN_PREFETCH = 4
+# Не чаще какого интервала маски страниц записываются на диск, мс
+MASK_SAVE_MS = 1500
+# Пауза в движении слайдера расширения, после которой маски пересобираются, мс
+EXP_APPLY_MS = 150
 
 class UpdateProgEvent(QEvent):
     Type = QEvent.Type(QEvent.User + 100)
@@ -133,28 +62,48 @@ class CleaningWindow(QWidget):
         # Состояние
         self.proc = False
         self.curr_op = None
-        self.clean_workers = []
+        self.inpaint_worker = None
+        self.page_loader = None
+        self.load_pool = None
+        self.clean_queue = []
+        self.clean_in_flight = 0
+        self.clean_skipped = []  # страницы последней очистки, пропущенные без масок
+        self.clean_before = {}  # page_idx -> (rect, пиксели до очистки)
         self.det_canc = False
         self.segm_canc = False
 
-        # Буфер для истории (1->2->3->циклично)
-        self.circ_buf = {}
+        # Расширение масок: изменения слайдера до срабатывания таймера
+        # и отложенные значения для страниц, которые еще не показывались
+        self.exp_changes = {}  # тип -> (расширение, все страницы)
+        self.exp_pending = {}  # page_idx -> {тип: расширение}
+        self.exp_timer = QTimer(self)
+        self.exp_timer.setSingleShot(True)
+        self.exp_timer.timeout.connect(self._apply_exp_changes)
+
+        # История undo/redo в виде дельт измененных областей
+        self.history = PageHistory()
         self.img_status = {}
 
-        # Проверка AI
-        try:
-            self.ai_avail = True
-            try:
-                from simple_lama_inpainting import SimpleLama
-                self.lama = SimpleLama()
-                self.inpaint_avail = True
-                logger.info("SimpleLama успешно инициализирован")
-            except ImportError:
-                self.inpaint_avail = False
-                logger.info("SimpleLama не установлена")
-        except ImportError:
-            self.ai_avail = False
-            logger.warning("OpenCV или NumPy не установлены")
+        # Сохранение: cacheKey pixmap, совпадающих с файлом на диске, и отправленных в запись
+        self.disk_keys = {}
+        self.save_keys = {}
+        self.save_worker = None
+        self.save_unchanged = 0
+        self.save_progress = 0  # страниц текущего сохранения, обработанных воркером
+        self.close_dialog = None  # прогресс записи, которую дожидается закрытие окна
+        self.saved_done = []  # пути страниц, записанных текущим сохранением (для пакетной очистки)
+
+        # Замеры этапов собираются заново для каждого открытия главы
+        self.timer = get_stage_timer()
+        self.timer.reset()
+        self.timing_panel = None
+
+        # Проверка AI: модели загружаются и прогреваются в фоне общим реестром
+        self.ai_avail = True
+        self.models = get_model_registry()
+        self.inpaint_avail = package_available('simple_lama_inpainting')
+        if not self.inpaint_avail:
+            logger.info("SimpleLama не установлена")
 
         self.paths = paths or {}
 
@@ -176,21 +125,10 @@ class CleaningWindow(QWidget):
         self.setWindowTitle("Клининг")
 
         self.comb_masks = {}
+        self.mask_models = {}  # page_idx -> PageMaskModel
 
         # Классы детекции и сегментации
-        self.detect_cls = {
-            'Text': {'threshold': 0.5, 'enabled': True, 'color': (255, 0, 0)},
-            'Sound': {'threshold': 0.5, 'enabled': False, 'color': (0, 255, 0)},
-            'FonText': {'threshold': 0.5, 'enabled': False, 'color': (0, 0, 255)},
-            'ComplexText': {'threshold': 0.5, 'enabled': False, 'color': (255, 128, 0)},
-        }
-
-        self.segm_cls = {
-            'TextSegm': {'threshold': 0.5, 'enabled': True, 'color': (255, 255, 0)},
-            'Sound': {'threshold': 0.5, 'enabled': False, 'color': (255, 0, 255)},
-            'FonText': {'threshold': 0.5, 'enabled': False, 'color': (0, 255, 255)},
-            'Text': {'threshold': 0.5, 'enabled': True, 'color': (0, 128, 255)},
-        }
+        self.detect_cls, self.segm_cls = default_classes()
 
         # Настройки рисования
         self.curr_draw_mode = DrawingMode.NONE
@@ -201,6 +139,12 @@ class CleaningWindow(QWidget):
         self.saved_detect_exp = MASK_EXP_DEF
         self.saved_segm_exp = MASK_EXP_DEF
 
+        # Сохраненные настройки главы (общие с консольной очисткой)
+        settings = load_clean_settings(self.chapter_paths["cleaning_folder"])
+        if settings:
+            self.saved_detect_exp, self.saved_segm_exp = apply_clean_settings(settings, self.detect_cls,
+                                                                              self.segm_cls)
+
         # Определение источника
         self.img_paths = self._decide_img_source()
 
@@ -221,7 +165,7 @@ class CleaningWindow(QWidget):
         self.page_change_sig.page_changed.connect(self.upd_active_thumb)
 
         # Просмотрщик
-        self.viewer = CustomImageViewer(self.img_paths, parent=self)
+        self.viewer = CustomImageViewer(self.img_paths, parent=self, preload=False)
         self.viewer.page_loading_status = {i: False for i in range(len(self.img_paths))}
 
         # Панель превью
@@ -247,7 +191,11 @@ class CleaningWindow(QWidget):
         self.viewer.mask_updated.connect(self.upd_thumb_no_mask)
         self.detect_mgr = DetectionManager(self.ai_models, self.detect_cls, self.segm_cls)
         self.detect_mgr.set_viewer(self.viewer)
+        self.detect_mgr.set_store_folder(os.path.join(self.chapter_paths["cleaning_folder"], ".detections"))
+        self.detect_mgr.model_hash_ready.connect(self._on_model_hash_ready)
         self.sync_detection_manager()
+        self._preload_models()
+        self._init_mask_store()
         for cls_name, info in self.detect_cls.items():
             if cls_name == 'Text':
                 self.cb_text.setChecked(info['enabled'])
@@ -311,45 +259,52 @@ class CleaningWindow(QWidget):
         # Оригинальный метод
         QGraphicsScene.update(self.viewer.scene_)
 
-        # При рисовании обновляем статус
+        # При рисовании статус выставляется один раз за штрих; миниатюра
+        # обновится по mask_updated после фиксации штриха в слое
         if hasattr(self.viewer, 'drawing') and self.viewer.drawing:
-            # Таймер для ограничения частоты
-            if not hasattr(self, 'thumb_update_timer'):
-                self.thumb_update_timer = QTimer()
-                self.thumb_update_timer.setSingleShot(True)
-                self.thumb_update_timer.timeout.connect(
-                    lambda: self.upd_thumb_no_mask(self.viewer.cur_page))
-
-            # Запускаем таймер если не активен
-            if not self.thumb_update_timer.isActive():
-                self.thumb_update_timer.start(200)
-
-            # Устанавливаем статус
-            if self.viewer.cur_page in self.img_status:
-                self.img_status[self.viewer.cur_page] = 'modified'
-                self.upd_thumb_status(self.viewer.cur_page)
-
-    def save_to_buf(self, page_idx):
-        """Сохраняет текущее состояние изображения в буфер"""
-        if page_idx not in self.circ_buf:
-            self.circ_buf[page_idx] = {
-                0: None,  # Бэкап из другого этапа
-                1: None,  # Оригинал (сохраняется)
-                2: None,  # После первой операции
-                3: None  # После второй операции
-            }
+            page_idx = self.viewer.cur_page
+            if page_idx in self.img_status and self.img_status[page_idx] != 'modified':
+                self.img_status[page_idx] = 'modified'
+                self.upd_thumb_status(page_idx)
 
-        # Если есть состояние 3, оно становится состоянием 2
-        if self.circ_buf[page_idx][3] is not None:
-            self.circ_buf[page_idx][2] = self.circ_buf[page_idx][3].copy()
+    def undo_page(self):
+        """Отмена последней операции на текущей странице"""
+        self._step_history(self.history.undo)
 
-        # Текущее состояние становится состоянием 3
-        if page_idx in self.viewer.pixmaps and not self.viewer.pixmaps[page_idx].isNull():
-            self.circ_buf[page_idx][3] = self.viewer.pixmaps[page_idx].copy()
+    def redo_page(self):
+        """Повтор отмененной операции на текущей странице"""
+        self._step_history(self.history.redo)
 
-            # Обновляем статус
-            self.img_status[page_idx] = 'modified'
+    def _step_history(self, step):
+        """Накладывает патч истории на изображение текущей страницы"""
+        if self.proc:
+            return
+        page_idx = self.viewer.cur_page
+        if not (0 <= page_idx < len(self.viewer.pixmaps)) or self.viewer.pixmaps[page_idx].isNull():
+            return
+
+        try:
+            entry = step(page_idx)
+            if entry is None:
+                return
+            (x0, y0, _, _), pixels = entry
+
+            pixmap = self.viewer.pixmaps[page_idx]
+            painter = QPainter(pixmap)
+            painter.setCompositionMode(QPainter.CompositionMode_Source)
+            painter.drawImage(x0, y0, rgb_to_qimage(pixels))
+            painter.end()
+            self.viewer.pixmaps[page_idx] = pixmap
+
+            self.img_status[page_idx] = 'unsaved'
+            self.viewer.display_current_page()
+            scaled = pixmap.scaled(THUMB_W, THUMB_W * 2, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            self.thumb_labels[page_idx].setPixmap(scaled)
             self.upd_thumb_status(page_idx)
+        except Exception as e:
+            logger.error(f"Ошибка отмены/повтора для страницы {page_idx}: {str(e)}")
+            import traceback
+            logger.error(traceback.format_exc())
 
     def is_valid_mask(self, mask):
         """Проверяет валидность маски для инпейнтинга"""
@@ -404,14 +359,149 @@ class CleaningWindow(QWidget):
                 if os.path.exists(segm_path):
                     self.ai_models["segm"] = segm_path
 
-    def _upd_prog_bar(self, prog_bar, val, total, msg=""):
-        """Обновляет прогресс-бар"""
+    def _preload_models(self):
+        """Фоновая загрузка моделей главы; состояние показывается в верхней панели"""
+        self.models.state_changed.connect(self._on_model_state)
+        self.detect_mgr.pin_models()
+        self.detect_mgr.preload_models()
+        if self.inpaint_avail:
+            self.models.preload([('lama', None)])
+        self._on_model_state("", "")
+
+    def _on_model_state(self, key, state):
+        """Обновляет надпись готовности моделей"""
+        states = []
+        if self.detect_mgr._model_available('detect'):
+            states.append(("Детекция", self.detect_mgr.model_state('detect')))
+        if self.detect_mgr._model_available('segm'):
+            states.append(("Сегментация", self.detect_mgr.model_state('segm')))
+        if self.inpaint_avail:
+            states.append(("LaMa", self.models.state('lama')))
+
+        marks = {ST_READY: "готова", ST_LOADING: "загрузка...", ST_FAILED: "ошибка"}
+        parts = [f"{name}: {marks.get(st, 'не загружена')}" for name, st in states]
+        self.models_lbl.setText(" | ".join(parts))
+        self.models_lbl.setVisible(bool(parts) and any(st != ST_READY for _, st in states))
+
+    def _init_mask_store(self):
+        """Хранилище масок главы: правки пишутся в фоне, страницы подгружаются при показе"""
+        self.mask_store = MaskStore(os.path.join(self.chapter_paths["cleaning_folder"], ".masks"))
+        self.mask_loaded = set()  # страницы, сохраненные маски которых уже в памяти
+        self.mask_stored = set()  # страницы с сохраненными масками, еще не подгруженные
+        self.mask_prints = {}  # page_idx -> отпечаток последнего записанного состояния
+        self.mask_save_timer = QTimer(self)
+        self.mask_save_timer.setSingleShot(True)
+        self.mask_save_timer.timeout.connect(self._flush_masks)
+        self.viewer.mask_loader = self.prepare_page_masks
+        self.viewer.mask_updated.connect(lambda idx: self._schedule_mask_save())
+
+    def _stored_mask_pages(self):
+        """Страницы с сохраненными масками (без чтения самих масок)"""
+        self.mask_stored = {i for i, path in enumerate(self.img_paths)
+                            if i not in self.mask_loaded and self.mask_store.has(os.path.basename(path))}
+        for page_idx in self.mask_stored:
+            if self.img_status.get(page_idx, 'saved') == 'saved':
+                self.img_status[page_idx] = 'modified'
+        if self.mask_stored:
+            logger.info(f"Сохраненные маски найдены для {len(self.mask_stored)} страниц")
+        return self.mask_stored
+
+    def prepare_page_masks(self, page_idx):
+        """Маски страницы перед показом или очисткой: сохраненные и отложенное расширение"""
+        if self.exp_timer.isActive():
+            self.exp_timer.stop()
+            self._apply_exp_changes()
+        self.ensure_page_masks(page_idx)
+        self.detect_mgr.restore_page(self, page_idx)
+        for kind, value in self.exp_pending.pop(page_idx, {}).items():
+            self._apply_page_exp(page_idx, kind, value)
+
+    def ensure_page_masks(self, page_idx):
+        """Подгружает сохраненные маски и слой рисования страницы (один раз)"""
+        if page_idx in self.mask_loaded or not 0 <= page_idx < len(self.img_paths):
+            return
+        self.mask_loaded.add(page_idx)
+        self.mask_stored.discard(page_idx)
+
+        path = self.img_paths[page_idx]
+        data = self.mask_store.load(os.path.basename(path), image_signature(path))
+        if data is None:
+            return
+
+        try:
+            for entry in data.get("items", []):
+                mask_type = entry.get("mask_type")
+                classes = self.detect_cls if mask_type == 'detect' else self.segm_cls
+                color = classes.get(entry.get("cls"), {}).get('color', (255, 0, 0))
+                if "rect" in entry:
+                    x, y, w, h = entry["rect"]
+                    mask = EditableMask(x, y, w, h, mask_type, entry.get("cls"), entry.get("conf", 0.0), color)
+                else:
+                    mask = EditablePolygonMask(entry["poly"], mask_type, entry.get("cls"), entry.get("conf", 0.0),
+                                               color)
+                    mask.setZValue(100)
+                mask.last_expansion = entry.get("exp", 0)
+                mask.set_page_index(page_idx)
+                self.viewer.add_mask_item(page_idx, mask)
+
+            if data["tiles"]:
+                layer = self.viewer._create_drawing_layer(page_idx)
+                if layer is not None:
+                    color = data.get("layer", {}).get("color", self.curr_draw_color)
+                    for key, bits in data["tiles"].items():
+                        layer.set_tile_mask(key, bits, color)
+                    if page_idx in self.viewer.draw_items:
+                        self.viewer.draw_items[page_idx].update()
+
+            # Загруженное состояние совпадает с файлом - повторно не записывается
+            self.mask_prints[page_idx] = self._mask_print(page_idx)
+            logger.info(f"Страница {page_idx + 1}: восстановлено масок {len(data.get('items', []))}, "
+                        f"тайлов слоя {len(data['tiles'])}")
+        except Exception as e:
+            logger.error(f"Ошибка восстановления масок страницы {page_idx}: {str(e)}")
+            import traceback
+            logger.error(traceback.format_exc())
+
+    def _mask_print(self, page_idx):
+        return page_fingerprint(self.viewer.masks.get(page_idx, []), self.viewer.draw_layers.get(page_idx))
+
+    def _schedule_mask_save(self):
+        """Запись масок с задержкой (правки подряд объединяются)"""
+        if hasattr(self, 'mask_save_timer') and not self.mask_save_timer.isActive():
+            self.mask_save_timer.start(MASK_SAVE_MS)
+
+    def _flush_masks(self):
+        """Ставит в фоновую запись страницы, маски которых изменились с прошлой записи"""
+        pages = set(self.viewer.masks) | set(self.viewer.draw_layers) | set(self.mask_prints)
+        written = 0
+        for page_idx in sorted(pages):
+            if not 0 <= page_idx < len(self.img_paths) or page_idx in self.mask_stored:
+                continue  # сохраненные маски не показанной страницы не перезаписываются
+            fp = self._mask_print(page_idx)
+            if self.mask_prints.get(page_idx) == fp:
+                continue
+            self.mask_prints[page_idx] = fp
+
+            path = self.img_paths[page_idx]
+            name = os.path.basename(path)
+            snap = snapshot_page(self.viewer.masks.get(page_idx, []), self.viewer.draw_layers.get(page_idx),
+                                 self.curr_draw_color)
+            if snap is None and not self.mask_store.has(name):
+                continue
+            self.mask_store.write_async(name, image_signature(path), snap)
+            written += 1
+        if written:
+            logger.debug(f"Маски записываются для {written} страниц")
+
+    def _upd_prog_bar(self, prog_bar, val, total, msg="", process_events=True):
+        """Обновляет прогресс-бар (process_events=False для вызовов из обработчиков сигналов)"""
         prog_bar.setRange(0, total)
         prog_bar.setValue(val)
         if msg:
             prog_bar.setFormat(msg)
         prog_bar.setVisible(True)
-        QApplication.processEvents()
+        if process_events:
+            QApplication.processEvents()
 
     def _decide_img_source(self):
         """Определение источника изображений с диалогом выбора"""
@@ -553,11 +643,12 @@ class CleaningWindow(QWidget):
 
     def _get_imgs_from_folder(self, folder):
         """Получение списка изображений из папки"""
-        if not os.path.isdir(folder):
-            return []
-        imgs = [os.path.join(folder, f) for f in sorted(os.listdir(folder))
-                if f.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.tiff'))]
-        return imgs
+        return get_imgs_from_folder(folder)
+
+    def _save_clean_settings(self):
+        """Сохраняет пороги, классы и расширение масок главы"""
+        save_clean_settings(self.chapter_paths["cleaning_folder"], self.detect_cls, self.segm_cls,
+                            self.saved_detect_exp, self.saved_segm_exp)
 
     def _copy_images_to_cleaning(self, source_images):
         """Копирует изображения в папку клининг с сохранением имен"""
@@ -702,6 +793,19 @@ class CleaningWindow(QWidget):
 
         top_bar.addStretch(1)
 
+        # Готовность моделей (загрузка идет в фоне)
+        self.models_lbl = QLabel("")
+        self.models_lbl.setStyleSheet("color:#AAAAAA;font-size:12px;")
+        top_bar.addWidget(self.models_lbl, 0, Qt.AlignVCenter | Qt.AlignRight)
+
+        stats_btn = QPushButton("Статистика")
+        stats_btn.setToolTip("Время этапов детекции, очистки и сохранения")
+        stats_btn.setStyleSheet(
+            "QPushButton{background-color:#4E4E6F;color:white;border-radius:8px;"
+            "padding:6px 12px;font-size:14px;}QPushButton:hover{background-color:#6E6E9F;}")
+        stats_btn.clicked.connect(self.show_timing_panel)
+        top_bar.addWidget(stats_btn, 0, Qt.AlignRight)
+
         close_btn = QPushButton("Назад")
         close_btn.setStyleSheet(
             "QPushButton{background-color:#4E4E6F;color:white;border-radius:8px;"
@@ -713,8 +817,72 @@ class CleaningWindow(QWidget):
 
     def on_back_clicked(self):
         """Обработка кнопки Назад"""
+        if self.save_worker is not None:
+            # Закрытие откладывается до конца записи своих файлов,
+            # чтобы не оставить главу в промежуточном состоянии
+            self._close_after_save()
+            return
+        self.detect_mgr.shutdown()
+        self.detect_mgr.unpin_models()
+        self._cancel_page_loading()
+        if self.load_pool is not None:
+            self.load_pool.shutdown(wait=False, cancel_futures=True)
+            self.load_pool = None
+        if self.inpaint_worker is not None:
+            worker = self.inpaint_worker
+            self.inpaint_worker = None
+            retire_thread(worker, (worker.page_started, worker.page_done, worker.page_failed))
+            self.models.unpin('lama')
+        try:
+            self.models.state_changed.disconnect(self._on_model_state)
+        except (RuntimeError, TypeError):
+            pass
+        self.history.close()
+        self.mask_save_timer.stop()
+        self._flush_masks()
+        self.mask_store.close()
+        self._save_clean_settings()
+        self._export_timing()
+        if self.timing_panel is not None:
+            self.timing_panel.close()
         self.back_requested.emit()
 
+    def _close_after_save(self):
+        """Модальный прогресс записи; окно закрывается по сигналу finished воркера"""
+        if self.close_dialog is not None:
+            return
+        total = len(self.save_worker.jobs)
+        dialog = QProgressDialog("Завершение сохранения перед закрытием...", "", 0, total, self)
+        dialog.setCancelButton(None)
+        dialog.setWindowTitle("Сохранение")
+        dialog.setWindowModality(Qt.WindowModal)
+        dialog.setMinimumDuration(0)
+        dialog.setAutoClose(False)
+        dialog.setValue(self.save_progress)
+        self.close_dialog = dialog
+        self.save_worker.signals.finished.connect(self._on_close_save_finished)
+
+    def _on_close_save_finished(self, stats):
+        dialog, self.close_dialog = self.close_dialog, None
+        if dialog is not None:
+            dialog.close()
+        self.on_back_clicked()
+
+    def show_timing_panel(self):
+        """Панель замеров этапов (немодальная)"""
+        if self.timing_panel is None:
+            self.timing_panel = TimingPanel(self.chapter_paths["cleaning_folder"], self)
+        self.timing_panel.show()
+        self.timing_panel.raise_()
+
+    def _export_timing(self):
+        """Запись замеров сессии в Клининг/.timing (если что-то замерено)"""
+        if not self.timer.samples:
+            return
+        path = default_timing_path(self.chapter_paths["cleaning_folder"])
+        if self.timer.export_json(path, {"chapter": self.chapter_folder, "pages": len(self.img_paths)}):
+            logger.info(f"Замеры этапов сохранены: {path}\n{self.timer.report()}")
+
     def _init_content(self):
         """Инициализация основного содержимого"""
         c_layout = QHBoxLayout()
@@ -764,16 +932,15 @@ class CleaningWindow(QWidget):
 
         tw = THUMB_W
         th = tw * 2
+        thumbs = get_thumb_cache()
         for i, path in enumerate(self.img_paths):
             thumb_c = QWidget()
             thumb_lay = QVBoxLayout(thumb_c)
             thumb_lay.setContentsMargins(0, 0, 0, 0)
             thumb_lay.setSpacing(0)
             lbl = QLabel()
-            pm = QPixmap(path)
-            if not pm.isNull():
-                scl = pm.scaled(tw, th, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                lbl.setPixmap(scl)
+            # Миниатюра из кэша или фоновая генерация
+            thumbs.set_label_thumb(lbl, path, tw, th)
             lbl.setAlignment(Qt.AlignCenter)
             lbl.setStyleSheet("QLabel{background-color:#222;border:2px solid transparent;"
                               "border-top-left-radius:8px;border-top-right-radius:8px;}")
@@ -1190,6 +1357,20 @@ class CleaningWindow(QWidget):
                                     "font-size:14px;}QPushButton:hover{background-color:#7744AA;}")
         self.save_btn.clicked.connect(self.save_result)
 
+        # Отмена/повтор (Ctrl+Z / Ctrl+Y)
+        history_lay = QHBoxLayout()
+        self.undo_btn = QPushButton("Отменить")
+        self.redo_btn = QPushButton("Повторить")
+        for btn in (self.undo_btn, self.redo_btn):
+            btn.setStyleSheet("QPushButton{background-color:#555555;color:white;"
+                              "border-radius:8px;padding:6px 12px;"
+                              "font-size:14px;}QPushButton:hover{background-color:#666666;}")
+            history_lay.addWidget(btn)
+        self.undo_btn.clicked.connect(self.undo_page)
+        self.redo_btn.clicked.connect(self.redo_page)
+        QShortcut(QKeySequence.Undo, self, self.undo_page)
+        QShortcut(QKeySequence.Redo, self, self.redo_page)
+
         # Опции массовой обработки
         mass_options_lay = QHBoxLayout()
         self.mass_process_cb = QCheckBox("Обработать все изображения")
@@ -1198,10 +1379,16 @@ class CleaningWindow(QWidget):
         proc_lay.addLayout(mass_options_lay)
 
         # Добавляем кнопки
+        proc_lay.addLayout(history_lay)
         proc_lay.addWidget(self.reset_to_saved_btn)
         proc_lay.addWidget(self.reset_to_orig_btn)
         proc_lay.addWidget(self.save_btn)
 
+        self.fast_save_cb = QCheckBox("Быстрое сжатие PNG")
+        self.fast_save_cb.setToolTip("Для промежуточных сохранений: запись быстрее, файлы крупнее")
+        self.fast_save_cb.setStyleSheet("color:white;")
+        proc_lay.addWidget(self.fast_save_cb)
+
         proc_grp.setLayout(proc_lay)
         l.addWidget(proc_grp)
 
@@ -1264,53 +1451,62 @@ class CleaningWindow(QWidget):
 
         self.img_paths = valid_paths
 
-        for i, path in enumerate(self.img_paths):
-            try:
-                pixmap = QPixmap(path)
-                if pixmap.isNull():
-                    continue
-
-                # Определение оригинала
-                orig_path = self._find_original_path(path, i)
-                logger.debug(f"Страница {i}: путь={path}, оригинал={orig_path}")
-
-                # Загрузка оригинала
-                orig_pixmap = QPixmap(orig_path) if os.path.exists(orig_path) else pixmap.copy()
-
-                # Инициализация буфера с правильными копиями
-                if i not in self.circ_buf:
-                    self.circ_buf[i] = {
-                        0: QPixmap(orig_pixmap),  # Оригинал
-                        1: QPixmap(pixmap),  # Текущее состояние
-                        2: None,  # Промежуточное 1
-                        3: None  # Промежуточное 2
-                    }
-                    logger.debug(f"Инициализация буфера для страницы {i}")
-
-                # Установка в viewer
-                self.viewer.pixmaps[i] = pixmap
-                self.viewer.orig_pixmaps[i] = orig_pixmap
-                self.viewer.page_loading_status[i] = True
-
-                # Обновление остальных компонентов
-                if i < len(self.thumb_labels):
-                    self.thumb_labels[i].setPixmap(
-                        pixmap.scaled(THUMB_W, THUMB_W * 2, Qt.KeepAspectRatio, Qt.SmoothTransformation))
-
-                # Инициализация слоя рисования
-                if i not in self.viewer.draw_layers:
-                    layer = QPixmap(pixmap.width(), pixmap.height())
-                    layer.fill(Qt.transparent)
-                    self.viewer.draw_layers[i] = layer
-
-            except Exception as e:
-                logger.error(f"Ошибка загрузки {path}: {str(e)}")
-
         # Проверка корректности текущей страницы
         if self.viewer.cur_page >= len(self.img_paths):
             self.viewer.cur_page = 0
 
+        self._cancel_page_loading()
+        self.viewer.pixmaps = [QPixmap() for _ in self.img_paths]
+        self.viewer.page_loading_status = {i: False for i in range(len(self.img_paths))}
+
+        # Страницы декодируются в пуле (QImage) и приходят пакетами раз в кадр,
+        # текущая страница и соседние - первыми
+        if self.load_pool is None:
+            self.load_pool = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 2),
+                                                thread_name_prefix="clean_load")
+        self.page_loader = PageLoader(list(self.img_paths), self.load_pool)
+        self.page_loader.image_loaded.connect(self._on_page_loaded)
+        self.page_loader.loading_complete.connect(self._on_pages_loaded)
+        self.lock_ui("Загрузка")
+        self.page_loader.start_loading(self.viewer.cur_page)
+
+    def _on_page_loaded(self, page_idx, pixmap, current_file):
+        """Страница декодирована (GUI-поток)"""
+        if page_idx >= len(self.viewer.pixmaps):
+            return
+        self.viewer.pixmaps[page_idx] = pixmap
+        # Копия делит данные с pixmap до первого изменения страницы
+        self.viewer.orig_pixmaps[page_idx] = QPixmap(pixmap)
+        self.viewer.page_loading_status[page_idx] = True
+        self.detect_mgr.register_loaded(page_idx, pixmap)
+        self.disk_keys[page_idx] = pixmap.cacheKey()
+        # Миниатюры уже выставлены кэшем в _create_preview_panel,
+        # слой рисования создается лениво (при показе страницы или штрихе)
+        if page_idx == self.viewer.cur_page:
+            self.viewer.display_current_page()
+
+    def _on_pages_loaded(self):
+        """Все страницы главы загружены"""
+        self.page_loader = None
+        # Маски детекции/сегментации из кэша главы, без инференса, строятся при показе страницы;
+        # страницы с сохраненными масками подгружаются из них
+        self.detect_mgr.restore_detections(self, skip=self._stored_mask_pages())
         self.viewer.display_current_page()
+        self.unlock_ui()
+
+    def _on_model_hash_ready(self, kind):
+        """Хэш модели посчитан: маски текущей страницы можно восстановить из кэша"""
+        if not self.proc and self.detect_mgr.restore_page(self, self.viewer.cur_page):
+            self.viewer.scene_.update()
+
+    def _cancel_page_loading(self):
+        if self.page_loader is not None:
+            loader = self.page_loader
+            self.page_loader = None
+            loader.image_loaded.disconnect(self._on_page_loaded)
+            loader.loading_complete.disconnect(self._on_pages_loaded)
+            loader.cancel()
+            self.unlock_ui()
 
     def _find_original_path(self, current_path, index):
         """Поиск пути к оригинальному изображению в Предобработка/Originals"""
@@ -1352,7 +1548,7 @@ class CleaningWindow(QWidget):
         if 0 <= page_idx < len(self.thumb_labels):
             try:
                 # Если нет изображения — ничего не делаем
-                if page_idx not in self.viewer.pixmaps or self.viewer.pixmaps[page_idx].isNull():
+                if not (0 <= page_idx < len(self.viewer.pixmaps)) or self.viewer.pixmaps[page_idx].isNull():
                     return
 
                 # Копируем оригинал для миниатюры
@@ -1373,8 +1569,10 @@ class CleaningWindow(QWidget):
             return
 
         status = self.img_status.get(page_idx, 'saved')
+        self._schedule_mask_save()
 
-        has_active_masks = False
+        # Сохраненные маски еще не показанной страницы
+        has_active_masks = page_idx in getattr(self, 'mask_stored', ())
         if page_idx in self.viewer.masks:
             for mask in self.viewer.masks[page_idx]:
                 if not (hasattr(mask, 'deleted') and mask.deleted):
@@ -1382,16 +1580,8 @@ class CleaningWindow(QWidget):
                     break
 
         has_drawing = False
-        if page_idx in self.viewer.draw_layers and not self.viewer.draw_layers[page_idx].isNull():
-            qimg = self.viewer.draw_layers[page_idx].toImage()
-            for y in range(0, qimg.height(), 10):
-                for x in range(0, qimg.width(), 10):
-                    alpha = (qimg.pixel(x, y) >> 24) & 0xFF
-                    if alpha > 0:
-                        has_drawing = True
-                        break
-                if has_drawing:
-                    break
+        if page_idx in self.viewer.draw_layers:
+            has_drawing = self.viewer.draw_layers[page_idx].has_content()
 
         # Логика определения статуса
         if status == 'unsaved':
@@ -1429,6 +1619,7 @@ class CleaningWindow(QWidget):
             return False
         return True
 
+    @timed("mask.build")
     def upd_comb_mask(self, page_idx):
         if not self.is_valid_page_idx(page_idx):
             logger.debug(f"Невалидный индекс страницы: {page_idx}")
@@ -1439,7 +1630,7 @@ class CleaningWindow(QWidget):
                 logger.debug(f"Индекс {page_idx} выходит за границы")
                 return None
 
-            if page_idx in self.viewer.pixmaps and not self.viewer.pixmaps[page_idx].isNull():
+            if 0 <= page_idx < len(self.viewer.pixmaps) and not self.viewer.pixmaps[page_idx].isNull():
                 w = self.viewer.pixmaps[page_idx].width()
                 h = self.viewer.pixmaps[page_idx].height()
                 logger.debug(f"Размеры изображения {page_idx}: {w}x{h}")
@@ -1447,62 +1638,26 @@ class CleaningWindow(QWidget):
                 logger.debug(f"Отсутствует pixmap для страницы {page_idx}")
                 return None
 
-            combined_mask = np.zeros((h, w), dtype=np.uint8)
-            mask_found = False
-            mask_count = 0
-
-            if page_idx in self.viewer.masks:
-                for mask in self.viewer.masks[page_idx]:
-                    if hasattr(mask, 'deleted') and mask.deleted:
-                        continue
-                    mask_count += 1
-
-                    if isinstance(mask, EditableMask):
-                        rect = mask.rect()
-                        x1, y1 = int(rect.x()), int(rect.y())
-                        x2, y2 = int(x1 + rect.width()), int(y1 + rect.height())
-
-                        x1 = max(0, min(x1, w - 1))
-                        y1 = max(0, min(y1, h - 1))
-                        x2 = max(0, min(x2, w - 1))
-                        y2 = max(0, min(y2, h - 1))
-
-                        if x2 > x1 and y2 > y1:
-                            cv2.rectangle(combined_mask, (x1, y1), (x2, y2), 255, -1)
-                            mask_found = True
-
-                    elif isinstance(mask, EditablePolygonMask):
-                        polygon = mask.polygon()
-                        points = []
-                        for i in range(polygon.count()):
-                            point = polygon.at(i)
-                            x = max(0, min(int(point.x()), w - 1))
-                            y = max(0, min(int(point.y()), h - 1))
-                            points.append((x, y))
-
-                        if len(points) > 2:
-                            pts = np.array(points, np.int32).reshape((-1, 1, 2))
-                            cv2.fillPoly(combined_mask, [pts], 255)
-                            mask_found = True
-
-            logger.debug(f"Обработано {mask_count} масок")
-
-            if page_idx in self.viewer.draw_layers and not self.viewer.draw_layers[page_idx].isNull():
-                qimg = self.viewer.draw_layers[page_idx].toImage()
-                draw_mask = np.zeros((h, w), dtype=np.uint8)
-                pixels_found = 0
-
-                for y in range(h):
-                    for x in range(w):
-                        if x < qimg.width() and y < qimg.height():
-                            pixel = qimg.pixel(x, y)
-                            alpha = (pixel >> 24) & 0xFF
-                            if alpha > 0:
-                                draw_mask[y, x] = 255
-                                pixels_found += 1
+            # Послойная модель: перерастеризуются только изменившиеся элементы
+            model = self.mask_models.get(page_idx)
+            if model is None or (model.w, model.h) != (w, h):
+                model = PageMaskModel(w, h)
+                self.mask_models[page_idx] = model
+
+            active = [m for m in self.viewer.masks.get(page_idx, [])
+                      if isinstance(m, (EditableMask, EditablePolygonMask))
+                      and not getattr(m, 'deleted', False) and not getattr(m, 'processed', False)]
+            changed = model.sync(active)
+            mask_count = len(model)
+            mask_found = mask_count > 0
+            combined_mask = model.mask()
+            logger.debug(f"Обработано {mask_count} масок, перерастеризовано: {changed}")
+
+            if page_idx in self.viewer.draw_layers:
+                # Обходятся только созданные тайлы слоя
+                pixels_found = self.viewer.draw_layers[page_idx].mask_into(combined_mask)
 
                 if pixels_found > 0:
-                    cv2.bitwise_or(combined_mask, draw_mask, combined_mask)
                     mask_found = True
                     logger.debug(f"Добавлено {pixels_found} пикселей из слоя рисования")
 
@@ -1532,6 +1687,8 @@ class CleaningWindow(QWidget):
             self.clean_btn.setEnabled(False)
             self.reset_to_saved_btn.setEnabled(False)
             self.reset_to_orig_btn.setEnabled(False)
+            self.undo_btn.setEnabled(False)
+            self.redo_btn.setEnabled(False)
             self.save_btn.setEnabled(False)
             self.tool_btnNone.setEnabled(False)
             self.tool_btnBrush.setEnabled(False)
@@ -1554,6 +1711,8 @@ class CleaningWindow(QWidget):
             self.clean_btn.setEnabled(True)
             self.reset_to_saved_btn.setEnabled(True)
             self.reset_to_orig_btn.setEnabled(True)
+            self.undo_btn.setEnabled(True)
+            self.redo_btn.setEnabled(True)
             self.save_btn.setEnabled(True)
             self.tool_btnNone.setEnabled(True)
             self.tool_btnBrush.setEnabled(True)
@@ -1577,21 +1736,16 @@ class CleaningWindow(QWidget):
                                 f"Уже выполняется операция: {self.curr_op}. Дождитесь её завершения.")
             return
 
-        # Проверка LaMa
+        # Проверка LaMa (сама модель догружается в потоке очистки)
         if not self.inpaint_avail:
-            try:
-                from simple_lama_inpainting import SimpleLama
-                self.lama = SimpleLama()
-                self.inpaint_avail = True
-                logger.info("SimpleLama успешно инициализирован")
-            except ImportError:
-                QMessageBox.critical(self, "Ошибка",
-                                     "Модуль SimpleLama не установлен. Установите пакет simple_lama_inpainting.")
-                return
-            except Exception as e:
-                QMessageBox.critical(self, "Ошибка",
-                                     f"Не удалось инициализировать SimpleLama: {str(e)}")
-                return
+            QMessageBox.critical(self, "Ошибка",
+                                 "Модуль SimpleLama не установлен. Установите пакет simple_lama_inpainting.")
+            return
+        if self.models.state('lama') == ST_FAILED:
+            QMessageBox.critical(self, "Ошибка",
+                                 f"Не удалось инициализировать SimpleLama: {self.models.error('lama')}")
+            self.models.request('lama')  # повторная попытка при следующем запуске
+            return
 
         # Определяем страницы для обработки
         if self.clean_all_cb and self.clean_all_cb.isChecked():
@@ -1605,218 +1759,140 @@ class CleaningWindow(QWidget):
             QMessageBox.information(self, "Информация", "Нет страниц для очистки.")
             return
 
-        # Начинаем с первой страницы
+        # Счетчик завершенных страниц и очередь подачи воркеру
         self.clean_curr_page_idx = 0
         self.clean_total_pages = len(pages_to_clean)
         self.pages_to_clean = pages_to_clean
+        self.clean_queue = list(pages_to_clean)
+        self.clean_in_flight = 0
+        self.clean_skipped = []
+
+        self.lock_ui("Очистка")
+        self._upd_prog_bar(self.clean_prog, 0, self.clean_total_pages, "Подготовка очистки...")
 
-        # Запускаем очистку первой страницы
+        self._ensure_inpaint_worker()
         self.process_next_clean_page()
 
+    def _ensure_inpaint_worker(self):
+        """Постоянный поток LaMa (создается при первой очистке)"""
+        if self.inpaint_worker is None:
+            # Модель из общего реестра; пока окно открыто, она не выгружается
+            self.models.pin('lama')
+            self.inpaint_worker = InpaintWorker(loader=lambda: self.models.get('lama'))
+            self.inpaint_worker.page_started.connect(
+                lambda idx, msg: self._upd_prog_bar(
+                    self.clean_prog, self.clean_curr_page_idx, self.clean_total_pages,
+                    f"Страница {idx + 1}: {msg}", process_events=False))
+            self.inpaint_worker.page_done.connect(self._on_inpaint_done)
+            self.inpaint_worker.page_failed.connect(self._on_inpaint_failed)
+            self.inpaint_worker.start()
+        return self.inpaint_worker
+
     def process_next_clean_page(self):
-        """Обработка следующей страницы для очистки"""
-        # Проверяем, закончили ли все страницы
-        if self.clean_curr_page_idx >= len(self.pages_to_clean):
+        """Подает воркеру следующие страницы (не больше CLEAN_PREFETCH в работе)"""
+        while self.clean_queue and self.clean_in_flight < CLEAN_PREFETCH:
+            page_idx = self.clean_queue.pop(0)
+            job = self._prepare_clean_job(page_idx)
+            if job is None:
+                self.clean_curr_page_idx += 1
+                self.clean_skipped.append(page_idx)
+                continue
+            self.clean_in_flight += 1
+            self.inpaint_worker.submit(job)
+
+        if not self.clean_queue and self.clean_in_flight == 0:
+            self._finish_cleaning()
+
+    def _finish_cleaning(self):
+        """Завершение очистки всех страниц"""
+        skipped = self.clean_skipped
+        if len(skipped) == self.clean_total_pages:
+            QMessageBox.warning(self, "Предупреждение", "Ни одна страница не очищена: нет масок для очистки")
+        elif skipped:
+            pages = ", ".join(str(i + 1) for i in skipped[:10]) + ("..." if len(skipped) > 10 else "")
+            QMessageBox.information(self, "Успех", f"Очистка завершена. Без масок пропущены страницы: {pages}")
+        else:
             QMessageBox.information(self, "Успех", "Очистка всех изображений завершена")
-            self.clean_prog.setVisible(False)
-            self.unlock_ui()
-            return
-
-        # Получаем текущую страницу
-        page_idx = self.pages_to_clean[self.clean_curr_page_idx]
-
-        # Блокируем интерфейс
-        self.lock_ui("Очистка")
-
-        # Показываем прогресс
-        self.clean_prog.setRange(0, self.clean_total_pages)
-        self.clean_prog.setValue(self.clean_curr_page_idx)
-        self.clean_prog.setFormat(f"Подготовка очистки страницы {page_idx + 1}/{self.clean_total_pages}...")
-        self.clean_prog.setVisible(True)
-        QApplication.processEvents()
+        self.clean_prog.setVisible(False)
+        self.unlock_ui()
 
+    @timed("clean.prepare")
+    def _prepare_clean_job(self, page_idx):
+        """Готовит задание очистки страницы или None, если очищать нечего"""
+        self.prepare_page_masks(page_idx)
         try:
-            # Сохраняем текущее состояние в буфер
-            self.save_to_buf(page_idx)
-
             # Получаем текущее изображение
-            current_pixmap = None
-
-            if page_idx in self.viewer.pixmaps and not self.viewer.pixmaps[page_idx].isNull():
+            if 0 <= page_idx < len(self.viewer.pixmaps) and not self.viewer.pixmaps[page_idx].isNull():
                 current_pixmap = self.viewer.pixmaps[page_idx]
                 logger.info(f"Используем текущее изображение для страницы {page_idx + 1}")
             else:
-                # Если нет в памяти, используем из буфера
-                if page_idx in self.circ_buf:
-                    if self.circ_buf[page_idx][1] is not None:
-                        current_pixmap = self.circ_buf[page_idx][1].copy()
-                        self.viewer.pixmaps[page_idx] = current_pixmap
-                        logger.info(f"Загружено сохраненное изображение для страницы {page_idx + 1}")
-                    elif self.circ_buf[page_idx][3] is not None:
-                        current_pixmap = self.circ_buf[page_idx][3].copy()
-                        self.viewer.pixmaps[page_idx] = current_pixmap
-                        logger.info(f"Загружено последнее состояние для страницы {page_idx + 1}")
+                # Если нет в памяти, загружаем с диска
+                original_path = self.img_paths[page_idx]
+                current_pixmap = QPixmap(original_path)
+                if not current_pixmap.isNull():
+                    self.viewer.pixmaps[page_idx] = current_pixmap
+                    logger.info(f"Загружено исходное изображение: {original_path}")
                 else:
-                    # Если нет истории, используем исходное
-                    original_path = self.img_paths[page_idx]
-                    current_pixmap = QPixmap(original_path)
-                    if not current_pixmap.isNull():
-                        self.viewer.pixmaps[page_idx] = current_pixmap
-                        logger.info(f"Загружено исходное изображение: {original_path}")
-                    else:
-                        raise ValueError(f"Не удалось загрузить исходное изображение: {original_path}")
+                    raise ValueError(f"Не удалось загрузить исходное изображение: {original_path}")
 
             # Размеры изображения
             w, h = current_pixmap.width(), current_pixmap.height()
             logger.info(f"Изображение {page_idx + 1} размером {w}x{h}")
 
-            # Создаем пустую маску
-            mask = np.zeros((h, w), dtype=np.uint8)
-
-            # Получаем маски для текущей страницы
-            masks_drawn = False
-
-            # 1. Добавляем все видимые маски
-            if page_idx in self.viewer.masks:
-                mask_count = 0
-
-                for mask_item in self.viewer.masks[page_idx]:
-                    try:
-                        # Пропускаем удаленные
-                        if hasattr(mask_item, 'deleted') and mask_item.deleted:
-                            continue
-
-                        # НОВОЕ: Пропускаем уже обработанные маски
-                        if hasattr(mask_item, 'processed') and mask_item.processed:
-                            continue
-
-                        if isinstance(mask_item, EditableMask):
-                            rect = mask_item.rect()
-                            x, y, width, height = int(rect.x()), int(rect.y()), int(rect.width()), int(rect.height())
-
-                            # Проверка границ
-                            x1 = max(0, min(x, w - 1))
-                            y1 = max(0, min(y, h - 1))
-                            x2 = max(0, min(x + width, w - 1))
-                            y2 = max(0, min(y + height, h - 1))
-
-                            if x2 > x1 and y2 > y1:
-                                cv2.rectangle(mask, (x1, y1), (x2, y2), 255, -1)
-                                masks_drawn = True
-                                mask_count += 1
-
-                        elif isinstance(mask_item, EditablePolygonMask):
-                            polygon = mask_item.polygon()
-                            points = []
-
-                            for i in range(polygon.count()):
-                                point = polygon.at(i)
-                                x = max(0, min(int(point.x()), w - 1))
-                                y = max(0, min(int(point.y()), h - 1))
-                                points.append([x, y])
-
-                            if len(points) > 2:
-                                points_array = np.array(points, np.int32)
-                                cv2.fillPoly(mask, [points_array], 255)
-                                masks_drawn = True
-                                mask_count += 1
-
-                    except Exception as e:
-                        logger.error(f"Ошибка при обработке маски: {str(e)}")
-                        continue
-
-                logger.info(f"Добавлено {mask_count} масок из viewer.masks")
-
-            # 2. Добавляем слой рисования
-            try:
-                if page_idx in self.viewer.draw_layers and not self.viewer.draw_layers[page_idx].isNull():
-                    draw_layer = self.viewer.draw_layers[page_idx].toImage()
-                    pixels_found = 0
-                    for y in range(min(h, draw_layer.height())):
-                        for x in range(min(w, draw_layer.width())):
-                            pixel = draw_layer.pixel(x, y)
-                            alpha = (pixel >> 24) & 0xFF
-                            if alpha > 10:
-                                mask[y, x] = 255
-                                pixels_found += 1
-
-                    if pixels_found > 0:
-                        masks_drawn = True
-                        logger.info(f"Добавлен слой рисования: {pixels_found} пикселей")
-            except Exception as e:
-                logger.error(f"Ошибка при обработке слоя рисования: {str(e)}")
-
-            # 3. Используем comb_masks (только необработанные)
-            try:
-                if page_idx in self.comb_masks and np.any(self.comb_masks[page_idx]):
-                    combined_mask = self.comb_masks[page_idx]
-                    # Проверяем размер
-                    if combined_mask.shape[0] == h and combined_mask.shape[1] == w:
-                        mask = cv2.bitwise_or(mask, combined_mask)
-                        masks_drawn = True
-                    else:
-                        # Если не совпадают, делаем ресайз
-                        combined_resized = cv2.resize(combined_mask, (w, h), interpolation=cv2.INTER_NEAREST)
-                        mask = cv2.bitwise_or(mask, combined_resized)
-                        masks_drawn = True
-            except Exception as e:
-                logger.error(f"Ошибка при обработке комбинированной маски: {str(e)}")
+            # Маска из послойной модели (необработанные маски + слой рисования)
+            mask = self.upd_comb_mask(page_idx)
+            masks_drawn = mask is not None
+            if masks_drawn and mask.shape != (h, w):
+                mask = cv2.resize(mask, (w, h), interpolation=cv2.INTER_NEAREST)
 
             # Проверяем, есть ли маска
-            if not masks_drawn or np.sum(mask) == 0:
+            if not masks_drawn or not mask.any():
                 logger.warning(f"Страница {page_idx + 1} не имеет масок для очистки, пропускаем")
+                return None
 
-                # Переходим к следующей
-                self.clean_curr_page_idx += 1
-                QTimer.singleShot(100, self.process_next_clean_page)
-                return
+            # Морфология уже применена в upd_comb_mask
 
-            # Улучшаем маску
-            kernel = np.ones((3, 3), np.uint8)
-            mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-            mask = cv2.dilate(mask, kernel, iterations=1)
+            pixel_count = int(np.count_nonzero(mask))
+            logger.info(f"Создана маска с {pixel_count} непрозрачными пикселями")
 
-            # НЕ СОХРАНЯЕМ отладочную маску на диск
+            self.img_status[page_idx] = 'modified'
+            self.upd_thumb_status(page_idx)
 
-            # Показываем прогресс
-            pixel_count = np.sum(mask > 0)
-            logger.info(f"Создана маска с {pixel_count} непрозрачными пикселями")
-            self._upd_prog_bar(
-                self.clean_prog, self.clean_curr_page_idx, self.clean_total_pages,
-                f"Очистка страницы {page_idx + 1}/{self.clean_total_pages}: {pixel_count} пикселей")
-
-            # Воркер для очистки БЕЗ сохранения на диск
-            worker = ImgCleanWorker(
-                self.lama,
-                current_pixmap,
-                mask,
-                page_idx
-            )
-
-            # Сигналы
-            worker.prog.connect(lambda v, t, m, idx=page_idx:
-                                self._upd_prog_bar(
-                                    self.clean_prog,
-                                    self.clean_curr_page_idx + v / t,
-                                    self.clean_total_pages,
-                                    f"Страница {idx + 1}/{self.clean_total_pages}: {m}"))
-            worker.err.connect(lambda e: QMessageBox.critical(self, "Ошибка", e))
-
-            # Для обработки следующей страницы (БЕЗ пути к файлу)
-            worker.done_img.connect(self._on_img_cleaned_batch)
-            # Запускаем очистку
-            self.clean_workers = [worker]
-            worker.start()
+            # Массивы передаются воркеру напрямую, без PNG
+            rgb = qimage_to_rgb(current_pixmap.toImage())
+
+            # Для истории достаточно рамки маски: вне ее пиксели не меняются
+            x, y, bw, bh = cv2.boundingRect(mask)
+            self.clean_before[page_idx] = ((x, y, x + bw, y + bh), rgb[y:y + bh, x:x + bw].copy())
+            return InpaintJob(page_idx, rgb, mask)
 
         except Exception as e:
             logger.error(f"Ошибка при подготовке очистки страницы {page_idx}: {str(e)}")
             import traceback
             logger.error(traceback.format_exc())
             QMessageBox.critical(self, "Ошибка", f"Не удалось запустить очистку страницы {page_idx + 1}: {str(e)}")
+            return None
 
-            # Переходим к следующей
-            self.clean_curr_page_idx += 1
-            QTimer.singleShot(100, self.process_next_clean_page)
+    @timed("clean.apply")
+    def _on_inpaint_done(self, page_idx, result):
+        """Результат LaMa: QImage поверх буфера массива, копия только в QPixmap"""
+        self.clean_in_flight -= 1
+        self.clean_curr_page_idx += 1
+        rect, before = self.clean_before.pop(page_idx, (None, None))
+        if rect is not None:
+            x0, y0, x1, y1 = rect
+            self.history.push(page_idx, rect, before, result[y0:y1, x0:x1])
+        self._on_img_cleaned_batch(page_idx, QPixmap.fromImage(rgb_to_qimage(result)))
+        self._upd_prog_bar(self.clean_prog, self.clean_curr_page_idx, self.clean_total_pages,
+                           f"Очищено {self.clean_curr_page_idx}/{self.clean_total_pages}", process_events=False)
+        self.process_next_clean_page()
+
+    def _on_inpaint_failed(self, page_idx, message):
+        self.clean_in_flight -= 1
+        self.clean_before.pop(page_idx, None)
+        self.clean_curr_page_idx += 1
+        QMessageBox.critical(self, "Ошибка", f"Ошибка очистки страницы {page_idx + 1}: {message}")
+        self.process_next_clean_page()
 
     def _on_img_cleaned_batch(self, page_idx, result_pixmap):
         try:
@@ -1825,19 +1901,6 @@ class CleaningWindow(QWidget):
 
                 self.viewer.pixmaps[page_idx] = result_pixmap
 
-                if page_idx not in self.circ_buf:
-                    self.circ_buf[page_idx] = {
-                        0: None,
-                        1: None,
-                        2: None,
-                        3: None
-                    }
-
-                if self.circ_buf[page_idx][1] is not None:
-                    self.circ_buf[page_idx][2] = self.circ_buf[page_idx][1].copy()
-
-                self.circ_buf[page_idx][1] = result_pixmap.copy()
-
                 # Полное удаление масок
                 if page_idx in self.viewer.masks:
                     for mask in self.viewer.masks[page_idx]:
@@ -1846,10 +1909,7 @@ class CleaningWindow(QWidget):
                     self.viewer.masks[page_idx] = []
 
                 # Очистка слоя рисования
-                if page_idx in self.viewer.draw_layers:
-                    self.viewer.draw_layers[page_idx].fill(Qt.transparent)
-                    if page_idx in self.viewer.draw_items:
-                        self.viewer.draw_items[page_idx].setPixmap(self.viewer.draw_layers[page_idx])
+                self.viewer.clear_draw_layer(page_idx)
 
                 # Очистка комбинированной маски
                 if page_idx in self.comb_masks:
@@ -1866,14 +1926,8 @@ class CleaningWindow(QWidget):
                 self.thumb_labels[page_idx].setPixmap(scaled)
                 self.upd_thumb_status(page_idx)
 
-            self.clean_curr_page_idx += 1
-            self.clean_workers = []
-            QTimer.singleShot(100, self.process_next_clean_page)
-
         except Exception as e:
             logger.error(f"Ошибка при обработке результата очистки: {str(e)}")
-            self.clean_curr_page_idx += 1
-            QTimer.singleShot(100, self.process_next_clean_page)
 
     def force_upd_display(self):
         """Принудительное обновление отображения"""
@@ -1882,7 +1936,7 @@ class CleaningWindow(QWidget):
     def upd_all_thumbs(self):
         """Обновляет все миниатюры"""
         for page_idx in range(len(self.img_paths)):
-            if page_idx in self.viewer.pixmaps and not self.viewer.pixmaps[page_idx].isNull():
+            if 0 <= page_idx < len(self.viewer.pixmaps) and not self.viewer.pixmaps[page_idx].isNull():
                 # Обновляем миниатюру
                 self.upd_thumb_no_mask(page_idx)
 
@@ -1938,14 +1992,7 @@ class CleaningWindow(QWidget):
         self.saved_detect_exp = value
 
         if self.sender() == self.expand_slider:
-            if self.detect_all_cb and self.detect_all_cb.isChecked():
-                # Обновляем все страницы
-                for page_idx in range(len(self.img_paths)):
-                    if page_idx in self.viewer.masks:
-                        self._upd_masks_exp(page_idx, 'detect', value)
-            else:
-                # Только текущую
-                self._upd_masks_exp(self.viewer.cur_page, 'detect', value)
+            self._queue_exp_change('detect', value, bool(self.detect_all_cb and self.detect_all_cb.isChecked()))
 
     def on_segm_exp_val_changed(self, value):
         """Обработка изменения значения расширения маски сегментации"""
@@ -1953,14 +2000,28 @@ class CleaningWindow(QWidget):
         self.saved_segm_exp = value
 
         if self.sender() == self.segm_expand_slider:
-            if self.segm_all_cb and self.segm_all_cb.isChecked():
-                # Обновляем все страницы
+            self._queue_exp_change('segm', value, bool(self.segm_all_cb and self.segm_all_cb.isChecked()))
+
+    def _queue_exp_change(self, kind, value, all_pages):
+        """Расширение применяется после паузы в движении слайдера"""
+        self.exp_changes[kind] = (value, all_pages)
+        self.exp_timer.start(EXP_APPLY_MS)
+
+    def _apply_exp_changes(self):
+        """Текущая страница пересобирается сразу, остальные - при показе или очистке"""
+        changes, self.exp_changes = self.exp_changes, {}
+        cur = self.viewer.cur_page
+        for kind, (value, all_pages) in changes.items():
+            if all_pages:
                 for page_idx in range(len(self.img_paths)):
-                    if page_idx in self.viewer.masks:
-                        self._upd_masks_exp(page_idx, 'segm', value)
-            else:
-                # Только текущую
-                self._upd_masks_exp(self.viewer.cur_page, 'segm', value)
+                    if page_idx != cur:
+                        self.exp_pending.setdefault(page_idx, {})[kind] = value
+            self._apply_page_exp(cur, kind, value)
+
+    def _apply_page_exp(self, page_idx, kind, value):
+        # Из кэша результатов маски строятся заново, иначе масштабируются существующие
+        if page_idx in self.viewer.masks and not self.detect_mgr.refilter_page(self, page_idx, kind, value):
+            self._upd_masks_exp(page_idx, kind, value)
 
     def on_prev_page(self):
         """Переход на предыдущую страницу"""
@@ -2058,7 +2119,7 @@ class CleaningWindow(QWidget):
     def _on_detection_completed(self, page_idx, results):
         try:
             if results:
-                logger.info(f"Получены результаты детекции для страницы {page_idx}: {len(results)} объектов")
+                logger.info(f"Получены результаты детекции для страницы {page_idx}: {len(results['conf'])} объектов")
                 self.sync_det_classes()
 
                 current_transform = None
@@ -2069,7 +2130,7 @@ class CleaningWindow(QWidget):
                     current_scale = self.viewer.scale_factor
 
                 img_shape = None
-                if page_idx in self.viewer.pixmaps and not self.viewer.pixmaps[page_idx].isNull():
+                if 0 <= page_idx < len(self.viewer.pixmaps) and not self.viewer.pixmaps[page_idx].isNull():
                     w = self.viewer.pixmaps[page_idx].width()
                     h = self.viewer.pixmaps[page_idx].height()
                     img_shape = (h, w)
@@ -2092,8 +2153,6 @@ class CleaningWindow(QWidget):
                     QTimer.singleShot(100, lambda: self.viewer.display_current_page())
                     if current_transform is not None:
                         QTimer.singleShot(200, lambda: self.viewer.setTransform(current_transform))
-
-                QApplication.processEvents()
             else:
                 logger.warning(f"Не найдено объектов на странице {page_idx + 1}")
 
@@ -2104,7 +2163,8 @@ class CleaningWindow(QWidget):
             total_pages = self.total_pages if hasattr(self, 'total_pages') else 1
 
             if current_progress >= total_pages:
-                self._upd_prog_bar(self.detect_prog, total_pages, total_pages, "Детекция завершена")
+                self._upd_prog_bar(self.detect_prog, total_pages, total_pages, "Детекция завершена",
+                                   process_events=False)
                 for i in range(len(self.img_paths)):
                     if i in self.viewer.masks and self.viewer.masks[i]:
                         self.upd_thumb_no_mask(i)
@@ -2117,7 +2177,7 @@ class CleaningWindow(QWidget):
         if 0 <= page_idx < len(self.thumb_labels):
             try:
                 # Если нет изображения — ничего не делаем
-                if page_idx not in self.viewer.pixmaps or self.viewer.pixmaps[page_idx].isNull():
+                if not (0 <= page_idx < len(self.viewer.pixmaps)) or self.viewer.pixmaps[page_idx].isNull():
                     return
 
                 # Копируем оригинал для миниатюры
@@ -2185,14 +2245,16 @@ class CleaningWindow(QWidget):
             self.viewer.masks[page_idx] = []
 
         # Очищаем слой рисования
-        if page_idx in self.viewer.draw_layers:
-            self.viewer.draw_layers[page_idx].fill(Qt.transparent)
-            if page_idx in self.viewer.draw_items:
-                self.viewer.draw_items[page_idx].setPixmap(self.viewer.draw_layers[page_idx])
+        self.viewer.clear_draw_layer(page_idx)
 
         # Удаляем комбинированную маску
         if page_idx in self.comb_masks:
             del self.comb_masks[page_idx]
+        self.mask_models.pop(page_idx, None)
+
+        # Очищенные маски не восстанавливаются из кэша при повторном открытии
+        self.detect_mgr.mark_applied(self, page_idx, 'detect', False)
+        self.detect_mgr.mark_applied(self, page_idx, 'segm', False)
 
     def run_detection(self):
         """Запускает процесс детекции"""
@@ -2226,7 +2288,6 @@ class CleaningWindow(QWidget):
         self.detect_prog.setValue(0)
         self.detect_prog.setFormat("Подготовка детекции...")
         self.detect_prog.setVisible(True)
-        QApplication.processEvents()
 
         # Страницы для обработки
         if self.detect_all_cb and self.detect_all_cb.isChecked():
@@ -2241,6 +2302,7 @@ class CleaningWindow(QWidget):
         self.current_page_index = 0
         self.expansion_value = self.expand_slider.value()
         self.saved_detect_exp = self.expansion_value
+        self._save_clean_settings()
 
         # Флаг отмены
         self.det_canc = False
@@ -2272,8 +2334,9 @@ class CleaningWindow(QWidget):
     def cancel_detection(self):
         """Отменяет процесс детекции"""
         self.det_canc = True
+        self.detect_mgr.cancel_batch('detect')
         QMessageBox.information(self, "Информация",
-                                "Детекция будет отменена после завершения текущей страницы")
+                                "Детекция будет отменена после завершения текущего пакета страниц")
 
         # Блокируем кнопку
         self.detect_btn.setEnabled(False)
@@ -2288,57 +2351,28 @@ class CleaningWindow(QWidget):
                                     f"Уже выполняется операция: {self.curr_op}. Дождитесь её завершения.")
                 return
 
-            # Путь к изображению
-            image_path = self.img_paths[page_idx]
-
             # Прогресс
             self.detect_prog.setVisible(True)
             self.detect_prog.setValue(0)
             self.detect_prog.setFormat("Подготовка детекции области...")
-            QApplication.processEvents()
 
             # Блокируем интерфейс
             self.lock_ui("Детекция области")
+            expansion = self.expand_slider.value()
 
-            # Отдельный поток
-            def run_detection_thread():
-                try:
-                    # Запускаем через менеджер
-                    results, offset = self.detect_mgr.detect_area(
-                        image_path, page_idx, selection_rect, self.expand_slider.value())
-
-                    if results is not None:
-                        self.detect_mgr.process_detection_results(
-                            results, self.viewer, page_idx, self.expand_slider.value(),
-                            img_shape=None, offset=offset)
-
-                        # Обновляем маску
-                        self.upd_comb_mask(page_idx)
-
-                        # Обновляем отображение
-                        QTimer.singleShot(100, self.viewer.display_current_page)
-
-                    # Завершаем прогресс
-                    QTimer.singleShot(0, lambda: self._upd_prog_bar(
-                        self.detect_prog, 1, 1, "Детекция области завершена"))
-
-                    # Скрываем прогресс
-                    QTimer.singleShot(PROG_HIDE_MS,
-                                      lambda: self.detect_prog.setVisible(False))
-
-                    # Разблокируем
-                    QTimer.singleShot(100, self.unlock_ui)
+            def on_result(results, offset):
+                self.detect_mgr.process_detection_results(
+                    results, self.viewer, page_idx, expansion, img_shape=None, offset=offset)
+                self.upd_comb_mask(page_idx)
+                self.viewer.display_current_page()
 
-                except Exception as e:
-                    logger.error(f"Ошибка детекции области: {str(e)}")
-                    QTimer.singleShot(0, lambda: QMessageBox.critical(self, "Ошибка",
-                                                                      f"Ошибка детекции области: {str(e)}"))
-                    QTimer.singleShot(0, self.unlock_ui)
+            def on_finish(cancelled):
+                self._upd_prog_bar(self.detect_prog, 1, 1, "Детекция области завершена", process_events=False)
+                QTimer.singleShot(PROG_HIDE_MS, lambda: self.detect_prog.setVisible(False))
+                self.unlock_ui()
 
-            # Запускаем поток
-            thread = Thread(target=run_detection_thread)
-            thread.daemon = True
-            thread.start()
+            # Инференс выполняется в потоке DetectionManager
+            self.detect_mgr.detect_area(self, page_idx, selection_rect, on_result, on_finish)
 
         except Exception as e:
             logger.error(f"Ошибка запуска детекции области: {str(e)}")
@@ -2374,7 +2408,6 @@ class CleaningWindow(QWidget):
         self.segm_prog.setValue(0)
         self.segm_prog.setFormat("Подготовка сегментации...")
         self.segm_prog.setVisible(True)
-        QApplication.processEvents()
 
         # Страницы для обработки
         if self.segm_all_cb and self.segm_all_cb.isChecked():
@@ -2389,6 +2422,7 @@ class CleaningWindow(QWidget):
         self.segm_current_page_index = 0
         self.segm_expansion_value = self.segm_expand_slider.value()
         self.saved_segm_exp = self.segm_expansion_value
+        self._save_clean_settings()
 
         # Флаг отмены
         self.segm_canc = False
@@ -2418,8 +2452,9 @@ class CleaningWindow(QWidget):
     def cancel_segmentation(self):
         """Отменяет процесс сегментации"""
         self.segm_canc = True
+        self.detect_mgr.cancel_batch('segm')
         QMessageBox.information(self, "Информация",
-                                "Сегментация будет отменена после завершения текущей страницы")
+                                "Сегментация будет отменена после завершения текущего пакета страниц")
 
         # Блокируем кнопку
         self.segm_btn.setEnabled(False)
@@ -2471,16 +2506,37 @@ class CleaningWindow(QWidget):
             else:
                 logger.warning(f"Класс сегментации {cls_name} не найден в словаре")
 
-                # Обновляем текущую страницу
-            if self.viewer.cur_page is not None:
-                for mask in self.viewer.masks.get(self.viewer.cur_page, []):
-                    if hasattr(mask, 'class_name') and hasattr(mask, 'mask_type'):
-                        classes_dict = self.detect_cls if mask.mask_type == 'detect' else self.segm_cls
-                        if mask.class_name in classes_dict:
-                            mask.setVisible(classes_dict[mask.class_name]['enabled'])
+        self._save_clean_settings()
+        self._refilter_masks(model_type)
+
+    def _refilter_masks(self, model_type, expansion=None):
+        """
+        Пересобирает маски из кэша результатов (без инференса). Для страниц
+        без кэша только скрывает маски отключенных классов.
+        """
+        all_cb = self.detect_all_cb if model_type == 'detect' else self.segm_all_cb
+        if all_cb and all_cb.isChecked():
+            pages = list(range(len(self.img_paths)))
+        else:
+            pages = [self.viewer.cur_page]
+        classes_dict = self.detect_cls if model_type == 'detect' else self.segm_cls
 
-                # Обновляем отображение
-                self.viewer.display_current_page()
+        rebuilt = 0
+        for page_idx in pages:
+            if page_idx is None:
+                continue
+            if self.detect_mgr.refilter_page(self, page_idx, model_type, expansion):
+                rebuilt += 1
+            elif page_idx == self.viewer.cur_page:
+                for mask in self.viewer.masks.get(page_idx, []):
+                    if getattr(mask, 'mask_type', None) == model_type and mask.class_name in classes_dict:
+                        mask.setVisible(classes_dict[mask.class_name]['enabled'])
+        if rebuilt:
+            logger.info(f"Маски {model_type} пересобраны из кэша на {rebuilt} стр.")
+
+        # Обновляем отображение
+        self.viewer.display_current_page()
+        return rebuilt
 
     def reset_to_orig(self):
         """Сброс изображения к исходному оригиналу с диска как при первом запуске"""
@@ -2635,7 +2691,8 @@ class CleaningWindow(QWidget):
                         # ВАЖНО: Удаляем старый слой рисования
                         if page_idx in self.viewer.draw_layers:
                             if page_idx in self.viewer.draw_items:
-                                self.viewer.scene_.removeItem(self.viewer.draw_items[page_idx])
+                                if self.viewer.draw_items[page_idx].scene():
+                                    self.viewer.scene_.removeItem(self.viewer.draw_items[page_idx])
                                 del self.viewer.draw_items[page_idx]
                             del self.viewer.draw_layers[page_idx]
 
@@ -2648,20 +2705,8 @@ class CleaningWindow(QWidget):
 
                         reset_count += 1
 
-                        # Обновляем буфер как при первом запуске
-                        if page_idx not in self.circ_buf:
-                            self.circ_buf[page_idx] = {
-                                0: None,
-                                1: None,
-                                2: None,
-                                3: None
-                            }
-
-                        # Обновляем позиции буфера
-                        self.circ_buf[page_idx][0] = QPixmap(orig_pixmap)  # Сохраняем оригинал
-                        self.circ_buf[page_idx][1] = QPixmap(orig_pixmap)  # Текущее состояние = оригинал
-                        self.circ_buf[page_idx][2] = None  # Очищаем промежуточные
-                        self.circ_buf[page_idx][3] = None
+                        # История как при первом запуске
+                        self.history.clear(page_idx)
 
                         # Удаление ВСЕХ масок
                         if page_idx in self.viewer.masks:
@@ -2765,13 +2810,8 @@ class CleaningWindow(QWidget):
                         self.viewer.pixmaps[page_idx] = saved_pixmap
                         reset_count += 1
 
-                        # Обновляем буфер
-                        if page_idx not in self.circ_buf:
-                            self.circ_buf[page_idx] = {0: None, 1: None, 2: None, 3: None}
-
-                        self.circ_buf[page_idx][1] = saved_pixmap.copy()
-                        self.circ_buf[page_idx][2] = None
-                        self.circ_buf[page_idx][3] = None
+                        # История после сброса начинается заново
+                        self.history.clear(page_idx)
 
                         # Очищаем маски и слои
                         self._clear_all_masks_for_page(page_idx)
@@ -2798,61 +2838,133 @@ class CleaningWindow(QWidget):
             logger.error(f"Ошибка при сбросе: {str(e)}")
             QMessageBox.critical(self, "Ошибка", f"Не удалось сбросить изображения: {str(e)}")
 
+    @timed("save.collect")
     def save_result(self):
-        """Сохранение изображений с принудительной заменой"""
+        """
+        Сохранение измененных страниц (статус modified/unsaved): PNG кодируются
+        в фоне из QImage, файлы заменяются атомарно. Страницы, пиксели которых
+        совпадают с файлом, не перекодируются.
+        """
+        if self.save_worker is not None:
+            QMessageBox.information(self, "Информация", "Сохранение уже выполняется")
+            return
+
         output_dir = self.chapter_paths["cleaning_folder"]
         os.makedirs(output_dir, exist_ok=True)
 
         # Определение страниц для сохранения
         pages_to_save = list(range(len(self.img_paths))) if self.mass_process_cb.isChecked() else [self.viewer.cur_page]
 
-        saved_count = 0
-
+        jobs = []
+        unchanged = []
         for page_idx in pages_to_save:
             # Правильная проверка для списка
             if page_idx >= len(self.viewer.pixmaps) or self.viewer.pixmaps[page_idx].isNull():
                 continue
+            if self.img_status.get(page_idx) not in ('modified', 'unsaved'):
+                continue
 
             pixmap = self.viewer.pixmaps[page_idx]
+            save_path = os.path.join(output_dir, os.path.basename(self.img_paths[page_idx]))
 
-            # Формирование имени файла
-            filename = os.path.basename(self.img_paths[page_idx])
-            save_path = os.path.join(output_dir, filename)
+            # Изменены только маски - файл уже содержит эти пиксели
+            if (self.disk_keys.get(page_idx) == pixmap.cacheKey()
+                    and os.path.normcase(os.path.abspath(self.img_paths[page_idx])) ==
+                    os.path.normcase(os.path.abspath(save_path))):
+                unchanged.append(page_idx)
+                continue
 
-            # Сохранение
-            if pixmap.save(save_path, "PNG"):
-                saved_count += 1
-                self.img_paths[page_idx] = save_path
+            self.save_keys[page_idx] = pixmap.cacheKey()
+            jobs.append((page_idx, pixmap.toImage(), save_path))
 
-                # Обновляем буфер
-                if page_idx not in self.circ_buf:
-                    self.circ_buf[page_idx] = {0: None, 1: pixmap.copy(), 2: None, 3: None}
-                else:
-                    self.circ_buf[page_idx][1] = pixmap.copy()
+        for page_idx in unchanged:
+            self._finish_page_save(page_idx)
+        # Сохраненные вручную страницы пакетная очистка (m8_8) не перезаписывает
+        self.saved_done = [self.img_paths[page_idx] for page_idx in unchanged]
 
-                # Помечаем маски как обработанные
-                if page_idx in self.viewer.masks:
-                    for mask in self.viewer.masks[page_idx]:
-                        mask.processed = True
-                        mask.setVisible(False)
+        if not jobs:
+            record_done_pages(output_dir, self.saved_done)
+            if unchanged:
+                QMessageBox.information(self, "Успех", f"Сохранено {len(unchanged)} изображений")
+            else:
+                QMessageBox.information(self, "Информация", "Нет изменений для сохранения")
+            return
 
-                # Очистка слоя рисования
-                if page_idx in self.viewer.draw_layers:
-                    self.viewer.draw_layers[page_idx].fill(Qt.transparent)
-                    if page_idx in self.viewer.draw_items:
-                        self.viewer.draw_items[page_idx].setPixmap(self.viewer.draw_layers[page_idx])
+        self.save_unchanged = len(unchanged)
+        self.save_progress = 0
+        self.save_btn.setEnabled(False)
+        self.save_btn.setText("Сохранение...")
+
+        quality = PNG_QUALITY_FAST if self.fast_save_cb.isChecked() else PNG_QUALITY_DEF
+        worker = PageSaveWorker(jobs, quality)
+        worker.signals.page_saved.connect(self._on_page_saved)
+        worker.signals.page_failed.connect(self._on_page_save_failed)
+        worker.signals.finished.connect(self._on_save_finished)
+        self.save_worker = worker
+        QThreadPool.globalInstance().start(worker)
+
+    def _finish_page_save(self, page_idx):
+        """Маски страницы помечаются обработанными, слой рисования очищается"""
+        if page_idx in self.viewer.masks:
+            for mask in self.viewer.masks[page_idx]:
+                mask.processed = True
+                mask.setVisible(False)
 
-                self.img_status[page_idx] = 'saved'
-                self.upd_thumb_status(page_idx)
+        self.viewer.clear_draw_layer(page_idx)
 
-        # Обновление конфигурации
-        if saved_count > 0:
-            config_path = os.path.join(output_dir, "saved_images.json")
-            with open(config_path, 'w', encoding='utf-8') as f:
-                json.dump({"paths": self.img_paths}, f, ensure_ascii=False, indent=4)
+        self.img_status[page_idx] = 'saved'
+        self.upd_thumb_status(page_idx)
+
+    def _advance_save_progress(self):
+        self.save_progress += 1
+        if self.close_dialog is not None:
+            self.close_dialog.setValue(self.save_progress)
+
+    def _on_page_save_failed(self, page_idx, message):
+        self.save_keys.pop(page_idx, None)
+        self._advance_save_progress()
 
-        if saved_count > 0:
-            QMessageBox.information(self, "Успех", f"Сохранено {saved_count} изображений")
+    def _on_page_saved(self, page_idx, path):
+        """Страница записана на диск"""
+        self._advance_save_progress()
+        key = self.save_keys.pop(page_idx, None)
+        self.img_paths[page_idx] = path
+
+        pixmap = self.viewer.pixmaps[page_idx]
+        if pixmap.cacheKey() == key:
+            self.disk_keys[page_idx] = key
+            self.saved_done.append(path)
+            self.detect_mgr.register_loaded(page_idx, pixmap)
+            self._finish_page_save(page_idx)
+        else:
+            # Страница изменилась во время записи - статус не трогаем
+            logger.debug(f"Страница {page_idx} изменена во время сохранения")
+
+    def _on_save_finished(self, stats):
+        """Обновление конфигурации и итог сохранения"""
+        self.save_worker = None
+        self.save_btn.setEnabled(not self.proc)
+        self.save_btn.setText("Сохранить результат")
+        record_done_pages(self.chapter_paths["cleaning_folder"], self.saved_done)
+        self.saved_done = []
+
+        if stats["saved"] > 0:
+            try:
+                write_json_atomic(os.path.join(self.chapter_paths["cleaning_folder"], "saved_images.json"),
+                                  {"paths": self.img_paths})
+            except Exception as e:
+                logger.error(f"Ошибка записи saved_images.json: {e}")
+
+        saved = stats["saved"] + self.save_unchanged
+        if stats["errors"]:
+            error_text = "\n".join(stats["errors"][:5])
+            QMessageBox.warning(self, "Сохранение завершено с ошибками",
+                                f"Сохранено {saved} изображений.\n\nОшибки:\n{error_text}")
+        elif self.close_dialog is not None:
+            # Окно закрывается сразу после записи
+            logger.info(f"Сохранено {saved} изображений перед закрытием")
+        else:
+            QMessageBox.information(self, "Успех", f"Сохранено {saved} изображений")
 
     def force_save_current(self):
         """Принудительное сохранение текущего изображения"""
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# ui/windows/m8_10_mask_store.py
+import os
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PySide6.QtWidgets import QGraphicsRectItem, QGraphicsPolygonItem
+
+from ui.windows.m8_4_mask_engine import polygon_points, item_geometry_key
+
+logger = logging.getLogger(__name__)
+
+# Версия формата файлов масок (другая версия считается устаревшей)
+MASK_FORMAT = 1
+
+
+def rle_encode(bits):
+    """Длины серий бинарного массива (построчно), первая серия - нули"""
+    flat = np.asarray(bits, dtype=bool).ravel()
+    if not flat.size:
+        return np.zeros(0, dtype=np.uint32)
+    change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    runs = np.diff(np.concatenate(([0], change, [flat.size])))
+    if flat[0]:
+        runs = np.concatenate(([0], runs))
+    return runs.astype(np.uint32)
+
+
+def rle_decode(runs, shape):
+    """Бинарный массив shape из длин серий rle_encode"""
+    values = (np.arange(len(runs)) % 2).astype(bool)
+    return np.repeat(values, np.asarray(runs, dtype=np.int64)).reshape(shape)
+
+
+def page_fingerprint(masks, layer):
+    """Отпечаток состояния масок страницы: меняется при любой правке элементов или слоя"""
+    items = tuple((id(m), item_geometry_key(m), bool(getattr(m, 'deleted', False)),
+                   bool(getattr(m, 'processed', False)), getattr(m, 'class_name', None))
+                  for m in masks)
+    return items, (layer.rev if layer is not None else None)
+
+
+def snapshot_page(masks, layer, color):
+    """
+    Снимок масок страницы в простых данных (в GUI-потоке): элементы в координатах
+    страницы и бинарные маски тайлов слоя. None, если сохранять нечего.
+    """
+    items = []
+    for m in masks:
+        if getattr(m, 'deleted', False) or getattr(m, 'processed', False):
+            continue
+        ox, oy = m.pos().x(), m.pos().y()
+        entry = {
+            "mask_type": getattr(m, 'mask_type', None),
+            "cls": getattr(m, 'class_name', None),
+            "conf": float(getattr(m, 'confidence', 0.0) or 0.0),
+            "exp": getattr(m, 'last_expansion', 0),
+        }
+        if isinstance(m, QGraphicsRectItem):
+            r = m.rect()
+            entry["rect"] = [r.x() + ox, r.y() + oy, r.width(), r.height()]
+        elif isinstance(m, QGraphicsPolygonItem):
+            pts = polygon_points(m)
+            if len(pts) < 3:
+                continue
+            entry["poly"] = np.round(pts + (ox, oy), 2).tolist()
+        else:
+            continue
+        items.append(entry)
+
+    tiles = {}
+    if layer is not None:
+        for key in list(layer.tiles):
+            bits = layer._tile_alpha(key) > 0
+            if bits.any():
+                tiles[key] = bits
+    if not items and not tiles:
+        return None
+
+    snap = {"items": items, "tiles": tiles}
+    if layer is not None:
+        snap["layer"] = {"w": layer.w, "h": layer.h, "tile": layer.tile, "color": list(color[:3])}
+    return snap
+
+
+class MaskStore:
+    """
+    Дисковое хранилище масок главы по страницам: <имя>.masks.json (боксы и
+    полигоны с классом, уверенностью и расширением) и <имя>.layer.npz (тайлы
+    слоя рисования в RLE). Запись идет в одном фоновом потоке в порядке
+    постановки, файлы заменяются атомарно. Сигнатура изображения в JSON
+    отбрасывает маски, если файл страницы изменился.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mask_store")
+
+    def _json(self, name):
+        return os.path.join(self.folder, f"{name}.masks.json")
+
+    def _npz(self, name):
+        return os.path.join(self.folder, f"{name}.layer.npz")
+
+    def has(self, name):
+        return os.path.exists(self._json(name))
+
+    def write_async(self, name, sig, snap):
+        """Ставит запись снимка страницы в очередь (None - удаление файлов)"""
+        return self.pool.submit(self._write, name, sig, snap)
+
+    def _write(self, name, sig, snap):
+        try:
+            if snap is None:
+                self._remove(name)
+                return
+            os.makedirs(self.folder, exist_ok=True)
+
+            tiles = snap["tiles"]
+            keys = sorted(tiles)
+            if keys:
+                arrays = {f"t{tx}_{ty}": rle_encode(tiles[(tx, ty)]) for tx, ty in keys}
+                tmp = f"{self._npz(name)}.tmp"
+                with open(tmp, "wb") as f:
+                    np.savez_compressed(f, **arrays)
+                os.replace(tmp, self._npz(name))
+            elif os.path.exists(self._npz(name)):
+                os.remove(self._npz(name))
+
+            # JSON пишется последним: он же признак целостной записи
+            data = {"version": MASK_FORMAT, "sig": sig, "items": snap["items"]}
+            if "layer" in snap:
+                data["layer"] = dict(snap["layer"], tiles=[[tx, ty, int(tiles[(tx, ty)].shape[1]),
+                                                            int(tiles[(tx, ty)].shape[0])] for tx, ty in keys])
+            tmp = f"{self._json(name)}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, self._json(name))
+        except Exception as e:
+            logger.error(f"Ошибка записи масок {name}: {e}")
+
+    def _remove(self, name):
+        for path in (self._json(name), self._npz(name)):
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.warning(f"Не удалось удалить {path}: {e}")
+
+    def load(self, name, sig):
+        """
+        Маски страницы {'items', 'layer', 'tiles': {(tx, ty): bool (h, w)}}
+        или None, если их нет или они устарели
+        """
+        path = self._json(name)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != MASK_FORMAT or data.get("sig") != sig:
+                logger.info(f"Маски {name} устарели (страница изменилась)")
+                self.write_async(name, None, None)
+                return None
+
+            tiles = {}
+            layer = data.get("layer")
+            if layer and layer.get("tiles"):
+                with np.load(self._npz(name), allow_pickle=False) as npz:
+                    for tx, ty, w, h in layer["tiles"]:
+                        tiles[(tx, ty)] = rle_decode(npz[f"t{tx}_{ty}"], (h, w))
+            data["tiles"] = tiles
+            return data
+        except Exception as e:
+            logger.warning(f"Повреждены маски {path}: {e}")
+            return None
+
+    def flush(self):
+        """Дожидается записи всех поставленных снимков"""
+        self.pool.submit(lambda: None).result()
+
+    def close(self):
+        self.pool.shutdown(wait=True)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# ui/windows/m8_11_timing_panel.py
+import os
+import time
+import logging
+from PySide6.QtCore import Qt, QTimer
+from PySide6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel, QPushButton,
+                               QTableWidget, QTableWidgetItem, QHeaderView, QFileDialog)
+
+from ui.components.stage_timer import get_stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Период обновления таблицы, мс
+REFRESH_MS = 1000
+COLUMNS = ("Этап", "Вызовов", "Элементов", "Всего, с", "На элемент, мс", "p50, мс", "p90, мс", "p99, мс", "Макс, мс")
+
+BTN_STYLE = ("QPushButton{background-color:#4E4E6F;color:white;border-radius:8px;"
+             "padding:6px 12px;font-size:13px;}QPushButton:hover{background-color:#6E6E9F;}")
+
+
+def default_timing_path(cleaning_folder):
+    """Путь файла замеров главы: Клининг/.timing/<дата_время>.json"""
+    return os.path.join(cleaning_folder, ".timing", f"{time.strftime('%Y%m%d_%H%M%S')}.json")
+
+
+class TimingPanel(QDialog):
+    """Немодальная таблица замеров этапов клининга, обновляется по таймеру"""
+
+    def __init__(self, cleaning_folder, parent=None):
+        super().__init__(parent)
+        self.cleaning_folder = cleaning_folder
+        self.timer = get_stage_timer()
+        self.setWindowTitle("Статистика этапов")
+        self.setMinimumSize(820, 360)
+        self.setStyleSheet("QDialog{background-color:#222;}QLabel{color:white;}")
+
+        layout = QVBoxLayout(self)
+        self.info_lbl = QLabel("")
+        self.info_lbl.setStyleSheet("color:#AAAAAA;font-size:12px;")
+        layout.addWidget(self.info_lbl)
+
+        self.table = QTableWidget(0, len(COLUMNS))
+        self.table.setHorizontalHeaderLabels(COLUMNS)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.table.setStyleSheet("QTableWidget{background-color:#333;color:white;gridline-color:#444;}"
+                                 "QHeaderView::section{background-color:#444;color:white;border:none;padding:4px;}")
+        layout.addWidget(self.table, stretch=1)
+
+        btn_layout = QHBoxLayout()
+        export_btn = QPushButton("Экспорт JSON")
+        export_btn.setStyleSheet(BTN_STYLE)
+        export_btn.clicked.connect(self.export)
+        reset_btn = QPushButton("Сбросить")
+        reset_btn.setStyleSheet(BTN_STYLE)
+        reset_btn.clicked.connect(self.reset)
+        close_btn = QPushButton("Закрыть")
+        close_btn.setStyleSheet(BTN_STYLE)
+        close_btn.clicked.connect(self.close)
+        btn_layout.addStretch()
+        btn_layout.addWidget(reset_btn)
+        btn_layout.addWidget(export_btn)
+        btn_layout.addWidget(close_btn)
+        layout.addLayout(btn_layout)
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh()
+
+    def showEvent(self, event):
+        self.refresh_timer.start(REFRESH_MS)
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.refresh_timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        stats = sorted(self.timer.summary().items(), key=lambda kv: -kv[1]["total"])
+        self.table.setRowCount(len(stats))
+        for row, (stage, st) in enumerate(stats):
+            values = (stage, str(st["count"]), str(st["items"]), f"{st['total']:.2f}",
+                      f"{st['per_item'] * 1000:.1f}", f"{st['p50'] * 1000:.1f}", f"{st['p90'] * 1000:.1f}",
+                      f"{st['p99'] * 1000:.1f}", f"{st['max'] * 1000:.1f}")
+            for col, text in enumerate(values):
+                item = self.table.item(row, col)
+                if item is None:
+                    item = QTableWidgetItem()
+                    if col:
+                        item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                    self.table.setItem(row, col, item)
+                item.setText(text)
+        started = time.strftime("%H:%M:%S", time.localtime(self.timer.started))
+        self.info_lbl.setText(f"Замеры с {started}, этапов: {len(stats)}")
+
+    def reset(self):
+        self.timer.reset()
+        self.refresh()
+
+    def export(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Экспорт замеров", default_timing_path(self.cleaning_folder),
+                                              "JSON (*.json)")
+        if not path:
+            return
+        if self.timer.export_json(path, {"chapter": os.path.dirname(self.cleaning_folder)}):
+            logger.info(f"Замеры сохранены: {path}")
+            self.info_lbl.setText(f"Сохранено: {path}")
@@ -22,6 +22,7 @@ class EditableMask(QGraphicsRectItem):
         self.deleted = False
         self.page_index = None
         self.last_expansion = 0
+        self.geom_rev = 0  # Ревизия геометрии для кэша растров маски
 
         pen = QPen(QColor(*color))
         pen.setWidth(2)
@@ -32,6 +33,10 @@ class EditableMask(QGraphicsRectItem):
         self.resizing = False
         self.resize_corner = None
 
+    def setRect(self, *args):
+        super().setRect(*args)
+        self.geom_rev += 1
+
     def hoverMoveEvent(self, event):
         rect = self.rect()
         pos = event.pos()
@@ -154,6 +159,7 @@ class EditablePolygonMask(QGraphicsPolygonItem):
         self.points = points
         self.page_index = None
         self.last_expansion = 0
+        self.geom_rev = 0  # Ревизия геометрии для кэша растров маски
 
         self.setFlag(QGraphicsItem.ItemIsMovable)
         self.setFlag(QGraphicsItem.ItemIsSelectable)
@@ -178,6 +184,10 @@ class EditablePolygonMask(QGraphicsPolygonItem):
                 point_item.setPen(QPen(QColor(*color)))
                 self.control_points.append(point_item)
 
+    def setPolygon(self, polygon):
+        super().setPolygon(polygon)
+        self.geom_rev += 1
+
     def updatePolygon(self):
         if not self.editing or not self.control_points:
             return
@@ -254,4 +264,22 @@ class SelectionRect(QGraphicsRectItem):
         pen.setStyle(Qt.DashLine)
         self.setPen(pen)
         brush = QBrush(QColor(0, 255, 255, 30))
-        self.setBrush(brush)
\ No newline at end of file
+        self.setBrush(brush)
+
+
+class TiledLayerItem(QGraphicsItem):
+    """Отображение разреженного слоя рисования: рисуются только видимые тайлы"""
+    def __init__(self, layer, parent=None):
+        super().__init__(parent)
+        self.layer = layer
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.layer.width(), self.layer.height())
+
+    def paint(self, painter, option, widget=None):
+        exposed = option.exposedRect
+        for key, img in self.layer.tiles.items():
+            r = QRectF(self.layer.tile_rect(key))
+            if r.intersects(exposed):
+                painter.drawImage(r.topLeft(), img)
@@ -1,16 +1,16 @@
 # -*- coding: utf-8 -*-
 # ui/windows/m8_2_image_viewer.py
 import cv2
-import numpy as np
 import logging
 from PySide6.QtCore import Qt, QObject, Signal, QRectF, QPointF, QEvent, QTimer
-from PySide6.QtWidgets import (QGraphicsView, QGraphicsScene, QGraphicsPixmapItem,
+from PySide6.QtWidgets import (QGraphicsView, QGraphicsScene, QGraphicsPixmapItem, QGraphicsPathItem,
                                QApplication, QMenu, QMessageBox)
-from PySide6.QtGui import (QPainter, QPixmap, QPen, QBrush, QColor, QCursor,
+from PySide6.QtGui import (QPainter, QPainterPath, QPixmap, QPen, QBrush, QColor, QCursor,
                            QAction, QTransform, QAction)
 
 from ui.windows.m8_1_graphics_items import EditableMask, EditablePolygonMask, BrushStroke
-from ui.windows.m8_1_graphics_items import SelectionRect, SelectionEvent
+from ui.windows.m8_1_graphics_items import SelectionRect, SelectionEvent, TiledLayerItem
+from ui.windows.m8_4_mask_engine import TiledDrawLayer
 
 # Константы для настройки инструментов
 MIN_BRUSH_SIZE = 1
@@ -19,6 +19,9 @@ DEFAULT_BRUSH_SIZE = 5
 DEFAULT_BRUSH_COLOR = (255, 0, 0)
 CURSOR_OUTLINE_COLOR = QColor(255, 255, 255)
 CURSOR_FILL_COLOR = QColor(255, 0, 0, 128)
+ERASER_PREVIEW_COLOR = QColor(255, 255, 255, 160)
+# Минимальный интервал обновления масок и миниатюр после штрихов (~1 кадр)
+REFRESH_MS = 16
 
 logger = logging.getLogger(__name__)
 
@@ -41,15 +44,17 @@ class CustomImageViewer(QGraphicsView):
     operation_started = Signal(str)
     operation_finished = Signal()
 
-    def __init__(self, image_paths, parent=None):
+    def __init__(self, image_paths, parent=None, preload=True):
         super().__init__(parent)
         # Основные параметры
         self.pages = image_paths
         self.cur_page = 0
         self.scale_factor = 1.0
         self.masks = {}  # Хранение масок
-        self.draw_layers = {}  # page_idx -> QPixmap
-        self.draw_items = {}  # page_idx -> QGraphicsPixmapItem
+        self.attached_page = None  # Страница, элементы которой сейчас на сцене
+        self.mask_loader = None  # mask_loader(page_idx) подгружает сохраненные маски страницы при показе
+        self.draw_layers = {}  # page_idx -> TiledDrawLayer (создается лениво)
+        self.draw_items = {}  # page_idx -> TiledLayerItem
 
         # Настройка представления
         self.setRenderHints(QPainter.Antialiasing | QPainter.SmoothPixmapTransform)
@@ -77,12 +82,27 @@ class CustomImageViewer(QGraphicsView):
         self.drawing = False
         self.last_pt = None
 
+        # Текущий штрих (до отпускания кнопки живет отдельным элементом)
+        self.live_stroke = None
+        self.stroke_path = None
+        self.stroke_page = None
+        self.stroke_eraser = False
+
+        # Отложенное обновление масок/миниатюр после штрихов
+        self.pending_refresh = set()
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.timeout.connect(self._flush_refresh)
+
         # Инициализация pixmaps
         self.pixmaps = []
         self.orig_pixmaps = {}
 
-        # Загрузка изображений
-        self._load_images()
+        # Загрузка изображений (preload=False - страницы выставляет окно по мере загрузки)
+        if preload:
+            self._load_images()
+        else:
+            self.pixmaps = [QPixmap() for _ in self.pages]
 
         # Отображаем текущую страницу
         self.display_current_page()
@@ -96,9 +116,8 @@ class CustomImageViewer(QGraphicsView):
                 if not pixmap.isNull():
                     self.pixmaps.append(pixmap)
                     page_idx = len(self.pixmaps) - 1
-                    self.orig_pixmaps[page_idx] = pixmap.copy()
-                    # Сразу создаем слой для рисования
-                    self._create_drawing_layer(page_idx)
+                    self.orig_pixmaps[page_idx] = QPixmap(pixmap)  # общие данные до изменения
+                    # Слой рисования создается при показе страницы или первом штрихе
                 else:
                     logger.error(f"Не удалось загрузить изображение: {path}")
                     self.pixmaps.append(QPixmap())
@@ -107,7 +126,7 @@ class CustomImageViewer(QGraphicsView):
                 self.pixmaps.append(QPixmap())
 
     def _create_drawing_layer(self, page_idx):
-        """Создает слой для рисования"""
+        """Создает разреженный слой для рисования (тайлы выделяются при штрихах)"""
         if page_idx in self.draw_layers and not self.draw_layers[page_idx].isNull():
             return self.draw_layers[page_idx]
 
@@ -126,23 +145,31 @@ class CustomImageViewer(QGraphicsView):
             logger.error(f"Некорректные размеры pixmap: {w}x{h}")
             return None
 
-        layer = QPixmap(w, h)
-        layer.fill(Qt.transparent)
+        layer = TiledDrawLayer(w, h)
         self.draw_layers[page_idx] = layer
 
         # Создаем элемент отображения и добавляем на сцену
-        item = QGraphicsPixmapItem(layer)
+        item = TiledLayerItem(layer)
         item.setPos(0, 0)  # Позиция соответствует position image
         item.setZValue(50)  # Поверх основного изображения
-        self.scene_.addItem(item)
         self.draw_items[page_idx] = item
 
-        # Видимость зависит от текущей страницы
-        item.setVisible(page_idx == self.cur_page)
+        # На сцене только элементы показанной страницы
+        if page_idx == self.attached_page:
+            self.scene_.addItem(item)
 
         logger.debug(f"Создан слой для страницы {page_idx}: {w}x{h}")
         return layer
 
+    def clear_draw_layer(self, page_idx):
+        """Очищает слой рисования страницы (тайлы освобождаются)"""
+        layer = self.draw_layers.get(page_idx)
+        if layer is None:
+            return
+        layer.clear()
+        if page_idx in self.draw_items:
+            self.draw_items[page_idx].update()
+
     def set_draw_mode(self, mode):
         """Устанавливает режим рисования"""
         self.draw_mode = mode
@@ -194,54 +221,94 @@ class CustomImageViewer(QGraphicsView):
         if self.draw_mode != DrawingMode.NONE:
             self._update_cursor()
 
-    def _draw_stroke(self, page_idx, start_pos, end_pos=None, is_eraser=False):
-        """Рисует линию на слое рисования"""
+    def _stroke_pen(self, is_eraser, preview=False):
+        """Перо штриха; для предпросмотра ластика - полупрозрачное белое"""
+        if is_eraser:
+            pen = QPen(ERASER_PREVIEW_COLOR if preview else QColor(0, 0, 0))
+        else:
+            pen = QPen(QColor(*self.draw_color))
+        pen.setWidth(self.draw_size)
+        pen.setCapStyle(Qt.RoundCap)
+        pen.setJoinStyle(Qt.RoundJoin)
+        return pen
+
+    def _begin_stroke(self, page_idx, pos, is_eraser):
+        """Начинает штрих: пока кнопка нажата, он рисуется во временном элементе"""
+        if page_idx not in self.draw_layers and self._create_drawing_layer(page_idx) is None:
+            return False
+
+        self.stroke_page = page_idx
+        self.stroke_eraser = is_eraser
+        self.stroke_path = QPainterPath(pos)
+        self.live_stroke = QGraphicsPathItem()
+        self.live_stroke.setPen(self._stroke_pen(is_eraser, preview=True))
+        self.live_stroke.setZValue(60)  # Поверх слоя рисования
+        self.scene_.addItem(self.live_stroke)
+        return True
+
+    def _extend_stroke(self, pos):
+        """Добавляет сегмент; перерисовывается только рамка временного элемента"""
+        if self.live_stroke is None:
+            return
+        self.stroke_path.lineTo(pos)
+        self.live_stroke.setPath(self.stroke_path)
+
+    def _commit_stroke(self):
+        """Переносит штрих в тайлы слоя (только его рамка) и убирает временный элемент"""
+        if self.live_stroke is None:
+            return
+        item, path = self.live_stroke, self.stroke_path
+        page_idx, is_eraser = self.stroke_page, self.stroke_eraser
+        self.live_stroke = None
+        self.stroke_path = None
+        self.scene_.removeItem(item)
+
+        layer = self.draw_layers.get(page_idx)
+        if layer is None:
+            return
+
         try:
-            if page_idx not in self.draw_layers:
-                layer = self._create_drawing_layer(page_idx)
-                if layer is None:
-                    print(f"ОШИБКА: Не удалось создать слой для страницы {page_idx}")
-                    return False
-
-            layer = self.draw_layers[page_idx]
-            painter = QPainter(layer)
-            painter.setRenderHint(QPainter.Antialiasing)
-
-            if is_eraser:
-                painter.setCompositionMode(QPainter.CompositionMode_Clear)
-                if end_pos:
-                    pen = QPen()
-                    pen.setWidth(self.draw_size)
-                    pen.setCapStyle(Qt.RoundCap)
-                    pen.setJoinStyle(Qt.RoundJoin)
-                    painter.setPen(pen)
-                    painter.drawLine(start_pos, end_pos)
-                else:
+            pen = self._stroke_pen(is_eraser)
+            start = path.elementAt(0)
+            single = path.elementCount() == 1
+
+            def draw(painter):
+                painter.setRenderHint(QPainter.Antialiasing)
+                if is_eraser:
+                    painter.setCompositionMode(QPainter.CompositionMode_Clear)
+                if single and is_eraser:
                     painter.setBrush(Qt.black)
                     painter.setPen(Qt.NoPen)
-                    painter.drawEllipse(start_pos, self.draw_size / 2, self.draw_size / 2)
-            else:
-                pen = QPen(QColor(*self.draw_color))
-                pen.setWidth(self.draw_size)
-                pen.setCapStyle(Qt.RoundCap)
-                pen.setJoinStyle(Qt.RoundJoin)
-                painter.setPen(pen)
-                if end_pos:
-                    painter.drawLine(start_pos, end_pos)
+                    painter.drawEllipse(QPointF(start.x, start.y), self.draw_size / 2, self.draw_size / 2)
+                elif single:
+                    painter.setPen(pen)
+                    painter.drawPoint(QPointF(start.x, start.y))
                 else:
-                    painter.drawPoint(start_pos)
+                    painter.setPen(pen)
+                    painter.drawPath(path)
 
-            painter.end()
-            self.draw_items[page_idx].setPixmap(layer)
-            self.viewport().update()
-            window = self.window()
-            if hasattr(window, 'image_status'):
-                window.image_status[page_idx] = 'modified'
-            self.mask_updated.emit(page_idx)
-            QApplication.processEvents()
-            return True
+            # Грязная область штриха с запасом на толщину кисти
+            pad = self.draw_size // 2 + 2
+            dirty = path.controlPointRect().toAlignedRect().adjusted(-pad, -pad, pad, pad)
+
+            # Ластик не создает новых тайлов
+            layer.paint(dirty, draw, create=not is_eraser)
+            if page_idx in self.draw_items:
+                self.draw_items[page_idx].update(QRectF(dirty))
+            self.schedule_refresh(page_idx)
         except Exception as e:
-            print(f"ОШИБКА: Рисования штриха: {str(e)}")
+            logger.error(f"Ошибка фиксации штриха: {str(e)}")
+
+    def schedule_refresh(self, page_idx):
+        """Обновление масок и миниатюры не чаще одного раза за кадр"""
+        self.pending_refresh.add(page_idx)
+        if not self.refresh_timer.isActive():
+            self.refresh_timer.start(REFRESH_MS)
+
+    def _flush_refresh(self):
+        pages, self.pending_refresh = self.pending_refresh, set()
+        for page_idx in pages:
+            self.mask_updated.emit(page_idx)
 
     def display_current_page(self):
         """Отображение текущей страницы точно так же, как в m6"""
@@ -251,45 +318,25 @@ class CustomImageViewer(QGraphicsView):
 
         pm = self.pixmaps[self.cur_page]
         if pm.isNull():
-            logger.error(f"Пустой pixmap для страницы {self.cur_page}")
+            logger.debug(f"Страница {self.cur_page} еще не загружена")
             return
 
         old_transform = self.transform()
         old_scale_factor = self.scale_factor
 
-        for item in self.scene_.items():
-            if item != self.single_page_item and item not in self.draw_items.values():
-                item.setVisible(False)
-
         self.single_page_item.setPixmap(pm)
         self.single_page_item.setPos(0, 0)
 
-        for idx, item in self.draw_items.items():
-            item.setVisible(idx == self.cur_page)
-            if idx == self.cur_page:
-                item.setPos(0, 0)
-
         if self.cur_page not in self.draw_layers:
             self._create_drawing_layer(self.cur_page)
 
         w, h = pm.width(), pm.height()
         self.setSceneRect(-30, -30, w + 60, h + 60)
 
-        for masks in self.masks.values():
-            for mask in masks:
-                mask.setVisible(False)
-
-        count = 0
-        if self.cur_page in self.masks:
-            for mask in self.masks[self.cur_page]:
-                if not (hasattr(mask, 'deleted') and mask.deleted):
-                    mask.setVisible(True)
-                    if mask.scene() is None:
-                        self.scene_.addItem(mask)
-                    if mask.page_index != self.cur_page:
-                        mask.set_page_index(self.cur_page)
-                    count += 1
-            logger.debug(f"Отображаем {count} масок для страницы {self.cur_page}")
+        if self.mask_loader is not None:
+            self.mask_loader(self.cur_page)
+        count = self._attach_page(self.cur_page)
+        logger.debug(f"Отображаем {count} масок для страницы {self.cur_page}")
 
         # ИЗМЕНЕНО: логика масштабирования
         if self.fit_to_view and not hasattr(self, '_initial_fit_done'):
@@ -304,20 +351,54 @@ class CustomImageViewer(QGraphicsView):
         self.scene_.update()
         self.viewport().update()
 
+    def _detach_page(self, page_idx):
+        """Убирает со сцены маски и слой рисования страницы (объекты остаются в self.masks)"""
+        for mask in self.masks.get(page_idx, []):
+            if mask.scene() is self.scene_:
+                self.scene_.removeItem(mask)
+        item = self.draw_items.get(page_idx)
+        if item is not None and item.scene() is self.scene_:
+            self.scene_.removeItem(item)
+
+    def _attach_page(self, page_idx):
+        """
+        Оставляет на сцене только элементы страницы page_idx.
+        Стоимость пропорциональна числу масок двух страниц, а не всей главы.
+        Возвращает число показанных масок.
+        """
+        if self.attached_page is not None and self.attached_page != page_idx:
+            self._detach_page(self.attached_page)
+        self.attached_page = page_idx
+
+        item = self.draw_items.get(page_idx)
+        if item is not None:
+            if item.scene() is None:
+                self.scene_.addItem(item)
+            item.setPos(0, 0)
+            item.setVisible(True)
+
+        count = 0
+        for mask in self.masks.get(page_idx, []):
+            if hasattr(mask, 'deleted') and mask.deleted:
+                continue
+            if mask.scene() is None:
+                self.scene_.addItem(mask)
+            mask.setVisible(True)
+            if mask.page_index != page_idx:
+                mask.set_page_index(page_idx)
+            count += 1
+        return count
+
+    def add_mask_item(self, page_idx, mask):
+        """Регистрирует маску страницы; на сцену она попадает, только если страница показана"""
+        self.masks.setdefault(page_idx, []).append(mask)
+        if page_idx == self.attached_page:
+            self.scene_.addItem(mask)
+            mask.setVisible(True)
+
     def _update_masks_for_current_page(self):
         """Обновление масок для текущей страницы"""
-        # Скрываем все маски
-        for page_idx, masks_list in self.masks.items():
-            for mask in masks_list:
-                mask.setVisible(False)
-
-        if self.cur_page in self.masks:
-            for mask in self.masks[self.cur_page]:
-                if not (hasattr(mask, 'deleted') and mask.deleted):
-                    mask.setVisible(True)
-                    # Устанавливаем правильную страницу, если нужно
-                    if mask.page_index is None or mask.page_index != self.cur_page:
-                        mask.set_page_index(self.cur_page)
+        self._attach_page(self.cur_page)
 
     def nextPage(self):
         """Переход на следующую страницу"""
@@ -362,6 +443,7 @@ class CustomImageViewer(QGraphicsView):
             menu.addAction(clear_action)
 
         # Сбрасываем состояние рисования перед показом меню
+        self._commit_stroke()
         self.drawing = False
         self.last_pt = None
 
@@ -384,9 +466,7 @@ class CustomImageViewer(QGraphicsView):
             logger.debug(f"Удалено {mask_count} масок")
 
         if self.cur_page in self.draw_layers:
-            self.draw_layers[self.cur_page].fill(Qt.transparent)
-            if self.cur_page in self.draw_items:
-                self.draw_items[self.cur_page].setPixmap(self.draw_layers[self.cur_page])
+            self.clear_draw_layer(self.cur_page)
             logger.debug("Очищен слой рисования")
 
         self.viewport().update()
@@ -489,20 +569,15 @@ class CustomImageViewer(QGraphicsView):
             scene_pos = self.mapToScene(event.position().toPoint())
             page_idx = self.cur_page
 
-            if page_idx not in self.draw_layers:
-                if not self._create_drawing_layer(page_idx):
-                    logger.error(f"Не удалось создать слой для страницы {page_idx}")
-                    return
+            self._commit_stroke()
+            is_eraser = (self.draw_mode == DrawingMode.ERASER)
+            if not self._begin_stroke(page_idx, scene_pos, is_eraser):
+                logger.error(f"Не удалось создать слой для страницы {page_idx}")
+                return
 
             self.drawing = True
             self.last_pt = scene_pos
 
-            is_eraser = (self.draw_mode == DrawingMode.ERASER)
-            success = self._draw_stroke(page_idx, scene_pos, None, is_eraser)
-            if not success:
-                self.drawing = False
-                self.last_pt = None
-
     def mouseMoveEvent(self, event):
         if self.draw_mode == DrawingMode.NONE or not self.drawing:
             super().mouseMoveEvent(event)
@@ -517,30 +592,14 @@ class CustomImageViewer(QGraphicsView):
                 abs(scene_pos.y() - self.last_pt.y()) < 1):
             return
 
-        is_eraser = (self.draw_mode == DrawingMode.ERASER)
-        success = self._draw_stroke(self.cur_page, self.last_pt, scene_pos, is_eraser)
-
-        if success:
-            self.last_pt = scene_pos
-
-            window = self.window()
-            if hasattr(window, 'force_update_thumbnail'):
-                if not hasattr(self, 'thumbnail_update_timer'):
-                    self.thumbnail_update_timer = QTimer()
-                    self.thumbnail_update_timer.setSingleShot(True)
-                    self.thumbnail_update_timer.timeout.connect(
-                        lambda: window.force_update_thumbnail(self.cur_page))
-
-                if not self.thumbnail_update_timer.isActive():
-                    self.thumbnail_update_timer.start(200)
-
-                if hasattr(window, 'image_status'):
-                    window.image_status[self.cur_page] = 'modified'
-
-        self.viewport().update()
+        self._extend_stroke(scene_pos)
+        self.last_pt = scene_pos
 
     def mouseReleaseEvent(self, event):
         if event.button() == Qt.RightButton and hasattr(self, 'saved_draw_mode'):
+            self._commit_stroke()
+            self.drawing = False
+            self.last_pt = None
             self.set_draw_mode(self.saved_draw_mode)
             delattr(self, 'saved_draw_mode')
             return
@@ -549,13 +608,8 @@ class CustomImageViewer(QGraphicsView):
             super().mouseReleaseEvent(event)
             return
 
-        window = self.window()
-        if hasattr(window, 'force_update_thumbnail'):
-            if hasattr(window, 'image_status'):
-                window.image_status[self.cur_page] = 'modified'
-            window.force_update_thumbnail(self.cur_page)
-
-        self.mask_updated.emit(self.cur_page)
+        # Маски и миниатюра обновятся по таймеру после фиксации
+        self._commit_stroke()
 
         self.drawing = False
         self.last_pt = None
@@ -564,12 +618,14 @@ class CustomImageViewer(QGraphicsView):
 
     def focusOutEvent(self, event):
         # Сброс состояния рисования при потере фокуса
+        self._commit_stroke()
         self.drawing = False
         self.last_pt = None
         super().focusOutEvent(event)
 
     def leaveEvent(self, event):
         # Сброс состояния рисования при выходе курсора
+        self._commit_stroke()
         self.drawing = False
         self.last_pt = None
         super().leaveEvent(event)
@@ -657,33 +713,13 @@ class CustomImageViewer(QGraphicsView):
         result = {}
 
         for page_idx, layer in self.draw_layers.items():
-            # Проверка содержимого
-            if layer.isNull():
+            # Пустые слои не содержат тайлов
+            if layer.isNull() or not layer.tiles:
                 continue
 
-            img = layer.toImage()
-            w, h = img.width(), img.height()
-
-            # Создаем маску
-            mask = np.zeros((h, w), dtype=np.uint8)
-
-            # Проверка непрозрачных пикселей
-            has_content = False
-            for y in range(0, h, 10):
-                for x in range(0, w, 10):
-                    if QColor(img.pixel(x, y)).alpha() > 0:
-                        has_content = True
-                        break
-                if has_content:
-                    break
-
             # Если есть непрозрачные пиксели
-            if has_content:
-                for y in range(h):
-                    for x in range(w):
-                        if QColor(img.pixel(x, y)).alpha() > 0:
-                            mask[y, x] = 255
-
+            mask = layer.mask()
+            if mask.any():
                 result[page_idx] = mask
 
         return result
@@ -5,197 +5,181 @@ import cv2
 import numpy as np
 import os
 import logging
-import torch
-import threading
-import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from PySide6.QtCore import QObject, Signal, QEvent, QRectF, QPointF
-from PySide6.QtWidgets import QApplication, QMessageBox
+from concurrent.futures import ThreadPoolExecutor
+from PySide6.QtCore import QObject, Signal, QRectF, QPointF
+from PySide6.QtWidgets import QMessageBox
 from PySide6.QtGui import QPolygonF, QColor, QImage
 from ui.windows.m8_1_graphics_items import EditableMask, EditablePolygonMask, BrushStroke
+from ui.windows.m8_4_mask_engine import polygon_points, offset_polygon, simplify_polygon, box_rect
+from ui.windows.m8_5_detection import (DetectionWorker, DetectionJob, DetectionStore, load_bgr,
+                                       file_hash, image_signature, DEF_BATCH, DEF_CONF)
+from ui.components.model_registry import get_model_registry, get_device as registry_device
+from ui.components.stage_timer import timed
 from PIL import Image
 logger = logging.getLogger(__name__)
 
+# Остановленные потоки, еще не завершившие работу (ссылка держится до finished)
+_retired_threads = set()
 
-class ImgLoadEvent(QEvent):
-    """Событие загрузки изображения"""
-    EventType = QEvent.Type(QEvent.User + 1)
-
-    def __init__(self, idx=None):
-        super().__init__(ImgLoadEvent.EventType)
-        self.idx = idx
-
-
-class AllImgLoadEvent(QEvent):
-    """Событие загрузки всех изображений"""
-    EventType = QEvent.Type(QEvent.User + 2)
-
-    def __init__(self):
-        super().__init__(AllImgLoadEvent.EventType)
-
-
-class ImgLoader(QObject):
-    """Загрузчик изображений"""
-    img_loaded = Signal(int, QImage, str)
-    load_prog = Signal(int, int, str)
-    load_complete = Signal()
-    load_cancelled = Signal()
-
-    def __init__(self, img_paths, thread_pool=None):
-        super().__init__()
-        self.img_paths = img_paths
-        self.thread_pool = thread_pool or ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 2))
-        self.cancel_loading = False
-
-    def start_loading(self, priority_idx=0):
-        """Запуск загрузки изображений"""
-        load_order = self._get_load_order(priority_idx)
-
-        self.loaded_count = 0
-        self.total_count = len(self.img_paths)
-        self.load_prog.emit(0, self.total_count, "")
-
-        thread = threading.Thread(target=self._load_thread, args=(load_order,), daemon=True)
-        thread.start()
-
-    def _get_load_order(self, priority_idx):
-        """Определяет порядок загрузки изображений"""
-        load_order = [priority_idx]
-
-        for offset in range(1, 4):
-            if priority_idx + offset < len(self.img_paths):
-                load_order.append(priority_idx + offset)
-            if priority_idx - offset >= 0:
-                load_order.append(priority_idx - offset)
-
-        for i in range(len(self.img_paths)):
-            if i not in load_order:
-                load_order.append(i)
-
-        return load_order
-
-    def _load_image(self, idx):
-        """Загрузка одного изображения"""
-        if self.cancel_loading:
-            return None, idx, ""
 
+def retire_thread(thread, signals=(), timeout=3000):
+    """
+    Останавливает поток с методом stop() и отключает его сигналы от окна.
+    Если поток не завершился за timeout (загрузка модели, инференс на CPU),
+    ссылка на него сохраняется до finished, чтобы QThread не уничтожился на ходу.
+    """
+    for signal in signals:
         try:
-            path = self.img_paths[idx]
-            current_file = path.split('/')[-1] if '/' in path else path
-            image = QImage(path)
-
-            if not image.isNull():
-                return image, idx, current_file
-        except Exception as e:
-            logger.error(f"Ошибка загрузки {idx}: {str(e)}")
-
-        return None, idx, ""
-
-    def _load_thread(self, load_order):
-        """Поток загрузки"""
-        try:
-            futures = []
-
-            # Создаем задачи
-            for idx in load_order:
-                if self.cancel_loading:
-                    break
-
-                future = self.thread_pool.submit(self._load_image, idx)
-                futures.append(future)
-                time.sleep(0.05)
-
-            # Обработка результатов
-            for future in as_completed(futures):
-                if self.cancel_loading:
-                    break
-
-                image, idx, current_file = future.result()
-                if image is not None:
-                    self.img_loaded.emit(idx, image, current_file)
-                    self.loaded_count += 1
-                    self.load_prog.emit(self.loaded_count, self.total_count, current_file)
-
-            # Сигнал о завершении
-            if not self.cancel_loading:
-                self.load_complete.emit()
-                QApplication.postEvent(QApplication.instance().activeWindow(), AllImgLoadEvent())
-            else:
-                self.load_cancelled.emit()
-
-        except Exception as e:
-            logger.error(f"Ошибка загрузки: {str(e)}")
-            self.load_cancelled.emit()
-
-    def cancel(self):
-        """Отмена загрузки"""
-        logger.info("Отмена загрузки изображений")
-        self.cancel_loading = True
+            signal.disconnect()
+        except (RuntimeError, TypeError):
+            pass
+    thread.stop()
+    if thread.wait(timeout):
+        return True
+    logger.info(f"Поток {type(thread).__name__} завершится в фоне")
+    _retired_threads.add(thread)
+    thread.finished.connect(thread.deleteLater)
+    thread.destroyed.connect(lambda: _retired_threads.discard(thread))
+    return False
 
 
 def enable_cuda_cudnn():
-    """Включает CUDA и настраивает cuDNN"""
-    try:
-        if torch.cuda.is_available():
-            torch.backends.cudnn.enabled = True
-            torch.backends.cudnn.benchmark = True
-            logger.info(f"CUDA: {torch.cuda.device_count()} устройств, {torch.cuda.get_device_name(0)}")
-            return True
-        else:
-            logger.info("CUDA недоступна")
-            return False
-    except Exception as e:
-        logger.error(f"Ошибка CUDA: {str(e)}")
-        return False
+    """Включает CUDA и настраивает cuDNN (torch импортируется при первом вызове)"""
+    return registry_device() == 'cuda'
 
 
 def get_device():
     """Определяет доступное устройство"""
-    try:
-        return 'cuda' if torch.cuda.is_available() else 'cpu'
-    except:
-        return 'cpu'
+    return registry_device()
 
 
 class DetectionManager(QObject):
-    """Управление детекцией и сегментацией"""
+    """Управление детекцией и сегментацией (инференс в отдельном потоке)"""
+    page_result = Signal(int, object)  # page_idx, {'detect'|'segm': компактный результат}
+    job_done = Signal(int, bool)  # job_id, отменено ли
+    model_hash_ready = Signal(str)  # 'detect'|'segm': хэш модели посчитан, дисковый кэш доступен
+    _model_hashed = Signal(str, str, str)  # внутренний: тип, путь, хэш (из пула в GUI)
 
-    def __init__(self, ai_models, detect_classes, segm_classes):
+    def __init__(self, ai_models, detect_classes, segm_classes, batch_size=DEF_BATCH):
         super().__init__()
         self.ai_models = ai_models
         self.detect_classes = detect_classes
         self.segm_classes = segm_classes
-        self.detection_model = None
-        self.segmentation_model = None
+        self.models = get_model_registry()
         self.viewer = None
-        enable_cuda_cudnn()
+        self.batch_size = batch_size
+        self.worker = None
+        self.pinned = []  # пути YOLO, закрепленных в реестре
+        self.jobs = {}  # job_id -> контекст задания
+        self.last_job_errors = []  # [(page_idx, сообщение)] последнего завершенного задания
+        self._job_seq = 0
+        # Прогон обеих моделей за один проход по странице (если модели доступны)
+        self.analyze_together = True
+        # Нарезка высоких страниц на окна в исходном разрешении
+        self.slice_tall = True
+        self.page_cache = {}  # page_idx -> (ключ страницы, {тип: результат})
+        self.store = None  # DetectionStore главы
+        self.loaded_keys = {}  # page_idx -> cacheKey pixmap, загруженного из файла
+        self.model_hashes = {}  # путь модели -> SHA-1 (считается в фоне)
+        self.hash_pending = set()
+        self.hash_pool = None
+        self.restore_pending = set()  # страницы, маски которых восстанавливаются из кэша при показе
+        self._model_hashed.connect(self._on_model_hashed)
 
     def set_viewer(self, viewer):
         self.viewer = viewer
         logger.debug("Установлен viewer для DetectionManager")
-    def load_detection_model(self):
-        """Загружает модель детекции"""
-        if self.detection_model is not None:
-            return self.detection_model
 
+    def set_store_folder(self, folder):
+        """Папка дискового кэша результатов главы"""
+        self.store = DetectionStore(folder)
+
+    def register_loaded(self, page_idx, pixmap):
+        """Запоминает pixmap, совпадающий с файлом страницы (для дискового кэша)"""
+        self.loaded_keys[page_idx] = pixmap.cacheKey()
+    def preload_models(self):
+        """Фоновая загрузка и прогрев моделей главы (и хэширование файлов для дискового кэша)"""
+        self.models.preload([('yolo', self.ai_models.get("detect")), ('yolo', self.ai_models.get("segm"))])
+        for kind in ('detect', 'segm'):
+            self._model_hash(kind)
+
+    def _model_hash(self, kind):
+        """SHA-1 файла модели или None, пока он считается в фоне (GUI-поток не читает файл)"""
+        path = self.ai_models.get(kind)
+        if not path or not os.path.exists(path):
+            return None
+        digest = self.model_hashes.get(path)
+        if digest is None and path not in self.hash_pending:
+            self.hash_pending.add(path)
+            if self.hash_pool is None:
+                self.hash_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-hash")
+            self.hash_pool.submit(self._hash_job, kind, path)
+        return digest
+
+    def _hash_job(self, kind, path):
+        """Хэширование файла модели (выполняется в пуле)"""
         try:
-            model_path = self.ai_models.get("detect")
-            if not model_path or not os.path.exists(model_path):
-                logger.error(f"Модель детекции не найдена: {model_path}")
-                return None
+            digest = file_hash(path) or ""
+        except Exception as e:
+            logger.error(f"Ошибка хэширования модели {path}: {e}")
+            digest = ""
+        self._model_hashed.emit(kind, path, digest)
+
+    def _on_model_hashed(self, kind, path, digest):
+        self.hash_pending.discard(path)
+        if digest:
+            self.model_hashes[path] = digest
+            self.model_hash_ready.emit(kind)
+
+    def pin_models(self):
+        """
+        Запрещает выгрузку YOLO главы, пока она открыта: детекция и сегментация
+        работают вместе, и загрузка одной не должна вытеснять другую
+        """
+        self.unpin_models()
+        self.pinned = [path for path in (self.ai_models.get("detect"), self.ai_models.get("segm"))
+                       if path and os.path.exists(path)]
+        for path in self.pinned:
+            self.models.pin('yolo', path)
+
+    def unpin_models(self):
+        for path in self.pinned:
+            self.models.unpin('yolo', path)
+        self.pinned = []
+
+    def model_state(self, kind):
+        """Состояние модели 'detect' или 'segm' в реестре"""
+        return self.models.state('yolo', self.ai_models.get(kind))
+
+    def _model_getter(self, kind):
+        """Загрузчик модели для задания воркера: бросает исключение с причиной, если модели нет"""
+        title = "детекции" if kind == 'detect' else "сегментации"
+
+        def getter():
+            model = self._load_model(kind, title)
+            if model is None:
+                model_path = self.ai_models.get(kind)
+                if not model_path or not os.path.exists(model_path):
+                    raise RuntimeError(f"Модель {title} не найдена: {model_path}")
+                raise RuntimeError(f"Модель {title} не загружена: {self.models.error('yolo', model_path)}")
+            return model
+        return getter
 
-            logger.info(f"Загрузка модели детекции: {model_path}")
-            from ultralytics import YOLO
+    def _load_model(self, kind, title):
+        """Модель из общего реестра (ожидает фоновую загрузку; вызывается из потока инференса)"""
+        model_path = self.ai_models.get(kind)
+        if not model_path or not os.path.exists(model_path):
+            logger.error(f"Модель {title} не найдена: {model_path}")
+            return None
 
-            device = get_device()
-            model = YOLO(model_path)
-            logger.info(f"Модель детекции загружена на {device}")
+        model = self.models.get('yolo', model_path)
+        if model is None:
+            logger.error(f"Ошибка загрузки модели {title}: {self.models.error('yolo', model_path)}")
+        return model
 
-            self.detection_model = model
-            return model
-        except Exception as e:
-            logger.error(f"Ошибка загрузки модели детекции: {str(e)}")
-            return None
+    def load_detection_model(self):
+        """Загружает модель детекции"""
+        return self._load_model("detect", "детекции")
 
     def _gen_color(self, name):
         """Генерирует цвет по имени"""
@@ -205,158 +189,41 @@ class DetectionManager(QObject):
 
     def load_segmentation_model(self):
         """Загружает модель сегментации"""
-        if self.segmentation_model is not None:
-            return self.segmentation_model
-
-        try:
-            model_path = self.ai_models.get("segm")
-            if not model_path or not os.path.exists(model_path):
-                logger.error(f"Модель сегментации не найдена: {model_path}")
-                return None
-
-            logger.info(f"Загрузка модели сегментации: {model_path}")
-            from ultralytics import YOLO
-
-            device = get_device()
-            model = YOLO(model_path)
-            logger.info(f"Модель сегментации загружена на {device}")
-
-            self.segmentation_model = model
-            return model
-        except Exception as e:
-            logger.error(f"Ошибка загрузки модели сегментации: {str(e)}")
-            return None
-
-    def detect_page(self, img_path, page_idx, expansion=10):
-        try:
-            model = self.load_detection_model()
-            if model is None:
-                return None
-
-            device = get_device()
-
-            if self.viewer and page_idx in self.viewer.pixmaps and not self.viewer.pixmaps[page_idx].isNull():
-                pixmap = self.viewer.pixmaps[page_idx]
-                logger.debug(f"Используем pixmap из памяти для страницы {page_idx}")
-
-                qimg = pixmap.toImage()
-                qimg = qimg.convertToFormat(QImage.Format_RGB888)
-
-                width = qimg.width()
-                height = qimg.height()
-
-                ptr = qimg.bits()
-                ptr.setsize(height * width * 3)
-                arr = np.frombuffer(ptr, np.uint8).reshape((height, width, 3))
-
-                img_bgr = cv2.cvtColor(arr, cv2.COLOR_RGB2BGR)
-
-                logger.info(f"Детекция страницы {page_idx + 1} на {device} (из памяти)")
-                results = model(img_bgr, conf=0.25, device=device)
-            else:
-                if not os.path.exists(img_path):
-                    logger.warning(f"Файл не существует: {img_path}")
-                    return None
-
-                logger.info(f"Детекция страницы {page_idx + 1} на {device} (из файла)")
-                results = model(img_path, conf=0.25, device=device)
-
-            logger.info(f"Детекция завершена для страницы {page_idx + 1}")
-
-            if device == 'cuda':
-                torch.cuda.empty_cache()
-
-            return results
-        except Exception as e:
-            logger.error(f"Ошибка детекции страницы {page_idx}: {str(e)}")
-            import traceback
-            logger.error(traceback.format_exc())
-            return None
-
-    def segment_page(self, img_path, page_idx, expansion=10):
-        try:
-            model = self.load_segmentation_model()
-            if model is None:
+        return self._load_model("segm", "сегментации")
+
+    def detect_area(self, window, page_idx, sel_rect, on_result, on_finish=None):
+        """
+        Детекция в выделенной области: фрагмент вырезается в GUI-потоке,
+        инференс выполняется воркером. on_result(results, (x, y)) получает смещение.
+        """
+        source = self._page_source(window, page_idx)
+        if isinstance(source, QImage):
+            w_img, h_img = source.width(), source.height()
+        else:
+            source = load_bgr(source)
+            if source is None:
+                logger.warning(f"Не удалось загрузить изображение страницы {page_idx}")
+                if on_finish:
+                    on_finish(False)
                 return None
+            h_img, w_img = source.shape[:2]
 
-            device = get_device()
-
-            if self.viewer and page_idx in self.viewer.pixmaps and not self.viewer.pixmaps[page_idx].isNull():
-                pixmap = self.viewer.pixmaps[page_idx]
-                logger.debug(f"Используем pixmap из памяти для страницы {page_idx}")
-
-                qimg = pixmap.toImage()
-                qimg = qimg.convertToFormat(QImage.Format_RGB888)
-
-                width = qimg.width()
-                height = qimg.height()
-
-                ptr = qimg.bits()
-                ptr.setsize(height * width * 3)
-                arr = np.frombuffer(ptr, np.uint8).reshape((height, width, 3))
-
-                img_bgr = cv2.cvtColor(arr, cv2.COLOR_RGB2BGR)
-
-                logger.info(f"Сегментация страницы {page_idx + 1} на {device} (из памяти)")
-                results = model(img_bgr, conf=0.25, device=device)
-            else:
-                if not os.path.exists(img_path):
-                    logger.warning(f"Файл не существует: {img_path}")
-                    return None
-
-                logger.info(f"Сегментация страницы {page_idx + 1} на {device} (из файла)")
-                results = model(img_path, conf=0.25, device=device)
-
-            logger.info(f"Сегментация завершена для страницы {page_idx + 1}")
-
-            if device == 'cuda':
-                torch.cuda.empty_cache()
-
-            return results
-        except Exception as e:
-            logger.error(f"Ошибка сегментации страницы {page_idx}: {str(e)}")
-            return None
-
-    def detect_area(self, img_path, page_idx, sel_rect, expansion=10):
-        """Выполняет детекцию объектов в выбранной области"""
-        try:
-            img = cv2.imread(img_path)
-            if img is None:
-                logger.warning(f"Не удалось загрузить изображение: {img_path}")
-                return None, (0, 0)
-
-            # Координаты выделения
-            x, y = int(sel_rect.x()), int(sel_rect.y())
-            w, h = int(sel_rect.width()), int(sel_rect.height())
-
-            # Проверка границ
-            h_img, w_img = img.shape[:2]
-            x = max(0, min(x, w_img - 1))
-            y = max(0, min(y, h_img - 1))
-            w = max(1, min(w, w_img - x))
-            h = max(1, min(h, h_img - y))
-
-            # Обрезаем изображение
-            roi = img[y:y + h, x:x + w]
-
-            model = self.load_detection_model()
-            if model is None:
-                return None, (0, 0)
-
-            device = get_device()
-            logger.info(f"Детекция области на странице {page_idx + 1}")
+        # Координаты выделения с проверкой границ
+        x = max(0, min(int(sel_rect.x()), w_img - 1))
+        y = max(0, min(int(sel_rect.y()), h_img - 1))
+        w = max(1, min(int(sel_rect.width()), w_img - x))
+        h = max(1, min(int(sel_rect.height()), h_img - y))
 
-            # Передаем numpy массив напрямую в модель (YOLO поддерживает это)
-            results = model(roi, conf=0.25, device=device)
+        roi = source.copy(x, y, w, h) if isinstance(source, QImage) else source[y:y + h, x:x + w].copy()
+        logger.info(f"Детекция области на странице {page_idx + 1}")
 
-            # Очистка памяти
-            if device == 'cuda':
-                torch.cuda.empty_cache()
+        def on_page(idx, outputs):
+            if outputs is not None:
+                # Маски страницы заменяются результатами области
+                self.mark_applied(window, idx, 'detect', False)
+                on_result(outputs['detect'], (x, y))
 
-            return results, (x, y)
-        except Exception as e:
-            logger.error(f"Ошибка детекции области: {str(e)}")
-            return None, (0, 0)
+        return self.submit('detect', [page_idx], lambda _: roi, on_page, on_finish)
 
     def _norm_cls_name(self, cls_name):
         """Нормализует имя класса из модели"""
@@ -391,13 +258,14 @@ class DetectionManager(QObject):
         else:
             return 'Text'
 
+    @timed("detect.apply")
     def process_detection_results(self, results, viewer, page_idx, expansion_value=0, img_shape=None, offset=None,
                                   scale_factor=1.0):
-        """Обработка результатов детекции для отображения в просмотрщике"""
+        """Обработка результатов детекции (компактный словарь extract_raw) для отображения в просмотрщике"""
         if page_idx not in viewer.masks:
             viewer.masks[page_idx] = []
 
-        logger.info(f"Обработка результатов детекции для страницы {page_idx}: {len(results)} объектов")
+        logger.info(f"Обработка результатов детекции для страницы {page_idx}: {len(results['conf'])} объектов")
 
         # Определяем размеры изображения
         if img_shape is None:
@@ -422,20 +290,16 @@ class DetectionManager(QObject):
         viewer.masks[page_idx] = existing
 
         try:
-            if hasattr(results[0], 'boxes'):
-                boxes = results[0].boxes
-                names = results[0].names
-
-                # Получаем состояние классов
-                parent_window = viewer.window()
+            if 'xyxy' in results:
+                names = results['names']
 
                 added = 0
                 class_counts = {}
 
-                for box in boxes:
-                    cls_id = int(box.cls.item())
+                for xyxy, conf, cls_id in zip(results['xyxy'], results['conf'], results['cls']):
+                    cls_id = int(cls_id)
                     raw_name = names.get(cls_id, str(cls_id))
-                    conf = float(box.conf.item())
+                    conf = float(conf)
 
                     # Нормализация имени класса
                     cls_name = self._norm_cls_name(raw_name)
@@ -458,7 +322,7 @@ class DetectionManager(QObject):
                         continue
 
                     # Координаты
-                    x1, y1, x2, y2 = box.xyxy.cpu().numpy()[0]
+                    x1, y1, x2, y2 = (float(v) for v in xyxy)
                     x1 += x_off
                     y1 += y_off
                     x2 += x_off
@@ -471,28 +335,21 @@ class DetectionManager(QObject):
                         x2 += expansion_value
                         y2 += expansion_value
 
-                    # Обрезка по границам
-                    x1 = max(0, min(x1, img_shape[1]))
-                    y1 = max(0, min(y1, img_shape[0]))
-                    x2 = max(0, min(x2, img_shape[1]))
-                    y2 = max(0, min(y2, img_shape[0]))
-                    w, h = x2 - x1, y2 - y1
-
-                    if w <= 0 or h <= 0:
-                        logger.debug(f"Пропускаем объект с невалидными размерами: {w}x{h}")
+                    # Обрезка по границам (та же геометрия в консольном движке m8_8)
+                    rect = box_rect(x1, y1, x2, y2, img_shape[1], img_shape[0])
+                    if rect is None:
+                        logger.debug(f"Пропускаем объект вне страницы: {x1},{y1},{x2},{y2}")
                         continue
+                    x1, y1, w, h = rect
 
                     # Создаем и добавляем маску
                     color = cls_info.get('color', (255, 0, 0))
                     mask = EditableMask(x1, y1, w, h, 'detect', cls_name, conf, color)
                     mask.last_expansion = expansion_value
                     mask.set_page_index(page_idx)
-                    viewer.masks[page_idx].append(mask)
 
-                    # Добавляем на сцену если это текущая страница
-                    if viewer.cur_page == page_idx:
-                        viewer.scene_.addItem(mask)
-                        mask.setVisible(True)
+                    # На сцену попадает, только если страница показана
+                    viewer.add_mask_item(page_idx, mask)
 
                     # Для статистики
                     class_counts[cls_name] = class_counts.get(cls_name, 0) + 1
@@ -505,27 +362,27 @@ class DetectionManager(QObject):
             # Обновляем сцену
             if viewer.cur_page == page_idx:
                 viewer.scene_.update()
-                QApplication.processEvents()
 
         except Exception as e:
             logger.error(f"Ошибка при обработке результатов детекции: {e}")
             import traceback
             logger.error(traceback.format_exc())
 
+    @timed("segm.apply")
     def process_segmentation_results(self, results, viewer, page_idx, expansion=10, img_shape=None, offset=(0, 0)):
         """Обрабатывает результаты сегментации и создает маски"""
-        if not results or not hasattr(results[0], 'masks') or results[0].masks is None:
+        if not results or not results.get('polys'):
             logger.warning("Нет результатов сегментации")
             return
 
         try:
-            masks = results[0].masks
-            names = results[0].names
+            polys = results['polys']
+            names = results['names']
 
             # Определяем размеры изображения
             if img_shape:
                 h, w = img_shape[:2]
-            elif page_idx in viewer.pixmaps and not viewer.pixmaps[page_idx].isNull():
+            elif 0 <= page_idx < len(viewer.pixmaps) and not viewer.pixmaps[page_idx].isNull():
                 h, w = viewer.pixmaps[page_idx].height(), viewer.pixmaps[page_idx].width()
             else:
                 h, w = 1000, 1000
@@ -537,10 +394,9 @@ class DetectionManager(QObject):
             masks_added = 0
             class_counts = {}
 
-            for i in range(len(masks)):
-                segment = masks.xy[i]
-                cls_id = int(results[0].boxes[i].cls.item())
-                conf = float(results[0].boxes[i].conf.item())
+            for i, segment in enumerate(polys):
+                cls_id = int(results['cls'][i])
+                conf = float(results['conf'][i])
                 raw_name = names.get(cls_id, str(cls_id))
 
                 # Нормализация имени класса для сегментации
@@ -563,28 +419,25 @@ class DetectionManager(QObject):
                     logger.debug(f"Низкая уверенность для {cls_name}: {conf}")
                     continue
 
+                # Смещение, расширение, упрощение и обрезка - на массивах
+                pts = np.asarray(segment, dtype=np.float32).reshape(-1, 2) + np.asarray(offset, dtype=np.float32)
                 if expansion > 0:
-                    segment = self._expand_polygon(segment, expansion)
-
-                # Смещение точек
-                offset_segment = [[
-                    max(0, min(x + offset[0], w - 1)),
-                    max(0, min(y + offset[1], h - 1))
-                ] for x, y in segment]
+                    pts = offset_polygon(pts, expansion)
+                pts = simplify_polygon(pts)
+                np.clip(pts, 0, [w - 1, h - 1], out=pts)
 
-                if len(offset_segment) < 3:
+                if len(pts) < 3:
                     continue
 
                 color = cls_info.get('color', (255, 255, 0))
-                poly_mask = EditablePolygonMask(offset_segment, 'segm', cls_name, conf, color)
+                poly_mask = EditablePolygonMask(pts.tolist(), 'segm', cls_name, conf, color)
                 poly_mask.last_expansion = expansion
                 poly_mask.set_page_index(page_idx)
-
-                viewer.scene_.addItem(poly_mask)
-                viewer.masks[page_idx].append(poly_mask)
-                poly_mask.setVisible(viewer.cur_page == page_idx)
                 poly_mask.setZValue(100)
 
+                # Маски других страниц не добавляются на общую сцену
+                viewer.add_mask_item(page_idx, poly_mask)
+
                 masks_added += 1
                 class_counts[cls_name] = class_counts.get(cls_name, 0) + 1
 
@@ -605,31 +458,6 @@ class DetectionManager(QObject):
             import traceback
             logger.error(traceback.format_exc())
 
-    def _expand_polygon(self, polygon, expansion):
-        """Расширяет полигон на указанное количество пикселей"""
-        if len(polygon) < 3:
-            return polygon
-
-        # Находим центр
-        center_x = sum(p[0] for p in polygon) / len(polygon)
-        center_y = sum(p[1] for p in polygon) / len(polygon)
-
-        # Расширяем от центра
-        expanded = []
-        for p in polygon:
-            dx = p[0] - center_x
-            dy = p[1] - center_y
-
-            # Нормализация
-            length = max(0.0001, (dx * dx + dy * dy) ** 0.5)
-            dx /= length
-            dy /= length
-
-            # Расширение
-            expanded.append([p[0] + dx * expansion, p[1] + dy * expansion])
-
-        return expanded
-
     def add_mask_to_combined(self, mask, combined_mask, w, h):
         """Добавляет маску в объединенную маску"""
         try:
@@ -652,18 +480,11 @@ class DetectionManager(QObject):
                     logger.debug(f"Добавлен прямоугольник: ({x1},{y1})-({x2},{y2})")
 
             elif isinstance(mask, EditablePolygonMask):
-                polygon = mask.polygon()
-                points = []
-                for i in range(polygon.count()):
-                    point = polygon.at(i)
-                    x = max(0, min(int(point.x()), w - 1))
-                    y = max(0, min(int(point.y()), h - 1))
-                    points.append((x, y))
-
-                if len(points) > 2:
-                    pts = np.array(points, np.int32).reshape((-1, 1, 2))
-                    cv2.fillPoly(combined_mask, [pts], 255)
-                    logger.debug(f"Добавлен полигон с {len(points)} точками")
+                pts = polygon_points(mask)
+                if len(pts) > 2:
+                    pts = np.clip(pts.astype(np.int32), 0, [w - 1, h - 1])
+                    cv2.fillPoly(combined_mask, [pts.reshape((-1, 1, 2))], 255)
+                    logger.debug(f"Добавлен полигон с {len(pts)} точками")
 
             elif isinstance(mask, BrushStroke):
                 if mask.path.isEmpty():
@@ -711,153 +532,415 @@ class DetectionManager(QObject):
             import traceback
             logger.error(traceback.format_exc())
 
-    def process_detection_pages(self, window, pages_to_process, expansion_value):
-        """Последовательная обработка страниц для детекции"""
-        from PySide6.QtCore import QTimer
-        PROGRESS_AUTO_HIDE_MS = 5000
-
-        if window.det_canc:
-            window._restore_detect_btn()
-            window._upd_prog_bar(window.detect_prog, 0, 1, "Детекция отменена")
-
-            def hide_progress():
-                if hasattr(window, 'detect_prog') and window.detect_prog:
-                    try:
-                        window.detect_prog.setVisible(False)
-                    except RuntimeError:
-                        pass
-
-            QTimer.singleShot(PROGRESS_AUTO_HIDE_MS, hide_progress)
-            window.unlock_ui()
+    def _page_source(self, window, page_idx):
+        """Источник страницы для воркера: QImage из памяти или путь к файлу"""
+        viewer = window.viewer
+        if 0 <= page_idx < len(viewer.pixmaps) and not viewer.pixmaps[page_idx].isNull():
+            return viewer.pixmaps[page_idx].toImage()
+        return window.img_paths[page_idx]
+
+    def _page_key(self, window, page_idx):
+        """Ключ актуальности кэша: cacheKey pixmap (меняется при замене страницы) или путь"""
+        viewer = window.viewer
+        if 0 <= page_idx < len(viewer.pixmaps) and not viewer.pixmaps[page_idx].isNull():
+            return ('pixmap', viewer.pixmaps[page_idx].cacheKey())
+        return ('file', window.img_paths[page_idx])
+
+    def _disk_key(self, window, page_idx, kind):
+        """
+        (сигнатура изображения, хэш модели) для дискового кэша или None,
+        если страница изменена в памяти и не совпадает с файлом
+        """
+        viewer = window.viewer
+        if 0 <= page_idx < len(viewer.pixmaps) and not viewer.pixmaps[page_idx].isNull():
+            if self.loaded_keys.get(page_idx) != viewer.pixmaps[page_idx].cacheKey():
+                return None
+        sig = image_signature(window.img_paths[page_idx])
+        model_hash = self._model_hash(kind)
+        if sig is None or model_hash is None:
+            return None
+        # Результаты с нарезкой и без нее различаются
+        return sig, f"{model_hash}|slice={int(self.slice_tall)}"
+
+    def _page_name(self, window, page_idx):
+        return os.path.basename(window.img_paths[page_idx])
+
+    def cached_outputs(self, window, page_idx):
+        """
+        Закэшированные результаты страницы {тип: результат}: из памяти,
+        недостающие - с диска. {} если страница изменилась
+        """
+        key = self._page_key(window, page_idx)
+        entry = self.page_cache.get(page_idx)
+        outputs = dict(entry[1]) if entry is not None and entry[0] == key else {}
+
+        if self.store is not None and 0 <= page_idx < len(window.img_paths):
+            for kind in ('detect', 'segm'):
+                if kind in outputs:
+                    continue
+                disk_key = self._disk_key(window, page_idx, kind)
+                raw = self.store.load(self._page_name(window, page_idx), kind, *disk_key) if disk_key else None
+                if raw is not None:
+                    outputs[kind] = raw
+
+        if outputs:
+            self.page_cache[page_idx] = (key, outputs)
+        return outputs
+
+    def _persist(self, window, page_idx, outputs):
+        """Сохраняет результаты на диск, если страница совпадает с файлом"""
+        if self.store is None:
             return
+        name = self._page_name(window, page_idx)
+        for kind, raw in outputs.items():
+            disk_key = self._disk_key(window, page_idx, kind)
+            if disk_key is not None:
+                self.store.save(name, kind, *disk_key, raw)
+
+    def mark_applied(self, window, page_idx, kind, applied=True):
+        """Отмечает, что маски типа kind на странице построены из кэша результатов"""
+        if self.store is not None and 0 <= page_idx < len(window.img_paths):
+            self.store.set_applied(self._page_name(window, page_idx), kind, applied)
+
+    def refilter_page(self, window, page_idx, kind, expansion=None):
+        """
+        Пересобирает маски типа kind из кэша с текущими порогами, классами
+        и расширением, без инференса. Только для страниц, где результаты этого
+        типа уже показаны. False, если пересобирать нечего.
+        """
+        shown = any(getattr(m, 'mask_type', None) == kind for m in window.viewer.masks.get(page_idx, []))
+        if not shown and not (self.store is not None and 0 <= page_idx < len(window.img_paths)
+                              and self.store.is_applied(self._page_name(window, page_idx), kind)):
+            return False
 
-        if window.current_page_index >= window.total_pages:
-            # Завершаем обработку
-            window._upd_prog_bar(
-                window.detect_prog, window.total_pages, window.total_pages, "Детекция завершена")
-
-            # Обновляем отображение
-            window.viewer.display_current_page()
-
-            # Восстанавливаем интерфейс
-            window._restore_detect_btn()
+        raw = self.cached_outputs(window, page_idx).get(kind)
+        if raw is None:
+            return False
 
-            def hide_progress():
-                if hasattr(window, 'detect_prog') and window.detect_prog:
-                    try:
-                        window.detect_prog.setVisible(False)
-                    except RuntimeError:
-                        pass
+        window._clear_page_masks(page_idx, kind)
+        if kind == 'detect':
+            if expansion is None:
+                expansion = window.expand_slider.value()
+            self.process_detection_results(raw, window.viewer, page_idx, expansion)
+        else:
+            if expansion is None:
+                expansion = window.segm_expand_slider.value()
+            self.process_segmentation_results(raw, window.viewer, page_idx, expansion)
+        self.mark_applied(window, page_idx, kind)
+
+        window.upd_comb_mask(page_idx)
+        window.upd_thumb_no_mask(page_idx)
+        return True
+
+    def restore_detections(self, window, skip=()):
+        """
+        Отмечает страницы для восстановления масок из дискового кэша. Сами маски
+        строятся лениво, при показе или очистке страницы (restore_page).
+        skip - страницы, маски которых восстанавливаются из сохраненных масок.
+        """
+        if self.store is None:
+            self.restore_pending = set()
+            return
+        self.restore_pending = {page_idx for page_idx in range(len(window.img_paths)) if page_idx not in skip}
+
+    def restore_page(self, window, page_idx):
+        """
+        Маски страницы из дискового кэша, если они были на ней применены.
+        Пока хэш модели считается, страница остается в очереди. Возвращает число восстановленных типов.
+        """
+        if page_idx not in self.restore_pending:
+            return 0
+        existing = {getattr(m, 'mask_type', None) for m in window.viewer.masks.get(page_idx, [])}
+        name = self._page_name(window, page_idx)
+        restored = 0
+        waiting = False
+        for kind in ('detect', 'segm'):
+            if kind in existing or not self.store.is_applied(name, kind):
+                continue
+            if self._model_available(kind) and self._model_hash(kind) is None:
+                waiting = True
+                continue
+            if self.refilter_page(window, page_idx, kind):
+                restored += 1
+        if not waiting:
+            self.restore_pending.discard(page_idx)
+        if restored:
+            logger.debug(f"Страница {page_idx + 1}: восстановлено результатов из кэша: {restored}")
+        return restored
+
+    def invalidate_cache(self, page_idx=None):
+        """Сбрасывает кэш результатов страницы (или всех страниц)"""
+        if page_idx is None:
+            self.page_cache.clear()
+        else:
+            self.page_cache.pop(page_idx, None)
+
+    def _model_available(self, kind):
+        return os.path.exists(self.ai_models.get(kind) or "")
+
+    def _job_kinds(self, kind):
+        """Модели задания: основная и, при analyze_together, вторая доступная"""
+        kinds = [kind]
+        other = 'segm' if kind == 'detect' else 'detect'
+        if self.analyze_together and self._model_available(other):
+            kinds.append(other)
+        return kinds
+
+    def _ensure_worker(self):
+        """Создает и запускает поток инференса при первом задании"""
+        if self.worker is None:
+            self.worker = DetectionWorker()
+            self.worker.need_pages.connect(self._on_need_pages)
+            self.worker.page_done.connect(self._on_page_done)
+            self.worker.page_failed.connect(self._on_page_failed)
+            self.worker.job_finished.connect(self._on_job_finished)
+            self.worker.start()
+        return self.worker
+
+    def submit(self, kinds, pages, source_fn, on_page=None, on_finish=None, conf=DEF_CONF, key_fn=None,
+               window=None):
+        """
+        Ставит задание в очередь воркера. kinds - 'detect', 'segm' или список.
+        source_fn(page_idx) вызывается в GUI-потоке по мере надобности,
+        key_fn(page_idx) - ключ кэша (None - результаты не кэшируются),
+        window - окно главы для сохранения результатов в дисковый кэш.
+        on_page(page_idx, {тип: результат}) получает результаты (None при ошибке),
+        on_finish(cancelled) - завершение. Возвращает job_id.
+        """
+        if isinstance(kinds, str):
+            kinds = [kinds]
+        getters = {kind: self._model_getter(kind) for kind in kinds}
+        self._job_seq += 1
+        job = DetectionJob(self._job_seq, getters, len(pages), self.batch_size, conf, self.slice_tall,
+                           page_ids=pages)
+        self.jobs[job.job_id] = {'job': job, 'pending': list(pages), 'source': source_fn, 'keys': {},
+                                 'key_fn': key_fn, 'window': window, 'on_page': on_page, 'on_finish': on_finish,
+                                 'errors': []}
+        self._ensure_worker().submit(job)
+        return job.job_id
+
+    def analyze_pages(self, window, pages, on_page=None, on_finish=None):
+        """
+        Единый проход детекции и сегментации: страница конвертируется один раз,
+        результаты обеих моделей кэшируются для последующей перефильтрации
+        """
+        kinds = [k for k in ('detect', 'segm') if self._model_available(k)]
+        return self.submit(kinds, pages, lambda idx: self._page_source(window, idx), on_page, on_finish,
+                           key_fn=lambda idx: self._page_key(window, idx), window=window)
+
+    def _on_need_pages(self, job_id, count):
+        """Подает воркеру очередную порцию страниц (GUI-поток)"""
+        ctx = self.jobs.get(job_id)
+        if ctx is None:
+            return
+        items = []
+        pending = ctx['pending']
+        while pending and len(items) < count:
+            page_idx = pending.pop(0)
+            try:
+                source = ctx['source'](page_idx)
+                if ctx['key_fn']:
+                    # Ключ фиксируется в момент подачи: страница может смениться до результата
+                    ctx['keys'][page_idx] = ctx['key_fn'](page_idx)
+            except Exception as e:
+                logger.error(f"Ошибка подготовки страницы {page_idx}: {str(e)}")
+                source = None
+            items.append((page_idx, source))
+        ctx['job'].add_pages(items)
+
+    def _on_page_done(self, job_id, page_idx, outputs):
+        ctx = self.jobs.get(job_id)
+        if ctx is None or ctx['job'].token.cancelled:
+            return
+        key = ctx['keys'].pop(page_idx, None)
+        if key is not None:
+            entry = self.page_cache.get(page_idx)
+            cached = dict(entry[1]) if entry is not None and entry[0] == key else {}
+            cached.update(outputs)
+            self.page_cache[page_idx] = (key, cached)
+            window = ctx['window']
+            if window is not None and key == self._page_key(window, page_idx):
+                self._persist(window, page_idx, outputs)
+        self.page_result.emit(page_idx, outputs)
+        if ctx['on_page']:
+            ctx['on_page'](page_idx, outputs)
+
+    def _on_page_failed(self, job_id, page_idx, message):
+        logger.warning(f"Страница {page_idx + 1} не обработана: {message}")
+        ctx = self.jobs.get(job_id)
+        if ctx is None or ctx['job'].token.cancelled:
+            return
+        ctx['errors'].append((page_idx, message))
+        if ctx['on_page']:
+            ctx['on_page'](page_idx, None)
 
-            QTimer.singleShot(PROGRESS_AUTO_HIDE_MS, hide_progress)
-            window.unlock_ui()
+    def _on_job_finished(self, job_id, cancelled):
+        ctx = self.jobs.pop(job_id, None)
+        if ctx is None:
             return
+        # Ошибки страниц завершенного задания (читаются в on_finish)
+        self.last_job_errors = ctx['errors']
+        self.job_done.emit(job_id, cancelled)
+        if ctx['on_finish']:
+            ctx['on_finish'](cancelled)
+
+    def cancel_job(self, job_id):
+        """Отменяет задание по идентификатору"""
+        ctx = self.jobs.get(job_id)
+        if ctx is not None:
+            ctx['job'].cancel()
+
+    def cancel_batch(self, kind):
+        """Отменяет все задания с основной моделью 'detect' или 'segm'"""
+        for ctx in list(self.jobs.values()):
+            if ctx['job'].kinds[0] == kind:
+                ctx['job'].cancel()
+
+    def shutdown(self):
+        """Отменяет задания и останавливает поток инференса"""
+        for ctx in list(self.jobs.values()):
+            ctx['job'].cancel()
+        if self.hash_pool is not None:
+            self.hash_pool.shutdown(wait=False, cancel_futures=True)
+            self.hash_pool = None
+        if self.worker is not None:
+            worker = self.worker
+            self.worker = None
+            retire_thread(worker, (worker.need_pages, worker.page_done, worker.page_failed, worker.job_finished))
+
+    def _report_job_errors(self, window, prog_bar, title, total):
+        """Итог задания с необработанными страницами: прогресс и сообщение с первой ошибкой"""
+        errors = self.last_job_errors
+        window._upd_prog_bar(prog_bar, total, total, f"{title}: не обработано страниц {len(errors)}",
+                             process_events=False)
+        first_page, message = errors[0]
+        QMessageBox.warning(window, "Ошибка",
+                            f"{title}: не обработано страниц {len(errors)} из {total}\n"
+                            f"Страница {first_page + 1}: {message}")
+
+    def _run_pages(self, kind, window, pages, on_page, on_finish):
+        """
+        Страницы с актуальным кэшем обрабатываются сразу без инференса,
+        остальные отправляются воркеру (вместе со второй моделью для кэша)
+        """
+        from PySide6.QtCore import QTimer
 
-        # Текущий индекс страницы для обработки
-        page_idx = window.pages_to_process[window.current_page_index]
+        cached, missing = [], []
+        for page_idx in pages:
+            outputs = self.cached_outputs(window, page_idx)
+            (cached if kind in outputs else missing).append((page_idx, outputs))
+
+        def finish_cached():
+            for page_idx, outputs in cached:
+                on_page(page_idx, outputs)
+            if missing:
+                self.submit(self._job_kinds(kind), [idx for idx, _ in missing],
+                            lambda idx: self._page_source(window, idx), on_page, on_finish,
+                            key_fn=lambda idx: self._page_key(window, idx), window=window)
+            else:
+                self.last_job_errors = []
+                on_finish(False)
 
-        # Формируем сообщение о прогрессе
-        if window.total_pages == 1:
-            progress_msg = "Детекция страницы..."
-        else:
-            progress_msg = f"Детекция страницы {page_idx + 1} ({window.current_page_index + 1}/{window.total_pages})"
+        if cached:
+            logger.info(f"Из кэша: {len(cached)} стр., на инференс: {len(missing)} стр.")
+        # Асинхронно, чтобы вызывающий код успел завершить подготовку интерфейса
+        QTimer.singleShot(0, finish_cached)
 
-        # Обновляем прогресс
-        window._upd_prog_bar(
-            window.detect_prog, window.current_page_index, window.total_pages, progress_msg)
+    def process_detection_pages(self, window, pages_to_process, expansion_value):
+        """Пакетная детекция страниц в фоновом потоке"""
+        from PySide6.QtCore import QTimer
+        PROGRESS_AUTO_HIDE_MS = 5000
 
-        try:
-            # Очищаем существующие маски
-            window._clear_page_masks(page_idx, 'detect')
+        def progress(val, total, msg):
+            # Без processEvents: вызывается из обработчиков сигналов воркера
+            window._upd_prog_bar(window.detect_prog, val, total, msg, process_events=False)
 
-            # Получаем путь к изображению
-            image_path = window.img_paths[page_idx]
+        def hide_progress():
+            if hasattr(window, 'detect_prog') and window.detect_prog:
+                try:
+                    window.detect_prog.setVisible(False)
+                except RuntimeError:
+                    pass
 
-            # Запускаем детекцию
-            results = self.detect_page(image_path, page_idx, expansion_value)
+        def on_page(page_idx, outputs):
+            if window.det_canc:
+                return
+            results = outputs.get('detect') if outputs else None
+            window.current_page_index += 1
+            if window.total_pages == 1:
+                progress_msg = "Детекция страницы..."
+            else:
+                progress_msg = f"Детекция страницы {page_idx + 1} ({window.current_page_index}/{window.total_pages})"
+            progress(window.current_page_index, window.total_pages, progress_msg)
 
-            if results is not None:
-                # Вместо прямой обработки, вызываем обработчик
+            if results is None:
+                logger.warning(f"Не получены результаты детекции для страницы {page_idx}")
+                return
+            try:
+                window._clear_page_masks(page_idx, 'detect')
                 window._on_detection_completed(page_idx, results)
+                self.mark_applied(window, page_idx, 'detect')
+            except Exception as e:
+                logger.error(f"Ошибка детекции страницы {page_idx}: {str(e)}")
+
+        def on_finish(cancelled):
+            if cancelled or window.det_canc:
+                progress(0, 1, "Детекция отменена")
+            elif self.last_job_errors:
+                self._report_job_errors(window, window.detect_prog, "Детекция", window.total_pages)
+                window.viewer.display_current_page()
             else:
-                logger.warning(f"Не получены результаты детекции для страницы {page_idx}")
-
-            # Увеличиваем индекс для следующего шага
-            window.current_page_index += 1
-
-            # Планируем следующий шаг
-            QTimer.singleShot(100, lambda: self.process_detection_pages(window, pages_to_process, expansion_value))
+                progress(window.total_pages, window.total_pages, "Детекция завершена")
+                window.viewer.display_current_page()
+            window._restore_detect_btn()
+            QTimer.singleShot(PROGRESS_AUTO_HIDE_MS, hide_progress)
+            window.unlock_ui()
 
-        except Exception as e:
-            logger.error(f"Ошибка детекции страницы {page_idx}: {str(e)}")
-            # При ошибке также увеличиваем индекс и продолжаем
-            window.current_page_index += 1
-            QTimer.singleShot(100, lambda: self.process_detection_pages(window, pages_to_process, expansion_value))
+        progress(0, window.total_pages, "Детекция страниц...")
+        self._run_pages('detect', window, pages_to_process, on_page, on_finish)
 
     def process_segmentation_pages(self, window, pages_to_process, expansion_value):
-        """Последовательная обработка страниц для сегментации"""
+        """Пакетная сегментация страниц в фоновом потоке"""
         from PySide6.QtCore import QTimer
         PROGRESS_AUTO_HIDE_MS = 5000
 
-        if window.segm_canc:
-            window._restore_segm_btn()
-            window._upd_prog_bar(window.segm_prog, 0, 1, "Сегментация отменена")
-            QTimer.singleShot(PROGRESS_AUTO_HIDE_MS, lambda: window.segm_prog.setVisible(False))
-            window.unlock_ui()
-            return
-
-        if window.segm_current_page_index >= window.segm_total_pages:
-            # Завершаем обработку
-            window._upd_prog_bar(
-                window.segm_prog, window.segm_total_pages, window.segm_total_pages, "Сегментация завершена")
+        def progress(val, total, msg):
+            window._upd_prog_bar(window.segm_prog, val, total, msg, process_events=False)
 
-            # Обновляем отображение
-            window.viewer.display_current_page()
+        def on_page(page_idx, outputs):
+            if window.segm_canc:
+                return
+            results = outputs.get('segm') if outputs else None
+            window.segm_current_page_index += 1
+            if window.segm_total_pages == 1:
+                progress_msg = "Сегментация страницы..."
+            else:
+                progress_msg = (f"Сегментация страницы {page_idx + 1} "
+                                f"({window.segm_current_page_index}/{window.segm_total_pages})")
+            progress(window.segm_current_page_index, window.segm_total_pages, progress_msg)
 
-            # Восстанавливаем интерфейс
+            if results is None:
+                return
+            try:
+                window._clear_page_masks(page_idx, 'segm')
+                self.process_segmentation_results(results, window.viewer, page_idx, expansion_value)
+                window.upd_comb_mask_from_visual(page_idx)
+                self.mark_applied(window, page_idx, 'segm')
+            except Exception as e:
+                logger.error(f"Ошибка сегментации страницы {page_idx}: {str(e)}")
+
+        def on_finish(cancelled):
+            if cancelled or window.segm_canc:
+                progress(0, 1, "Сегментация отменена")
+            elif self.last_job_errors:
+                self._report_job_errors(window, window.segm_prog, "Сегментация", window.segm_total_pages)
+                window.viewer.display_current_page()
+            else:
+                progress(window.segm_total_pages, window.segm_total_pages, "Сегментация завершена")
+                window.viewer.display_current_page()
             window._restore_segm_btn()
             QTimer.singleShot(PROGRESS_AUTO_HIDE_MS, lambda: window.segm_prog.setVisible(False))
             window.unlock_ui()
-            return
-
-        # Текущий индекс страницы для обработки
-        page_idx = window.segm_pages_to_process[window.segm_current_page_index]
-
-        # Формируем сообщение о прогрессе
-        if window.segm_total_pages == 1:
-            progress_msg = "Сегментация страницы..."
-        else:
-            progress_msg = f"Сегментация страницы {page_idx + 1} ({window.segm_current_page_index + 1}/{window.segm_total_pages})"
-
-        # Обновляем прогресс
-        window._upd_prog_bar(
-            window.segm_prog, window.segm_current_page_index, window.segm_total_pages, progress_msg)
 
-        try:
-            # Очищаем существующие маски
-            window._clear_page_masks(page_idx, 'segm')
-
-            # Получаем путь к изображению
-            image_path = window.img_paths[page_idx]
-
-            # Запускаем сегментацию
-            results = self.segment_page(image_path, page_idx, expansion_value)
-
-            if results is not None:
-                # Обрабатываем результаты
-                self.process_segmentation_results(
-                    results, window.viewer, page_idx, expansion_value)
-
-                # Обновляем миниатюру
-                window.upd_comb_mask_from_visual(page_idx)
-
-            # Увеличиваем индекс и планируем следующий шаг
-            window.segm_current_page_index += 1
-            QTimer.singleShot(100, lambda: self.process_segmentation_pages(
-                window, pages_to_process, expansion_value))
-
-        except Exception as e:
-            logger.error(f"Ошибка сегментации страницы {page_idx}: {str(e)}")
-            window.segm_current_page_index += 1
-            QTimer.singleShot(100, lambda: self.process_segmentation_pages(
-                window, pages_to_process, expansion_value))
\ No newline at end of file
+        progress(0, window.segm_total_pages, "Сегментация страниц...")
+        self._run_pages('segm', window, pages_to_process, on_page, on_finish)
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+# ui/windows/m8_4_mask_engine.py
+import sys
+import logging
+import cv2
+import numpy as np
+from PySide6.QtCore import Qt, QRect
+from PySide6.QtGui import QImage, QPainter
+from PySide6.QtWidgets import QGraphicsRectItem, QGraphicsPolygonItem
+
+logger = logging.getLogger(__name__)
+
+# Индекс байта альфа-канала в пикселе ARGB32 (0xAARRGGBB в порядке байт платформы)
+ALPHA_BYTE = 3 if sys.byteorder == "little" else 0
+# Сторона тайла разреженного слоя рисования
+DRAW_TILE = 256
+# Допуск упрощения контуров сегментации (Douglas-Peucker), px
+POLY_SIMPLIFY_EPS = 1.5
+
+
+def qimage_alpha(qimg):
+    """Альфа-канал QImage как массив (h, w) uint8 без попиксельного обхода"""
+    if qimg.isNull():
+        return np.zeros((0, 0), dtype=np.uint8)
+    if qimg.format() not in (QImage.Format_ARGB32, QImage.Format_ARGB32_Premultiplied):
+        qimg = qimg.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+
+    w, h, bpl = qimg.width(), qimg.height(), qimg.bytesPerLine()
+    buf = np.frombuffer(qimg.constBits(), dtype=np.uint8, count=bpl * h).reshape(h, bpl)
+    return buf[:, :w * 4].reshape(h, w, 4)[:, :, ALPHA_BYTE].copy()
+
+
+class TiledDrawLayer:
+    """
+    Разреженный слой рисования страницы: сетка прозрачных тайлов QImage,
+    тайл создается только при первом штрихе в нем. Альфа тайла кэшируется
+    до следующего рисования в этом тайле.
+    """
+
+    def __init__(self, w, h, tile=DRAW_TILE):
+        self.w, self.h = w, h
+        self.tile = tile
+        self.tiles = {}  # (tx, ty) -> QImage ARGB32_Premultiplied
+        self.alphas = {}  # (tx, ty) -> альфа тайла (h, w) uint8
+        self.rev = 0  # ревизия, растет при любом изменении
+
+    def width(self):
+        return self.w
+
+    def height(self):
+        return self.h
+
+    def isNull(self):
+        return self.w <= 0 or self.h <= 0
+
+    def rect(self):
+        return QRect(0, 0, self.w, self.h)
+
+    def tile_rect(self, key):
+        """Прямоугольник тайла в координатах страницы (крайние тайлы обрезаны)"""
+        x, y = key[0] * self.tile, key[1] * self.tile
+        return QRect(x, y, min(self.tile, self.w - x), min(self.tile, self.h - y))
+
+    def _keys(self, rect):
+        r = QRect(rect).intersected(self.rect())
+        if r.isEmpty():
+            return []
+        t = self.tile
+        return [(tx, ty)
+                for ty in range(r.top() // t, r.bottom() // t + 1)
+                for tx in range(r.left() // t, r.right() // t + 1)]
+
+    def _tile_alpha(self, key):
+        alpha = self.alphas.get(key)
+        if alpha is None:
+            alpha = qimage_alpha(self.tiles[key])
+            self.alphas[key] = alpha
+        return alpha
+
+    def paint(self, rect, draw, create=True):
+        """
+        Вызывает draw(painter) для тайлов, пересекающих rect (координаты страницы).
+        create=False - только существующие тайлы (ластик), опустевшие удаляются.
+        Возвращает True, если слой изменился.
+        """
+        changed = False
+        for key in self._keys(rect):
+            img = self.tiles.get(key)
+            if img is None:
+                if not create:
+                    continue
+                tr = self.tile_rect(key)
+                img = QImage(tr.width(), tr.height(), QImage.Format_ARGB32_Premultiplied)
+                img.fill(Qt.transparent)
+                self.tiles[key] = img
+
+            painter = QPainter(img)
+            painter.translate(-key[0] * self.tile, -key[1] * self.tile)
+            draw(painter)
+            painter.end()
+            self.alphas.pop(key, None)
+            changed = True
+
+            if not create and not self._tile_alpha(key).any():
+                del self.tiles[key]
+                del self.alphas[key]
+
+        if changed:
+            self.rev += 1
+        return changed
+
+    def set_tile_mask(self, key, mask, color):
+        """
+        Восстанавливает тайл из бинарной маски (h, w): пиксели маски
+        закрашиваются непрозрачным цветом color (r, g, b). Пустая маска удаляет тайл.
+        """
+        tr = self.tile_rect(key)
+        src = np.asarray(mask, dtype=bool)[:tr.height(), :tr.width()]
+        mask = np.zeros((tr.height(), tr.width()), dtype=bool)
+        mask[:src.shape[0], :src.shape[1]] = src
+        if not mask.any():
+            if self.tiles.pop(key, None) is not None:
+                self.alphas.pop(key, None)
+                self.rev += 1
+            return
+
+        r, g, b = (int(c) for c in color[:3])
+        argb = np.uint32((255 << 24) | (r << 16) | (g << 8) | b)
+        buf = np.zeros((tr.height(), tr.width()), dtype=np.uint32)
+        buf[mask] = argb
+        img = QImage(buf.data, tr.width(), tr.height(), tr.width() * 4, QImage.Format_ARGB32_Premultiplied).copy()
+        self.tiles[key] = img
+        self.alphas[key] = np.where(mask, np.uint8(255), np.uint8(0))
+        self.rev += 1
+
+    def clear(self):
+        """Удаляет все тайлы"""
+        if self.tiles:
+            self.tiles.clear()
+            self.alphas.clear()
+            self.rev += 1
+
+    def has_content(self, threshold=0):
+        """Есть ли хоть один пиксель с альфой больше threshold"""
+        return any((self._tile_alpha(key) > threshold).any() for key in list(self.tiles))
+
+    def mask_into(self, out, threshold=0):
+        """
+        Записывает 255 в out (h, w) uint8 для пикселей с альфой больше threshold,
+        обходя только созданные тайлы. Возвращает число таких пикселей.
+        """
+        count = 0
+        oh, ow = out.shape[:2]
+        for key in list(self.tiles):
+            tr = self.tile_rect(key)
+            x, y = tr.x(), tr.y()
+            alpha = self._tile_alpha(key)
+            hh, ww = min(alpha.shape[0], oh - y), min(alpha.shape[1], ow - x)
+            if hh <= 0 or ww <= 0:
+                continue
+            sel = alpha[:hh, :ww] > threshold
+            out[y:y + hh, x:x + ww][sel] = 255
+            count += int(np.count_nonzero(sel))
+        return count
+
+    def mask(self, threshold=0):
+        """Бинарная маска (0/255) слоя во весь размер страницы"""
+        out = np.zeros((self.h, self.w), dtype=np.uint8)
+        self.mask_into(out, threshold)
+        return out
+
+
+def polygon_points(item):
+    """
+    Вершины полигона элемента как массив (n, 2) float64 в его локальных координатах.
+    Кэшируется по ревизии геометрии, так что обход QPolygonF идет только после изменений.
+    """
+    rev = getattr(item, 'geom_rev', None)
+    cached = getattr(item, '_pts_cache', None)
+    if cached is not None and rev is not None and cached[0] == rev:
+        return cached[1]
+
+    polygon = item.polygon()
+    pts = np.array([(polygon.at(i).x(), polygon.at(i).y()) for i in range(polygon.count())],
+                   dtype=np.float64).reshape(-1, 2)
+    if rev is not None:
+        item._pts_cache = (rev, pts)
+    return pts
+
+
+def offset_polygon(pts, expansion):
+    """
+    Расширение полигона на expansion px: растр полигона расширяется cv2.dilate
+    (настоящее смещение контура, а не отталкивание от центра) и снова
+    превращается во внешний контур. Возвращает массив (k, 2) float32.
+    """
+    pts = np.asarray(pts, dtype=np.float32).reshape(-1, 2)
+    if expansion <= 0 or len(pts) < 3:
+        return pts
+
+    e = int(np.ceil(expansion))
+    x0, y0 = np.floor(pts.min(axis=0)).astype(np.int32) - e - 1
+    x1, y1 = np.ceil(pts.max(axis=0)).astype(np.int32) + e + 1
+    local = np.round(pts - (x0, y0)).astype(np.int32)
+
+    raster = np.zeros((y1 - y0 + 1, x1 - x0 + 1), dtype=np.uint8)
+    cv2.fillPoly(raster, [local.reshape(-1, 1, 2)], 255)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * e + 1, 2 * e + 1))
+    raster = cv2.dilate(raster, kernel)
+
+    contours, _ = cv2.findContours(raster, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return pts
+    contour = max(contours, key=cv2.contourArea)
+    return contour.reshape(-1, 2).astype(np.float32) + (x0, y0)
+
+
+def simplify_polygon(pts, eps=POLY_SIMPLIFY_EPS):
+    """Упрощение контура Douglas-Peucker; возвращает массив (k, 2) float32"""
+    pts = np.asarray(pts, dtype=np.float32).reshape(-1, 2)
+    if eps <= 0 or len(pts) <= 4:
+        return pts
+    return cv2.approxPolyDP(pts.reshape(-1, 1, 2), eps, True).reshape(-1, 2)
+
+
+def item_geometry_key(item):
+    """Ключ геометрии элемента маски: ревизия формы и позиция на сцене"""
+    pos = item.pos()
+    return (getattr(item, 'geom_rev', id(item)), pos.x(), pos.y())
+
+
+def box_rect(x1, y1, x2, y2, w, h):
+    """Бокс детекции (с расширением), обрезанный по странице: (x, y, ширина, высота) или None"""
+    x1, x2 = max(0, min(x1, w)), max(0, min(x2, w))
+    y1, y2 = max(0, min(y1, h)), max(0, min(y2, h))
+    if x2 - x1 <= 0 or y2 - y1 <= 0:
+        return None
+    return x1, y1, x2 - x1, y2 - y1
+
+
+def rect_span(x, y, rw, rh, w, h):
+    """Пиксели прямоугольной маски: (x1, y1, x2, y2) включительно или None"""
+    x1 = max(0, min(int(x), w - 1))
+    y1 = max(0, min(int(y), h - 1))
+    x2 = max(0, min(int(x + rw), w - 1))
+    y2 = max(0, min(int(y + rh), h - 1))
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return x1, y1, x2, y2
+
+
+def rasterize_item(item, w, h):
+    """
+    Растр одного элемента маски в пределах его рамки.
+    Возвращает (x0, y0, массив 0/1) или None, если элемент вне страницы.
+    """
+    ox, oy = item.pos().x(), item.pos().y()
+
+    if isinstance(item, QGraphicsRectItem):
+        rect = item.rect()
+        span = rect_span(rect.x() + ox, rect.y() + oy, rect.width(), rect.height(), w, h)
+        if span is None:
+            return None
+        x1, y1, x2, y2 = span
+        return x1, y1, np.ones((y2 - y1 + 1, x2 - x1 + 1), dtype=np.uint8)
+
+    if isinstance(item, QGraphicsPolygonItem):
+        pts = polygon_points(item)
+        if len(pts) < 3:
+            return None
+        pts = np.clip((pts + (ox, oy)).astype(np.int32), 0, [w - 1, h - 1])
+        x0, y0 = pts.min(axis=0)
+        x1, y1 = pts.max(axis=0)
+        sub = np.zeros((y1 - y0 + 1, x1 - x0 + 1), dtype=np.uint8)
+        cv2.fillPoly(sub, [(pts - (x0, y0)).reshape((-1, 1, 2))], 1)
+        return int(x0), int(y0), sub
+
+    return None
+
+
+class PageMaskModel:
+    """
+    Послойная маска страницы: у каждого элемента свой кэшированный растр,
+    пересчитываемый только при изменении его геометрии. Покрытие хранится
+    счетчиком, поэтому элемент можно убрать без пересборки остальных.
+    """
+
+    def __init__(self, w, h):
+        self.w, self.h = w, h
+        self.cover = np.zeros((h, w), dtype=np.uint16)
+        self.items = {}  # id(item) -> (item, key, x0, y0, растр)
+
+    def _apply(self, entry, sign):
+        _, _, x0, y0, sub = entry
+        region = self.cover[y0:y0 + sub.shape[0], x0:x0 + sub.shape[1]]
+        if sign > 0:
+            region += sub
+        else:
+            region -= sub
+
+    def sync(self, mask_items):
+        """Приводит модель к списку элементов, возвращает число перерисованных"""
+        seen = set()
+        changed = 0
+        for item in mask_items:
+            k = id(item)
+            seen.add(k)
+            key = item_geometry_key(item)
+            old = self.items.get(k)
+            if old is not None and old[1] == key:
+                continue
+
+            if old is not None:
+                self._apply(old, -1)
+                del self.items[k]
+            raster = rasterize_item(item, self.w, self.h)
+            if raster is not None:
+                entry = (item, key) + raster
+                self._apply(entry, 1)
+                self.items[k] = entry
+            changed += 1
+
+        for k in [k for k in self.items if k not in seen]:
+            self._apply(self.items.pop(k), -1)
+            changed += 1
+        return changed
+
+    def mask(self):
+        """Объединенная маска элементов (0/255)"""
+        return np.where(self.cover > 0, np.uint8(255), np.uint8(0))
+
+    def __len__(self):
+        return len(self.items)
@@ -0,0 +1,503 @@
+# -*- coding: utf-8 -*-
+# ui/windows/m8_5_detection.py
+import os
+import json
+import queue
+import hashlib
+import logging
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from PySide6.QtCore import QThread, Signal
+from PySide6.QtGui import QImage
+
+from ui.components.model_registry import get_device
+from ui.components.stage_timer import get_stage_timer
+
+logger = logging.getLogger(__name__)
+
+DEF_BATCH = 4
+DEF_CONF = 0.25
+# Нарезка высоких страниц (вебтун): отношение высоты к ширине, перекрытие окон,
+# минимальная доля меньшего бокса в пересечении для слияния на стыках
+SLICE_MIN_RATIO = 2.0
+SLICE_OVERLAP = 0.25
+SLICE_MERGE_IOS = 0.5
+# Максимум изображений в одном вызове модели
+MAX_PREDICT_IMGS = 16
+
+
+def qimage_to_bgr(qimg):
+    """QImage -> массив BGR (h, w, 3) с учетом выравнивания строк"""
+    if qimg.format() != QImage.Format_RGB888:
+        qimg = qimg.convertToFormat(QImage.Format_RGB888)
+    w, h, bpl = qimg.width(), qimg.height(), qimg.bytesPerLine()
+    buf = np.frombuffer(qimg.constBits(), dtype=np.uint8, count=bpl * h).reshape(h, bpl)
+    return cv2.cvtColor(buf[:, :w * 3].reshape(h, w, 3), cv2.COLOR_RGB2BGR)
+
+
+def load_bgr(path):
+    """Чтение файла в BGR (поддерживает не-ASCII пути)"""
+    if not path or not os.path.exists(path):
+        return None
+    data = np.fromfile(path, dtype=np.uint8)
+    return cv2.imdecode(data, cv2.IMREAD_COLOR)
+
+
+def to_bgr(source):
+    """Источник страницы (QImage, путь или массив) -> массив BGR"""
+    if isinstance(source, QImage):
+        return None if source.isNull() else qimage_to_bgr(source)
+    if isinstance(source, np.ndarray):
+        return source
+    return load_bgr(source)
+
+
+def extract_raw(res):
+    """
+    Results ultralytics -> компактный словарь на numpy (без тензоров):
+    боксы, уверенности, классы, имена классов и полигоны сегментации
+    """
+    res = res.cpu()
+    boxes = res.boxes
+    raw = {
+        'names': {int(k): str(v) for k, v in res.names.items()},
+        'shape': tuple(int(v) for v in res.orig_shape),
+        'xyxy': boxes.xyxy.numpy().astype(np.float32).reshape(-1, 4),
+        'conf': boxes.conf.numpy().astype(np.float32).reshape(-1),
+        'cls': boxes.cls.numpy().astype(np.int32).reshape(-1),
+    }
+    if res.masks is not None:
+        raw['polys'] = [np.asarray(p, dtype=np.float32).reshape(-1, 2) for p in res.masks.xy]
+    return raw
+
+
+def slice_windows(h, w, overlap=SLICE_OVERLAP, min_ratio=SLICE_MIN_RATIO):
+    """
+    Окна (y0, y1) для нарезки страницы по высоте: квадраты со стороной,
+    равной ширине страницы, с перекрытием. Невысокая страница - одно окно.
+    """
+    if w <= 0 or h < w * min_ratio:
+        return [(0, h)]
+    step = max(1, int(w * (1 - overlap)))
+    ys = list(range(0, h - w + 1, step))
+    if ys[-1] + w < h:
+        ys.append(h - w)
+    return [(y, y + w) for y in ys]
+
+
+def _union_polygon(polys):
+    """Объединение полигонов через растр: внешний контур наибольшей связной области"""
+    pts = np.concatenate(polys)
+    x0, y0 = np.floor(pts.min(axis=0)).astype(np.int32)
+    x1, y1 = np.ceil(pts.max(axis=0)).astype(np.int32)
+    canvas = np.zeros((y1 - y0 + 1, x1 - x0 + 1), dtype=np.uint8)
+    for p in polys:
+        if len(p) >= 3:
+            cv2.fillPoly(canvas, [np.round(p - (x0, y0)).astype(np.int32)], 255)
+    contours, _ = cv2.findContours(canvas, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return polys[0]
+    return max(contours, key=cv2.contourArea).reshape(-1, 2).astype(np.float32) + (x0, y0)
+
+
+def merge_slices(parts, shape, merge_ios=SLICE_MERGE_IOS):
+    """
+    Слияние результатов окон [(y0, raw)] в результат страницы.
+    Боксы одного класса, пересекающиеся больше чем на merge_ios площади
+    меньшего из них, объединяются (NMS для дублей в перекрытии и склейка
+    объектов, разрезанных стыком); полигоны таких объектов объединяются.
+    """
+    names = {}
+    xyxy, conf, cls, polys = [], [], [], []
+    has_polys = any('polys' in raw for _, raw in parts)
+    for y0, raw in parts:
+        names.update(raw['names'])
+        if not len(raw['conf']):
+            continue
+        xyxy.append(raw['xyxy'] + np.array([0, y0, 0, y0], dtype=np.float32))
+        conf.append(raw['conf'])
+        cls.append(raw['cls'])
+        if has_polys:
+            raw_polys = raw.get('polys') or [np.zeros((0, 2), dtype=np.float32)] * len(raw['conf'])
+            polys.extend(p + np.array([0, y0], dtype=np.float32) for p in raw_polys)
+
+    merged = {'names': names, 'shape': tuple(shape)}
+    if not xyxy:
+        merged.update(xyxy=np.zeros((0, 4), np.float32), conf=np.zeros(0, np.float32), cls=np.zeros(0, np.int32))
+        if has_polys:
+            merged['polys'] = []
+        return merged
+
+    xyxy, conf, cls = np.concatenate(xyxy), np.concatenate(conf), np.concatenate(cls)
+    areas = np.maximum(0, xyxy[:, 2] - xyxy[:, 0]) * np.maximum(0, xyxy[:, 3] - xyxy[:, 1])
+
+    # Жадная кластеризация по уверенности
+    clusters = []  # [индексы]
+    boxes = []  # текущий объединенный бокс кластера
+    for i in np.argsort(-conf):
+        target = None
+        for c, members in enumerate(clusters):
+            if cls[members[0]] != cls[i]:
+                continue
+            bx = boxes[c]
+            iw = min(bx[2], xyxy[i, 2]) - max(bx[0], xyxy[i, 0])
+            ih = min(bx[3], xyxy[i, 3]) - max(bx[1], xyxy[i, 1])
+            if iw <= 0 or ih <= 0:
+                continue
+            b_area = (bx[2] - bx[0]) * (bx[3] - bx[1])
+            if iw * ih > merge_ios * max(1e-6, min(b_area, areas[i])):
+                target = c
+                break
+        if target is None:
+            clusters.append([i])
+            boxes.append(xyxy[i].copy())
+        else:
+            clusters[target].append(i)
+            bx = boxes[target]
+            boxes[target] = np.array([min(bx[0], xyxy[i, 0]), min(bx[1], xyxy[i, 1]),
+                                      max(bx[2], xyxy[i, 2]), max(bx[3], xyxy[i, 3])], dtype=np.float32)
+
+    merged['xyxy'] = np.array(boxes, dtype=np.float32).reshape(-1, 4)
+    merged['conf'] = np.array([conf[m].max() for m in clusters], dtype=np.float32)
+    merged['cls'] = np.array([cls[m[0]] for m in clusters], dtype=np.int32)
+    if has_polys:
+        merged['polys'] = []
+        for members in clusters:
+            parts_polys = [polys[j] for j in members if len(polys[j]) >= 3]
+            if len(parts_polys) > 1:
+                merged['polys'].append(_union_polygon(parts_polys))
+            else:
+                merged['polys'].append(parts_polys[0] if parts_polys else polys[members[0]])
+    return merged
+
+
+_hash_memo = {}
+
+
+def file_hash(path):
+    """SHA-1 файла модели (запоминается по пути, размеру и времени изменения)"""
+    if not path or not os.path.exists(path):
+        return None
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    digest = _hash_memo.get(memo_key)
+    if digest is None:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = _hash_memo[memo_key] = h.hexdigest()
+    return digest
+
+
+def image_signature(path):
+    """Сигнатура файла изображения: размер и время изменения"""
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+class DetectionStore:
+    """
+    Дисковый кэш компактных результатов по страницам главы.
+    Файл <имя>.<тип>.npz хранит сигнатуру изображения и хэш модели:
+    при несовпадении результат считается устаревшим. applied.json хранит,
+    какие результаты были применены к странице (для восстановления масок).
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.applied_path = os.path.join(folder, "applied.json")
+        self.applied = {}
+        if os.path.exists(self.applied_path):
+            try:
+                with open(self.applied_path, "r", encoding="utf-8") as f:
+                    self.applied = json.load(f)
+            except Exception as e:
+                logger.warning(f"Не удалось прочитать {self.applied_path}: {e}")
+
+    def _file(self, name, kind):
+        return os.path.join(self.folder, f"{name}.{kind}.npz")
+
+    def load(self, name, kind, sig, model_hash):
+        """Результат из кэша или None, если его нет или он устарел"""
+        path = self._file(name, kind)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if str(data['sig']) != sig or str(data['model']) != model_hash:
+                    return None
+                raw = {
+                    'names': {int(k): v for k, v in json.loads(str(data['names'])).items()},
+                    'shape': tuple(int(v) for v in data['shape']),
+                    'xyxy': data['xyxy'],
+                    'conf': data['conf'],
+                    'cls': data['cls'],
+                }
+                if 'poly_len' in data.files:
+                    lengths = data['poly_len']
+                    pts = data['poly_pts']
+                    raw['polys'] = np.split(pts, np.cumsum(lengths)[:-1]) if len(lengths) else []
+            return raw
+        except Exception as e:
+            logger.warning(f"Поврежден кэш детекции {path}: {e}")
+            return None
+
+    def save(self, name, kind, sig, model_hash, raw):
+        """Атомарная запись результата страницы"""
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            arrays = {
+                'sig': np.array(sig),
+                'model': np.array(model_hash),
+                'names': np.array(json.dumps(raw['names'], ensure_ascii=False)),
+                'shape': np.array(raw['shape'], dtype=np.int32),
+                'xyxy': raw['xyxy'],
+                'conf': raw['conf'],
+                'cls': raw['cls'],
+            }
+            if 'polys' in raw:
+                polys = raw['polys']
+                arrays['poly_len'] = np.array([len(p) for p in polys], dtype=np.int32)
+                arrays['poly_pts'] = (np.concatenate(polys).astype(np.float32) if polys
+                                      else np.zeros((0, 2), dtype=np.float32))
+            path = self._file(name, kind)
+            tmp = f"{path}.tmp"
+            with open(tmp, "wb") as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(tmp, path)
+        except Exception as e:
+            logger.error(f"Ошибка записи кэша детекции {name}: {e}")
+
+    def is_applied(self, name, kind):
+        return kind in self.applied.get(name, [])
+
+    def set_applied(self, name, kind, applied=True):
+        """Отмечает, что результат типа kind показан (или убран) на странице"""
+        kinds = set(self.applied.get(name, []))
+        if (kind in kinds) == applied:
+            return
+        if applied:
+            kinds.add(kind)
+        else:
+            kinds.discard(kind)
+        self.applied[name] = sorted(kinds)
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            tmp = f"{self.applied_path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.applied, f, ensure_ascii=False, indent=4)
+            os.replace(tmp, self.applied_path)
+        except Exception as e:
+            logger.error(f"Ошибка записи {self.applied_path}: {e}")
+
+
+class CancelToken:
+    """Признак отмены задания (проверяется воркером между пакетами)"""
+    __slots__ = ("cancelled",)
+
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class DetectionJob:
+    """
+    Задание воркера: модели ({'detect'|'segm': загрузчик}), число страниц
+    и очередь их источников. Каждая страница конвертируется один раз
+    и проходит через все модели задания. Загрузчик возвращает модель
+    или бросает исключение с причиной.
+    """
+
+    def __init__(self, job_id, model_getters, total, batch_size=DEF_BATCH, conf=DEF_CONF, slice_tall=True,
+                 page_ids=()):
+        self.job_id = job_id
+        self.slice_tall = slice_tall
+        self.model_getters = model_getters
+        self.kinds = tuple(model_getters)
+        self.total = total
+        self.page_ids = tuple(page_ids)  # индексы страниц (для ошибок до подачи страниц)
+        self.batch_size = max(1, batch_size)
+        self.conf = conf
+        self.token = CancelToken()
+        self.pages = queue.Queue()
+
+    def add_pages(self, items):
+        """Добавляет страницы: [(page_idx, QImage | путь | массив BGR)]"""
+        for item in items:
+            self.pages.put(item)
+
+    def cancel(self):
+        self.token.cancel()
+        self.pages.put(None)
+
+
+class DetectionWorker(QThread):
+    """
+    Постоянный поток инференса YOLO с очередью заданий.
+    Страницы каждого задания подаются из GUI порциями по запросу need_pages
+    (в памяти не больше двух пакетов), результаты отдаются по страницам
+    в виде {тип модели: компактный результат}.
+    """
+    need_pages = Signal(int, int)  # job_id, сколько страниц подать
+    page_done = Signal(int, int, object)  # job_id, page_idx, {тип: результат}
+    page_failed = Signal(int, int, str)  # job_id, page_idx, сообщение
+    job_finished = Signal(int, bool)  # job_id, отменено ли
+
+    def __init__(self, device=None, concurrent=True):
+        super().__init__()
+        self.device = device  # None - определяется в потоке (импорт torch не блокирует GUI)
+        self.concurrent = concurrent
+        self.jobs = queue.Queue()
+        self.stopping = False
+        self._pool = None
+
+    def submit(self, job):
+        self.jobs.put(job)
+
+    def stop(self):
+        """Останавливает поток после текущего пакета"""
+        self.stopping = True
+        self.jobs.put(None)
+
+    def _take_batch(self, job, remaining):
+        """Забирает до batch_size страниц, дожидаясь хотя бы одной"""
+        batch = []
+        need = min(job.batch_size, remaining)
+        while len(batch) < need and not job.token.cancelled and not self.stopping:
+            try:
+                item = job.pages.get(timeout=0.1 if batch else 1.0)
+            except queue.Empty:
+                if batch:
+                    break
+                continue
+            if item is None:
+                break
+            batch.append(item)
+        return batch
+
+    def _predict(self, model, imgs, conf, kind='detect'):
+        timer = get_stage_timer()
+        raws = []
+        for i in range(0, len(imgs), MAX_PREDICT_IMGS):
+            chunk = imgs[i:i + MAX_PREDICT_IMGS]
+            with timer.measure(f"{kind}.inference", len(chunk)):
+                results = model.predict(chunk, conf=conf, device=self.device,
+                                        batch=len(chunk), half=self.device == 'cuda', verbose=False)
+            with timer.measure(f"{kind}.extract", len(chunk)):
+                raws.extend(extract_raw(r) for r in results)
+        return raws
+
+    def _predict_all(self, models, imgs, conf):
+        """Прогон пакета через все модели (при нескольких моделях - параллельно)"""
+        if len(models) > 1 and self.concurrent:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="yolo")
+            futures = {kind: self._pool.submit(self._predict, model, imgs, conf, kind)
+                       for kind, model in models.items()}
+            return {kind: future.result() for kind, future in futures.items()}
+        return {kind: self._predict(model, imgs, conf, kind) for kind, model in models.items()}
+
+    def _run_job(self, job):
+        models = {}
+        for kind, getter in job.model_getters.items():
+            try:
+                model = getter()
+                if model is None:
+                    raise RuntimeError(f"Модель {kind} не загружена")
+            except Exception as e:
+                # Без модели все страницы задания считаются необработанными
+                logger.error(f"Модель {kind} недоступна: {str(e)}")
+                for page_idx in job.page_ids:
+                    self.page_failed.emit(job.job_id, page_idx, str(e))
+                return
+            models[kind] = model
+
+        remaining = job.total
+        # Подаем сразу два пакета, чтобы подготовка шла параллельно инференсу
+        self.need_pages.emit(job.job_id, job.batch_size * 2)
+
+        while remaining > 0 and not job.token.cancelled and not self.stopping:
+            batch = self._take_batch(job, remaining)
+            if not batch:
+                continue
+            remaining -= len(batch)
+            if remaining > 0:
+                self.need_pages.emit(job.job_id, len(batch))
+
+            idxs, imgs, tiles = [], [], []  # tiles: (позиция страницы в idxs, y0)
+            for page_idx, source in batch:
+                try:
+                    with get_stage_timer().measure("detect.convert"):
+                        img = to_bgr(source)
+                except Exception as e:
+                    img = None
+                    logger.error(f"Ошибка подготовки страницы {page_idx}: {e}")
+                if img is None:
+                    self.page_failed.emit(job.job_id, page_idx, "Не удалось загрузить изображение")
+                    continue
+                # Высокие страницы режутся на окна в исходном разрешении
+                h, w = img.shape[:2]
+                windows = slice_windows(h, w) if job.slice_tall else [(0, h)]
+                for y0, y1 in windows:
+                    tiles.append((len(idxs), y0, (h, w)))
+                    imgs.append(img if len(windows) == 1 else np.ascontiguousarray(img[y0:y1]))
+                idxs.append(page_idx)
+
+            if not imgs or job.token.cancelled:
+                continue
+
+            try:
+                outputs = self._predict_all(models, imgs, job.conf)
+            except Exception as e:
+                logger.error(f"Ошибка пакетного инференса: {str(e)}")
+                for page_idx in idxs:
+                    self.page_failed.emit(job.job_id, page_idx, str(e))
+                continue
+
+            # Сборка результатов страниц из окон (кэш CUDA не сбрасывается постранично)
+            per_page = [{kind: [] for kind in outputs} for _ in idxs]
+            shapes = [None] * len(idxs)
+            for t, (pos, y0, shape) in enumerate(tiles):
+                shapes[pos] = shape
+                for kind, raws in outputs.items():
+                    per_page[pos][kind].append((y0, raws[t]))
+
+            for pos, page_idx in enumerate(idxs):
+                page_out = {}
+                for kind, parts in per_page[pos].items():
+                    if len(parts) == 1:
+                        page_out[kind] = parts[0][1]
+                    else:
+                        with get_stage_timer().measure("detect.merge"):
+                            page_out[kind] = merge_slices(parts, shapes[pos])
+                self.page_done.emit(job.job_id, page_idx, page_out)
+
+    def run(self):
+        if self.device is None:
+            self.device = get_device()
+        while not self.stopping:
+            job = self.jobs.get()
+            if job is None:
+                break
+            try:
+                if not job.token.cancelled:
+                    self._run_job(job)
+            except Exception as e:
+                logger.error(f"Ошибка задания {job.kinds}: {str(e)}")
+                import traceback
+                logger.error(traceback.format_exc())
+            finally:
+                if self.device == 'cuda' and self.jobs.empty():
+                    import torch
+                    torch.cuda.empty_cache()
+                self.job_finished.emit(job.job_id, job.token.cancelled)
+
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
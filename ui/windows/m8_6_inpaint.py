@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+# ui/windows/m8_6_inpaint.py
+import queue
+import logging
+from collections import deque
+import cv2
+import numpy as np
+from PySide6.QtCore import QThread, Signal
+from PySide6.QtGui import QImage
+from ui.components.stage_timer import get_stage_timer, timed
+
+logger = logging.getLogger(__name__)
+
+# Сколько страниц одинакового размера LaMa обрабатывает за один проход
+LAMA_BATCH = 2
+# LaMa требует размеры, кратные 8
+LAMA_MOD = 8
+# Очистка по областям: контекст вокруг связной области (px и доля ее размера)
+REGION_PAD = 48
+REGION_PAD_REL = 0.5
+# Если области занимают больше этой доли страницы, страница идет в LaMa целиком
+REGION_FULL_RATIO = 0.5
+# Ограничение большей стороны кропа перед LaMa (None - исходное разрешение)
+REGION_MAX_SIDE = None
+# Быстрая заливка однородного фона: ширина кольца вокруг области (px)
+FILL_RING = 6
+# Макс. СКО цвета кольца для заливки медианой и для cv2.inpaint (Telea)
+FLAT_STD = 4.0
+SMOOTH_STD = 10.0
+
+
+def qimage_to_rgb(qimg):
+    """QImage -> непрерывный массив RGB (h, w, 3) uint8 (копия)"""
+    if qimg.format() != QImage.Format_RGB888:
+        qimg = qimg.convertToFormat(QImage.Format_RGB888)
+    w, h, bpl = qimg.width(), qimg.height(), qimg.bytesPerLine()
+    buf = np.frombuffer(qimg.constBits(), dtype=np.uint8, count=bpl * h).reshape(h, bpl)
+    return buf[:, :w * 3].reshape(h, w, 3).copy()
+
+
+def rgb_to_qimage(arr):
+    """
+    QImage поверх буфера массива RGB без копирования.
+    Массив должен жить, пока используется QImage (например, до QPixmap.fromImage).
+    """
+    arr = np.ascontiguousarray(arr)
+    h, w = arr.shape[:2]
+    return QImage(arr.data, w, h, w * 3, QImage.Format_RGB888)
+
+
+def mask_regions(mask, pad=REGION_PAD, pad_rel=REGION_PAD_REL):
+    """
+    Прямоугольники (x0, y0, x1, y1) вокруг связных областей маски с контекстом.
+    Пересекающиеся прямоугольники объединяются, чтобы близкие пузыри
+    обрабатывались одним кропом.
+    """
+    h, w = mask.shape[:2]
+    n, _, stats, _ = cv2.connectedComponentsWithStats((mask > 0).astype(np.uint8), connectivity=8)
+    rects = []
+    for i in range(1, n):
+        x, y, bw, bh = (int(v) for v in stats[i, :4])
+        p = int(pad + pad_rel * max(bw, bh))
+        rects.append([max(0, x - p), max(0, y - p), min(w, x + bw + p), min(h, y + bh + p)])
+
+    merged = True
+    while merged:
+        merged = False
+        out = []
+        for r in rects:
+            for o in out:
+                if r[0] < o[2] and o[0] < r[2] and r[1] < o[3] and o[1] < r[3]:
+                    o[0], o[1] = min(o[0], r[0]), min(o[1], r[1])
+                    o[2], o[3] = max(o[2], r[2]), max(o[3], r[3])
+                    merged = True
+                    break
+            else:
+                out.append(r)
+        rects = out
+    return [tuple(r) for r in rects]
+
+
+def fast_fill(rgb, mask, ring=FILL_RING):
+    """
+    Заливка областей маски на однородном фоне без LaMa.
+    Для каждой связной области оценивается разброс цвета кольца вокруг нее:
+    плоский фон заливается медианой, плавный - cv2.inpaint (Telea).
+    Возвращает (rgb, оставшаяся маска для LaMa, число залитых областей).
+    """
+    h, w = mask.shape[:2]
+    binary = (mask > 0).astype(np.uint8)
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    if n <= 1:
+        return rgb, mask, 0
+
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * ring + 1, 2 * ring + 1))
+    out, rest = None, None
+    filled = 0
+    for i in range(1, n):
+        x, y, bw, bh = (int(v) for v in stats[i, :4])
+        x0, y0 = max(0, x - ring), max(0, y - ring)
+        x1, y1 = min(w, x + bw + ring), min(h, y + bh + ring)
+
+        comp = (labels[y0:y1, x0:x1] == i).astype(np.uint8)
+        # Кольцо - соседние пиксели вне любой области маски
+        border = (cv2.dilate(comp, kernel) > 0) & (binary[y0:y1, x0:x1] == 0)
+        colors = rgb[y0:y1, x0:x1][border]
+        if len(colors) < ring * 4:
+            continue
+
+        std = float(colors.std(axis=0).max())
+        if std > SMOOTH_STD:
+            continue
+
+        if out is None:
+            out, rest = rgb.copy(), mask.copy()
+        sel = comp > 0
+        if std <= FLAT_STD:
+            out[y0:y1, x0:x1][sel] = np.median(colors, axis=0).astype(np.uint8)
+        else:
+            crop = np.ascontiguousarray(out[y0:y1, x0:x1])
+            res = cv2.inpaint(crop, comp * 255, 3, cv2.INPAINT_TELEA)
+            out[y0:y1, x0:x1][sel] = res[sel]
+        rest[y0:y1, x0:x1][sel] = 0
+        filled += 1
+
+    if out is None:
+        return rgb, mask, 0
+    return out, rest, filled
+
+
+class InpaintJob:
+    """Страница для очистки: RGB-массив и маска (0/255) одного размера"""
+    __slots__ = ("page_idx", "rgb", "mask")
+
+    def __init__(self, page_idx, rgb, mask):
+        self.page_idx = page_idx
+        self.rgb = rgb
+        self.mask = mask
+
+
+class LamaInpainter:
+    """
+    Очистка страниц LaMa без привязки к потокам и Qt: быстрая заливка
+    однородного фона, затем LaMa по областям маски или по странице целиком.
+    Используется воркером окна и консольным движком очистки.
+    Вместо готовой модели можно передать loader(): он вызывается при первом
+    прогоне LaMa (страницы, залитые без LaMa, модель не ждут).
+    """
+
+    def __init__(self, lama=None, region_mode=True, max_side=REGION_MAX_SIDE, flat_fill=True, loader=None):
+        self.lama = lama
+        self.loader = loader
+        self.region_mode = region_mode
+        self.max_side = max_side
+        self.flat_fill = flat_fill
+
+    def get_lama(self):
+        if self.lama is None and self.loader is not None:
+            self.lama = self.loader()
+        if self.lama is None:
+            raise RuntimeError("Модель LaMa не загружена")
+        return self.lama
+
+    def run_model(self, rgbs, masks):
+        """Пакетный прогон LaMa на тензорах; без доступа к модели - по одному через SimpleLama"""
+        lama = self.get_lama()
+        model = getattr(lama, 'model', None)
+        device = getattr(lama, 'device', None)
+        timer = get_stage_timer()
+        if model is None or device is None:
+            with timer.measure("clean.lama", len(rgbs)):
+                return [np.asarray(lama(rgb, mask))[:rgb.shape[0], :rgb.shape[1]] for rgb, mask in zip(rgbs, masks)]
+
+        import torch
+        import torch.nn.functional as F
+
+        h, w = rgbs[0].shape[:2]
+        img = torch.from_numpy(np.stack(rgbs)).permute(0, 3, 1, 2).float().div_(255.0)
+        msk = torch.from_numpy((np.stack(masks) > 0).astype(np.float32))[:, None]
+
+        # Дополнение до кратности 8 (результат обрезается обратно)
+        pad_h, pad_w = (-h) % LAMA_MOD, (-w) % LAMA_MOD
+        if pad_h or pad_w:
+            img = F.pad(img, (0, pad_w, 0, pad_h), mode='replicate')
+            msk = F.pad(msk, (0, pad_w, 0, pad_h), mode='replicate')
+
+        # Замер до .cpu(): копирование с GPU дожидается конца инференса
+        with timer.measure("clean.lama", len(rgbs)), torch.inference_mode():
+            out = model(img.to(device), msk.to(device))
+            out = out[:, :, :h, :w].clamp(0, 1).mul(255).round().to(torch.uint8)
+            return list(out.permute(0, 2, 3, 1).cpu().numpy())
+
+    def inpaint_regions(self, job, rects):
+        """Кропы вокруг областей маски; обратно вклеиваются только пиксели маски"""
+        out = job.rgb.copy()
+        for x0, y0, x1, y1 in rects:
+            crop = job.rgb[y0:y1, x0:x1]
+            crop_mask = job.mask[y0:y1, x0:x1]
+            ch, cw = crop.shape[:2]
+
+            scale = 1.0
+            if self.max_side and max(ch, cw) > self.max_side:
+                scale = self.max_side / max(ch, cw)
+                size = (max(1, round(cw * scale)), max(1, round(ch * scale)))
+                crop = cv2.resize(crop, size, interpolation=cv2.INTER_AREA)
+                crop_mask = cv2.resize(crop_mask, size, interpolation=cv2.INTER_NEAREST)
+
+            res = self.run_model([np.ascontiguousarray(crop)], [np.ascontiguousarray(crop_mask)])[0]
+            if scale != 1.0:
+                res = cv2.resize(res, (cw, ch), interpolation=cv2.INTER_CUBIC)
+
+            sel = job.mask[y0:y1, x0:x1] > 0
+            out[y0:y1, x0:x1][sel] = res[sel]
+        return out
+
+    @timed("clean.fill")
+    def prefill(self, job):
+        """Заливает области на однородном фоне; True, если для LaMa ничего не осталось"""
+        if not self.flat_fill:
+            return False
+        job.rgb, job.mask, filled = fast_fill(job.rgb, job.mask)
+        if filled:
+            logger.debug(f"Страница {job.page_idx}: залито без LaMa областей: {filled}")
+        return filled > 0 and not job.mask.any()
+
+    def plan(self, job):
+        """Прямоугольники для очистки по областям или None, если выгоднее страница целиком"""
+        if not self.region_mode:
+            return None
+        rects = mask_regions(job.mask)
+        page_area = job.mask.shape[0] * job.mask.shape[1]
+        if not rects or sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in rects) > REGION_FULL_RATIO * page_area:
+            return None
+        return rects
+
+    def inpaint_full(self, batch):
+        """Страницы целиком одним пакетом (при ошибке пакета - по одной)"""
+        try:
+            results = self.run_model([job.rgb for job in batch], [job.mask for job in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                raise
+            # Например, нехватка памяти GPU на пакете - повтор по одной странице
+            logger.warning(f"Пакетный инпейнтинг не удался ({e}), обработка по одной странице")
+            results = [self.run_model([job.rgb], [job.mask])[0] for job in batch]
+
+        outs = []
+        for job, res in zip(batch, results):
+            # Вне маски остаются исходные пиксели (LaMa слегка меняет всю страницу)
+            out = job.rgb.copy()
+            sel = job.mask > 0
+            out[sel] = res[sel]
+            outs.append(out)
+        return outs
+
+    def inpaint(self, rgb, mask):
+        """Синхронная очистка одной страницы, результат RGB (h, w, 3) uint8"""
+        job = InpaintJob(-1, rgb, mask)
+        if self.prefill(job):
+            return job.rgb
+        rects = self.plan(job)
+        if rects is not None:
+            return self.inpaint_regions(job, rects)
+        return self.inpaint_full([job])[0]
+
+
+class InpaintWorker(QThread):
+    """
+    Постоянный поток инпейнтинга LaMa с очередью страниц.
+    Получает массивы напрямую (без PNG-кодирования), страницы одинакового
+    размера объединяет в пакет, результат отдает массивом RGB.
+    """
+    page_done = Signal(int, object)  # page_idx, результат RGB (h, w, 3) uint8
+    page_failed = Signal(int, str)
+    page_started = Signal(int, str)  # page_idx, сообщение
+
+    def __init__(self, lama=None, batch_size=LAMA_BATCH, region_mode=True, max_side=REGION_MAX_SIDE, flat_fill=True,
+                 loader=None):
+        super().__init__()
+        self.engine = LamaInpainter(lama, region_mode, max_side, flat_fill, loader)
+        self.batch_size = max(1, batch_size)
+        self.jobs = queue.Queue()
+        self.held = deque()  # задания другого размера, отложенные при сборке пакета
+        self.emitted = set()  # id заданий текущего пакета, по которым уже отправлен результат
+        self.stopping = False
+
+    @property
+    def lama(self):
+        return self.engine.lama
+
+    def submit(self, job):
+        self.jobs.put(job)
+
+    def stop(self):
+        self.stopping = True
+        self.jobs.put(None)
+
+    def _next_job(self, block):
+        if self.held:
+            return self.held.popleft()
+        try:
+            return self.jobs.get(block=block)
+        except queue.Empty:
+            return None
+
+    def _take_batch(self):
+        """Первое задание (с ожиданием) и уже готовые задания того же размера"""
+        first = self._next_job(block=True)
+        if first is None:
+            return []
+        batch = [first]
+        skipped = []
+        while len(batch) < self.batch_size:
+            job = self._next_job(block=False)
+            if job is None:
+                break
+            if job.rgb.shape == first.rgb.shape:
+                batch.append(job)
+            else:
+                skipped.append(job)
+        self.held.extendleft(reversed(skipped))
+        return batch
+
+    def _lama_note(self, msg):
+        return msg if self.engine.lama is not None else "Ожидание загрузки LaMa..."
+
+    def _done(self, job, out):
+        self.emitted.add(id(job))
+        self.page_done.emit(job.page_idx, out)
+
+    def _failed(self, job, e):
+        self.emitted.add(id(job))
+        self.page_failed.emit(job.page_idx, str(e))
+
+    def _process(self, batch):
+        """Каждое задание пакета получает ровно один сигнал: page_done или page_failed"""
+        full = []
+        for job in batch:
+            try:
+                if self.engine.prefill(job):
+                    self._done(job, job.rgb)
+                    continue
+
+                rects = self.engine.plan(job)
+                if rects is None:
+                    full.append(job)
+                    continue
+
+                self.page_started.emit(job.page_idx, self._lama_note(f"LaMa по областям: {len(rects)}"))
+                self._done(job, self.engine.inpaint_regions(job, rects))
+            except Exception as e:
+                logger.error(f"Ошибка очистки страницы {job.page_idx}: {str(e)}")
+                self._failed(job, e)
+
+        if full:
+            for job in full:
+                self.page_started.emit(job.page_idx, self._lama_note("LaMa инпейнтинг..."))
+            try:
+                outs = self.engine.inpaint_full(full)
+            except Exception as e:
+                logger.error(f"Ошибка инпейнтинга страниц {[job.page_idx for job in full]}: {str(e)}")
+                for job in full:
+                    self._failed(job, e)
+                return
+            for job, out in zip(full, outs):
+                self._done(job, out)
+
+    def run(self):
+        while not self.stopping:
+            batch = self._take_batch()
+            if not batch:
+                continue
+            self.emitted.clear()
+            try:
+                self._process(batch)
+            except Exception as e:
+                logger.error(f"Ошибка очистки изображения: {str(e)}")
+                import traceback
+                logger.error(traceback.format_exc())
+                # Сигнал об ошибке только для заданий, еще не получивших результат
+                for job in batch:
+                    if id(job) not in self.emitted:
+                        self._failed(job, e)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# ui/windows/m8_7_history.py
+import os
+import zlib
+import shutil
+import logging
+import tempfile
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Лимит сжатых патчей в памяти; более старые выгружаются на диск
+HISTORY_MEM_LIMIT = 256 * 1024 * 1024
+# Быстрый уровень zlib: страницы манги с однотонными областями сжимаются хорошо
+HISTORY_ZLIB_LEVEL = 1
+
+
+class HistoryPatch:
+    """Изменение прямоугольника страницы: пиксели до и после, сжатые вместе"""
+    __slots__ = ("rect", "shape", "dtype", "data", "path", "size")
+
+    def __init__(self, rect, before, after):
+        self.rect = rect  # (x0, y0, x1, y1)
+        self.shape = before.shape
+        self.dtype = before.dtype.str
+        self.data = zlib.compress(np.stack([before, after]).tobytes(), HISTORY_ZLIB_LEVEL)
+        self.path = None
+        self.size = len(self.data)
+
+    def arrays(self):
+        """Массивы (до, после), доступные для записи"""
+        if self.data is not None:
+            raw = self.data
+        else:
+            with open(self.path, 'rb') as f:
+                raw = f.read()
+        buf = np.frombuffer(bytearray(zlib.decompress(raw)), dtype=np.dtype(self.dtype))
+        pair = buf.reshape((2,) + tuple(self.shape))
+        return pair[0], pair[1]
+
+    def spill(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.data)
+        self.path = path
+        self.data = None
+
+    def drop(self):
+        self.data = None
+        if self.path and os.path.exists(self.path):
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        self.path = None
+
+
+class PageHistory:
+    """
+    Неограниченная история undo/redo страниц в виде дельт: хранится только
+    измененный прямоугольник (до и после). Сверх лимита памяти самые старые
+    патчи выгружаются во временную папку.
+    """
+
+    def __init__(self, mem_limit=HISTORY_MEM_LIMIT, spill_dir=None):
+        self.mem_limit = mem_limit
+        self.mem_used = 0
+        self.spill_dir = spill_dir
+        self.own_dir = None  # временная папка, созданная самой историей
+        self.undo_stacks = {}  # page_idx -> [HistoryPatch]
+        self.redo_stacks = {}
+        self.resident = OrderedDict()  # id патча -> патч в памяти, в порядке добавления
+        self.seq = 0
+
+    def push(self, page_idx, rect, before, after):
+        """Записывает операцию; ветка redo страницы при этом отбрасывается"""
+        patch = HistoryPatch(rect, before, after)
+        self.undo_stacks.setdefault(page_idx, []).append(patch)
+        for old in self.redo_stacks.pop(page_idx, []):
+            self._forget(old)
+
+        self.mem_used += patch.size
+        self.resident[id(patch)] = patch
+        self._enforce_limit()
+        logger.debug(f"История страницы {page_idx}: патч {rect}, {patch.size} байт")
+
+    def can_undo(self, page_idx):
+        return bool(self.undo_stacks.get(page_idx))
+
+    def can_redo(self, page_idx):
+        return bool(self.redo_stacks.get(page_idx))
+
+    def undo(self, page_idx):
+        """(rect, пиксели до) последней операции или None"""
+        stack = self.undo_stacks.get(page_idx)
+        if not stack:
+            return None
+        patch = stack.pop()
+        self.redo_stacks.setdefault(page_idx, []).append(patch)
+        return patch.rect, patch.arrays()[0]
+
+    def redo(self, page_idx):
+        """(rect, пиксели после) отмененной операции или None"""
+        stack = self.redo_stacks.get(page_idx)
+        if not stack:
+            return None
+        patch = stack.pop()
+        self.undo_stacks.setdefault(page_idx, []).append(patch)
+        return patch.rect, patch.arrays()[1]
+
+    def clear(self, page_idx=None):
+        """Очищает историю страницы (или всех страниц)"""
+        pages = list(set(self.undo_stacks) | set(self.redo_stacks)) if page_idx is None else [page_idx]
+        for idx in pages:
+            for patch in self.undo_stacks.pop(idx, []) + self.redo_stacks.pop(idx, []):
+                self._forget(patch)
+
+    def close(self):
+        """Очищает историю и удаляет временную папку"""
+        self.clear()
+        self.resident.clear()
+        if self.own_dir:
+            shutil.rmtree(self.own_dir, ignore_errors=True)
+            self.own_dir = None
+
+    def _forget(self, patch):
+        """Удаляет патч из истории: сжатые данные освобождаются сразу, а не при вытеснении"""
+        self.resident.pop(id(patch), None)
+        if patch.data is not None:
+            self.mem_used -= patch.size
+        patch.drop()
+
+    def _folder(self):
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            return self.spill_dir
+        if self.own_dir is None:
+            self.own_dir = tempfile.mkdtemp(prefix="mio_history_")
+        return self.own_dir
+
+    def _enforce_limit(self):
+        while self.mem_used > self.mem_limit and self.resident:
+            key, patch = self.resident.popitem(last=False)
+            if patch.data is None:
+                continue  # уже выгружен
+            self.seq += 1
+            try:
+                patch.spill(os.path.join(self._folder(), f"{self.seq:08d}.patch"))
+                self.mem_used -= patch.size
+            except OSError as e:
+                logger.error(f"Не удалось выгрузить историю на диск: {e}")
+                self.resident[key] = patch
+                self.resident.move_to_end(key, last=False)
+                break
@@ -0,0 +1,557 @@
+# -*- coding: utf-8 -*-
+# ui/windows/m8_8_clean_engine.py
+"""
+Очистка глав без интерфейса: детекция -> маска -> инпейнтинг -> сохранение.
+Использует те же модели, кэш результатов, пороги классов и расширение масок,
+что и окно клининга, и пишет результат в папку "Клининг" главы.
+
+Запуск: python -m ui.windows.m8_8_clean_engine <папка главы> [...]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import cv2
+import numpy as np
+
+from ui.windows.m8_3_utils import DetectionManager, get_device
+from ui.windows.m8_4_mask_engine import offset_polygon, simplify_polygon, box_rect, rect_span
+from ui.windows.m8_5_detection import (DetectionStore, extract_raw, slice_windows, merge_slices, load_bgr,
+                                       file_hash, image_signature, DEF_CONF, MAX_PREDICT_IMGS)
+from ui.windows.m8_6_inpaint import LamaInpainter
+from ui.windows.m8_9_save import write_json_atomic
+from ui.components.stage_timer import get_stage_timer, timed
+
+logger = logging.getLogger(__name__)
+
+IMG_EXTS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff')
+SETTINGS_JSON = "clean_settings.json"
+SOURCE_CONFIG_JSON = "image_source_config.json"
+SAVED_IMAGES_JSON = "saved_images.json"
+# Страницы, очищенные движком или сохраненные в окне: {имя: сигнатура файла}
+DONE_PAGES_JSON = "cleaned_pages.json"
+MASK_EXP_DEF = 10
+
+# Классы детекции и сегментации по умолчанию
+DETECT_CLASSES = {
+    'Text': {'threshold': 0.5, 'enabled': True, 'color': (255, 0, 0)},
+    'Sound': {'threshold': 0.5, 'enabled': False, 'color': (0, 255, 0)},
+    'FonText': {'threshold': 0.5, 'enabled': False, 'color': (0, 0, 255)},
+    'ComplexText': {'threshold': 0.5, 'enabled': False, 'color': (255, 128, 0)},
+}
+
+SEGM_CLASSES = {
+    'TextSegm': {'threshold': 0.5, 'enabled': True, 'color': (255, 255, 0)},
+    'Sound': {'threshold': 0.5, 'enabled': False, 'color': (255, 0, 255)},
+    'FonText': {'threshold': 0.5, 'enabled': False, 'color': (0, 255, 255)},
+    'Text': {'threshold': 0.5, 'enabled': True, 'color': (0, 128, 255)},
+}
+
+
+def default_classes():
+    """Копии словарей классов по умолчанию (detect, segm)"""
+    return ({k: dict(v) for k, v in DETECT_CLASSES.items()},
+            {k: dict(v) for k, v in SEGM_CLASSES.items()})
+
+
+def chapter_paths(chapter_folder):
+    """Рабочие папки главы"""
+    return {
+        "cleaning_folder": os.path.join(chapter_folder, "Клининг"),
+        "enhanced_folder": os.path.join(chapter_folder, "Предобработка"),
+        "originals_folder": os.path.join(chapter_folder, "Загрузка", "originals"),
+        "upload_folder": os.path.join(chapter_folder, "Загрузка")
+    }
+
+
+def get_imgs_from_folder(folder):
+    """Получение списка изображений из папки"""
+    if not os.path.isdir(folder):
+        return []
+    return [os.path.join(folder, f) for f in sorted(os.listdir(folder)) if f.lower().endswith(IMG_EXTS)]
+
+
+def image_sources(paths):
+    """Доступные источники изображений главы: {ключ: {path, images, name, count}}"""
+    sources = {}
+
+    save_folder = os.path.join(paths["enhanced_folder"], "Save")
+    save_images = get_imgs_from_folder(save_folder)
+    if save_images:
+        sources["preprocess_save"] = {
+            "path": save_folder,
+            "images": save_images,
+            "name": "Предобработка (Save)",
+            "count": len(save_images)
+        }
+
+    upload_images = get_imgs_from_folder(paths["upload_folder"])
+    if upload_images:
+        sources["upload"] = {
+            "path": paths["upload_folder"],
+            "images": upload_images,
+            "name": "Загрузка",
+            "count": len(upload_images)
+        }
+    return sources
+
+
+def copy_images(source_images, dst_folder):
+    """Копирует изображения в папку с сохранением имен (при совпадении добавляется номер)"""
+    os.makedirs(dst_folder, exist_ok=True)
+    for src_path in source_images:
+        try:
+            filename = os.path.basename(src_path)
+            dst_path = os.path.join(dst_folder, filename)
+            if os.path.exists(dst_path):
+                base, ext = os.path.splitext(filename)
+                counter = 1
+                while os.path.exists(dst_path):
+                    dst_path = os.path.join(dst_folder, f"{base}_{counter}{ext}")
+                    counter += 1
+            shutil.copy2(src_path, dst_path)
+            logger.info(f"Скопирован файл: {filename}")
+        except Exception as e:
+            logger.error(f"Ошибка копирования {src_path}: {str(e)}")
+
+
+def resolve_images(paths, source=None):
+    """
+    Изображения главы в папке клининга (как в окне, но без диалога):
+    уже скопированные, иначе источник source, сохраненный выбор или первый доступный.
+    """
+    cleaning_folder = paths["cleaning_folder"]
+    existing = get_imgs_from_folder(cleaning_folder)
+    if existing:
+        return existing
+
+    sources = image_sources(paths)
+    if not sources:
+        return []
+
+    config_path = os.path.join(cleaning_folder, SOURCE_CONFIG_JSON)
+    if source not in sources and os.path.exists(config_path):
+        try:
+            with open(config_path, 'r', encoding='utf-8') as f:
+                source = json.load(f).get("source")
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать {config_path}: {e}")
+    if source not in sources:
+        source = next(iter(sources))
+
+    os.makedirs(cleaning_folder, exist_ok=True)
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump({"source": source}, f, ensure_ascii=False, indent=4)
+
+    logger.info(f"Источник изображений: {sources[source]['name']} ({sources[source]['count']})")
+    copy_images(sources[source]["images"], cleaning_folder)
+    return get_imgs_from_folder(cleaning_folder)
+
+
+def load_clean_settings(cleaning_folder):
+    """Сохраненные настройки очистки главы (пороги, классы, расширение) или {}"""
+    path = os.path.join(cleaning_folder, SETTINGS_JSON)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать {path}: {e}")
+        return {}
+
+
+def load_done_pages(cleaning_folder):
+    """{имя файла: сигнатура} страниц, уже очищенных или сохраненных вручную"""
+    path = os.path.join(cleaning_folder, DONE_PAGES_JSON)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get("pages", {})
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать {path}: {e}")
+        return {}
+
+
+def record_done_pages(cleaning_folder, paths):
+    """Отмечает страницы очищенными: сигнатура фиксируется после записи файла"""
+    if not paths:
+        return
+    pages = load_done_pages(cleaning_folder)
+    for path in paths:
+        sig = image_signature(path)
+        if sig:
+            pages[os.path.basename(path)] = sig
+    try:
+        os.makedirs(cleaning_folder, exist_ok=True)
+        write_json_atomic(os.path.join(cleaning_folder, DONE_PAGES_JSON), {"pages": pages})
+    except Exception as e:
+        logger.error(f"Ошибка записи {DONE_PAGES_JSON}: {e}")
+
+
+def is_page_done(done_pages, path):
+    """Страница отмечена и с тех пор не менялась"""
+    sig = done_pages.get(os.path.basename(path))
+    return sig is not None and sig == image_signature(path)
+
+
+def chapter_completed(chapter_folder):
+    """Клининг главы отмечен завершенным в chapter.json"""
+    path = os.path.join(chapter_folder, "chapter.json")
+    if not os.path.exists(path):
+        return False
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get("stages", {}).get("Клининг") is True
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать {path}: {e}")
+        return False
+
+
+def save_clean_settings(cleaning_folder, detect_classes, segm_classes, detect_exp, segm_exp):
+    """Атомарная запись настроек очистки главы"""
+    data = {
+        "detect": {k: {'threshold': v.get('threshold', 0.5), 'enabled': bool(v.get('enabled', False))}
+                   for k, v in detect_classes.items()},
+        "segm": {k: {'threshold': v.get('threshold', 0.5), 'enabled': bool(v.get('enabled', False))}
+                 for k, v in segm_classes.items()},
+        "detect_expansion": int(detect_exp),
+        "segm_expansion": int(segm_exp),
+    }
+    path = os.path.join(cleaning_folder, SETTINGS_JSON)
+    try:
+        os.makedirs(cleaning_folder, exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        os.replace(tmp, path)
+    except Exception as e:
+        logger.error(f"Ошибка записи {path}: {e}")
+
+
+def apply_clean_settings(settings, detect_classes, segm_classes):
+    """
+    Переносит сохраненные пороги и включенность в словари классов (на месте).
+    Возвращает (расширение детекции, расширение сегментации).
+    """
+    for key, classes in (("detect", detect_classes), ("segm", segm_classes)):
+        for cls_name, saved in settings.get(key, {}).items():
+            if cls_name in classes:
+                if 'threshold' in saved:
+                    classes[cls_name]['threshold'] = float(saved['threshold'])
+                if 'enabled' in saved:
+                    classes[cls_name]['enabled'] = bool(saved['enabled'])
+    return (int(settings.get("detect_expansion", MASK_EXP_DEF)),
+            int(settings.get("segm_expansion", MASK_EXP_DEF)))
+
+
+def _passes(classes, cls_name, conf):
+    info = classes.get(cls_name)
+    return info is not None and info.get('enabled', False) and conf >= info.get('threshold', 0.5)
+
+
+def detection_mask(raw, classes, norm, shape, expansion=0, out=None):
+    """Маска (0/255) боксов детекции с порогами и расширением, пиксель в пиксель как у масок окна"""
+    h, w = shape[:2]
+    out = np.zeros((h, w), dtype=np.uint8) if out is None else out
+    names = raw['names']
+    for xyxy, conf, cls_id in zip(raw['xyxy'], raw['conf'], raw['cls']):
+        cls_name = norm(names.get(int(cls_id), str(int(cls_id))))
+        if not _passes(classes, cls_name, float(conf)):
+            continue
+        x1, y1, x2, y2 = (float(v) for v in xyxy)
+        # Окно: box_rect при создании EditableMask, rect_span при растеризации
+        rect = box_rect(x1 - expansion, y1 - expansion, x2 + expansion, y2 + expansion, w, h)
+        span = rect_span(*rect, w, h) if rect is not None else None
+        if span is None:
+            continue
+        x1, y1, x2, y2 = span
+        out[y1:y2 + 1, x1:x2 + 1] = 255
+    return out
+
+
+def segmentation_mask(raw, classes, norm, shape, expansion=0, out=None):
+    """Маска (0/255) полигонов сегментации с порогами, расширением и упрощением"""
+    h, w = shape[:2]
+    out = np.zeros((h, w), dtype=np.uint8) if out is None else out
+    names = raw['names']
+    for segment, conf, cls_id in zip(raw.get('polys') or [], raw['conf'], raw['cls']):
+        cls_name = norm(names.get(int(cls_id), str(int(cls_id))))
+        if not _passes(classes, cls_name, float(conf)):
+            continue
+        pts = np.asarray(segment, dtype=np.float32).reshape(-1, 2)
+        if expansion > 0:
+            pts = offset_polygon(pts, expansion)
+        pts = simplify_polygon(pts)
+        if len(pts) < 3:
+            continue
+        pts = np.clip(pts, 0, [w - 1, h - 1]).astype(np.int32)
+        cv2.fillPoly(out, [pts.reshape(-1, 1, 2)], 255)
+    return out
+
+
+def finish_mask(mask):
+    """Закрытие разрывов и расширение на 1 px, как при сборке маски в окне"""
+    if not mask.any():
+        return mask
+    kernel = np.ones((3, 3), np.uint8)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    return cv2.dilate(mask, kernel, iterations=1)
+
+
+@timed("save.encode")
+def write_png(path, rgb):
+    """Атомарная запись PNG (поддерживает не-ASCII пути)"""
+    ok, buf = cv2.imencode('.png', cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR))
+    if not ok:
+        raise IOError(f"Не удалось закодировать {path}")
+    tmp = f"{path}.tmp"
+    buf.tofile(tmp)
+    os.replace(tmp, path)
+
+
+class CleanEngine:
+    """
+    Очистка страниц без Qt-интерфейса. Модели загружаются через DetectionManager,
+    результаты детекции берутся из дискового кэша главы (и пополняют его),
+    инпейнтинг - LamaInpainter с заливкой фона и очисткой по областям.
+    """
+
+    def __init__(self, ai_models, detect_classes=None, segm_classes=None, lama=None,
+                 detect_exp=MASK_EXP_DEF, segm_exp=MASK_EXP_DEF, conf=DEF_CONF, slice_tall=True):
+        defaults = default_classes()
+        self.detect_classes = detect_classes if detect_classes is not None else defaults[0]
+        self.segm_classes = segm_classes if segm_classes is not None else defaults[1]
+        self.detect_exp = detect_exp
+        self.segm_exp = segm_exp
+        self.conf = conf
+        self.slice_tall = slice_tall
+        self.device = get_device()
+        self.mgr = DetectionManager(ai_models, self.detect_classes, self.segm_classes)
+        self.lama = lama
+        self.inpainter = None
+
+    def use_settings(self, settings):
+        """Настройки главы поверх значений по умолчанию (словари классов меняются на месте)"""
+        for classes, defaults in zip((self.detect_classes, self.segm_classes), default_classes()):
+            for cls_name, info in defaults.items():
+                classes.setdefault(cls_name, {}).update(info)
+        self.detect_exp, self.segm_exp = apply_clean_settings(settings, self.detect_classes, self.segm_classes)
+
+    def kinds(self):
+        """Доступные модели: 'detect' и/или 'segm'"""
+        return [k for k in ('detect', 'segm') if self.mgr._model_available(k)]
+
+    def preload(self):
+        """Фоновая загрузка YOLO и LaMa, пока идет подготовка страниц"""
+        self.mgr.pin_models()
+        self.mgr.preload_models()
+        if self.lama is None:
+            self.mgr.models.preload([('lama', None)])
+
+    def _get_inpainter(self):
+        if self.inpainter is None:
+            # Модель LaMa общая (реестр), ожидается только при первом прогоне
+            self.inpainter = LamaInpainter(self.lama, loader=lambda: self.mgr.models.get('lama'))
+        return self.inpainter
+
+    def _model(self, kind):
+        return self.mgr.load_detection_model() if kind == 'detect' else self.mgr.load_segmentation_model()
+
+    def _predict(self, model, bgr, kind='detect'):
+        """Результат модели для страницы (высокие страницы - по окнам с объединением)"""
+        timer = get_stage_timer()
+        h, w = bgr.shape[:2]
+        windows = slice_windows(h, w) if self.slice_tall else [(0, h)]
+        imgs = [bgr if len(windows) == 1 else np.ascontiguousarray(bgr[y0:y1]) for y0, y1 in windows]
+        raws = []
+        for i in range(0, len(imgs), MAX_PREDICT_IMGS):
+            chunk = imgs[i:i + MAX_PREDICT_IMGS]
+            with timer.measure(f"{kind}.inference", len(chunk)):
+                results = model.predict(chunk, conf=self.conf, device=self.device,
+                                        batch=len(chunk), half=self.device == 'cuda', verbose=False)
+            with timer.measure(f"{kind}.extract", len(chunk)):
+                raws.extend(extract_raw(r) for r in results)
+        if len(raws) == 1:
+            return raws[0]
+        with timer.measure("detect.merge"):
+            return merge_slices([(y0, raw) for (y0, _), raw in zip(windows, raws)], (h, w))
+
+    def analyze(self, path, bgr, store=None):
+        """{тип: компактный результат} страницы; кэш главы используется с ключом окна"""
+        outputs = {}
+        name = os.path.basename(path)
+        sig = image_signature(path)
+        for kind in self.kinds():
+            model_hash = file_hash(self.mgr.ai_models.get(kind))
+            disk_key = (sig, f"{model_hash}|slice={int(self.slice_tall)}") if sig and model_hash else None
+            raw = store.load(name, kind, *disk_key) if store is not None and disk_key else None
+            if raw is None:
+                model = self._model(kind)
+                if model is None:
+                    continue
+                raw = self._predict(model, bgr, kind)
+                if store is not None and disk_key:
+                    store.save(name, kind, *disk_key, raw)
+            outputs[kind] = raw
+        return outputs
+
+    @timed("mask.build")
+    def page_mask(self, outputs, shape):
+        """Объединенная маска страницы по результатам моделей"""
+        mask = np.zeros(shape[:2], dtype=np.uint8)
+        norm = self.mgr._norm_cls_name
+        if 'detect' in outputs:
+            detection_mask(outputs['detect'], self.detect_classes, norm, shape, self.detect_exp, mask)
+        if 'segm' in outputs:
+            segmentation_mask(outputs['segm'], self.segm_classes, norm, shape, self.segm_exp, mask)
+        return finish_mask(mask)
+
+    def clean_page(self, path, store=None):
+        """Очищенная страница RGB или None, если маска пуста; исходник не изменяется"""
+        with get_stage_timer().measure("detect.convert"):
+            bgr = load_bgr(path)
+        if bgr is None:
+            raise IOError(f"Не удалось загрузить изображение {path}")
+        mask = self.page_mask(self.analyze(path, bgr, store), bgr.shape)
+        if not mask.any():
+            return None
+        rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+        return self._get_inpainter().inpaint(rgb, mask)
+
+    def clean_chapter(self, chapter_folder, source=None, force=False):
+        """
+        Очищает страницы главы и сохраняет их в папку клининга. Страницы,
+        уже очищенные или сохраненные в окне и не изменившиеся с тех пор,
+        пропускаются (force - очищать все заново).
+        Возвращает статистику {'pages', 'cleaned', 'skipped', 'done', 'failed'}.
+        """
+        paths = chapter_paths(chapter_folder)
+        cleaning_folder = paths["cleaning_folder"]
+        img_paths = resolve_images(paths, source)
+        stats = {'pages': len(img_paths), 'cleaned': 0, 'skipped': 0, 'done': 0, 'failed': 0}
+        if not img_paths:
+            logger.error(f"Не найдены изображения для обработки: {chapter_folder}")
+            return stats
+
+        done_pages = {} if force else load_done_pages(cleaning_folder)
+        self.preload()
+        store = DetectionStore(os.path.join(cleaning_folder, ".detections"))
+        for i, path in enumerate(img_paths):
+            if is_page_done(done_pages, path):
+                stats['done'] += 1
+                logger.info(f"[{i + 1}/{len(img_paths)}] {os.path.basename(path)}: уже очищена")
+                continue
+            start = time.perf_counter()
+            try:
+                result = self.clean_page(path, store)
+                if result is None:
+                    stats['skipped'] += 1
+                    logger.info(f"[{i + 1}/{len(img_paths)}] {os.path.basename(path)}: нечего очищать")
+                    continue
+                write_png(path, result)
+                # Отметка сразу после записи: прерванный прогон не очистит страницу повторно
+                record_done_pages(cleaning_folder, [path])
+                stats['cleaned'] += 1
+                elapsed = time.perf_counter() - start
+                get_stage_timer().add("engine.page", elapsed)
+                logger.info(f"[{i + 1}/{len(img_paths)}] {os.path.basename(path)}: {elapsed:.2f} с")
+            except Exception as e:
+                stats['failed'] += 1
+                logger.error(f"Ошибка очистки {path}: {str(e)}")
+                import traceback
+                logger.error(traceback.format_exc())
+
+        write_json_atomic(os.path.join(cleaning_folder, SAVED_IMAGES_JSON), {"paths": img_paths})
+        return stats
+
+
+def find_chapters(root):
+    """Папки глав внутри root (с подпапкой "Загрузка")"""
+    chapters = []
+    for dirpath, dirnames, _ in os.walk(root):
+        if "Загрузка" in dirnames:
+            chapters.append(dirpath)
+            dirnames[:] = []
+    return sorted(chapters)
+
+
+def models_from_dir(models_dir):
+    """Пути detect.pt/segm.pt в папке моделей (или ее подпапке cleaner)"""
+    models = {"detect": "", "segm": ""}
+    if not models_dir:
+        return models
+    for folder in (os.path.join(models_dir, "cleaner"), models_dir):
+        for kind in models:
+            path = os.path.join(folder, f"{kind}.pt")
+            if not models[kind] and os.path.exists(path):
+                models[kind] = path
+    return models
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Очистка глав без интерфейса: детекция, маска, LaMa, сохранение")
+    parser.add_argument("chapters", nargs="+", help="папки глав")
+    parser.add_argument("--recursive", action="store_true", help="искать главы внутри указанных папок")
+    parser.add_argument("--source", choices=("auto", "preprocess_save", "upload"), default="auto",
+                        help="источник изображений, если папка клининга пуста")
+    parser.add_argument("--models-dir", default="", help="папка с detect.pt/segm.pt (или cleaner/)")
+    parser.add_argument("--detect-model", default="", help="путь к модели детекции")
+    parser.add_argument("--segm-model", default="", help="путь к модели сегментации")
+    parser.add_argument("--settings", default="", help="JSON настроек вместо сохраненных в главе")
+    parser.add_argument("--force", action="store_true",
+                        help="очищать заново все страницы, включая завершенные главы и сохраненные вручную")
+    parser.add_argument("--timing", default="", help="записать замеры этапов в JSON")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    ai_models = models_from_dir(args.models_dir)
+    ai_models["detect"] = args.detect_model or ai_models["detect"]
+    ai_models["segm"] = args.segm_model or ai_models["segm"]
+    if not any(os.path.exists(p) for p in ai_models.values() if p):
+        logger.error("Не найдены модели детекции/сегментации")
+        return 2
+
+    override = None
+    if args.settings:
+        with open(args.settings, 'r', encoding='utf-8') as f:
+            override = json.load(f)
+
+    chapters = []
+    for folder in args.chapters:
+        chapters.extend(find_chapters(folder) if args.recursive else [folder])
+
+    # Модели загружаются один раз на все главы
+    engine = CleanEngine(ai_models)
+    failed = 0
+    for chapter in chapters:
+        settings = override if override is not None else load_clean_settings(chapter_paths(chapter)["cleaning_folder"])
+        engine.use_settings(settings)
+
+        if not args.force and chapter_completed(chapter):
+            logger.info(f"Глава {chapter}: клининг завершен, пропуск (--force для повторной очистки)")
+            continue
+
+        logger.info(f"Глава: {chapter}")
+        stats = engine.clean_chapter(chapter, None if args.source == "auto" else args.source, args.force)
+        logger.info(f"Глава {chapter}: очищено {stats['cleaned']}, без изменений {stats['skipped']}, "
+                    f"уже очищено {stats['done']}, ошибок {stats['failed']} из {stats['pages']}")
+        failed += stats['failed']
+
+    timer = get_stage_timer()
+    if timer.samples:
+        logger.info(f"Замеры этапов:\n{timer.report()}")
+        if args.timing and timer.export_json(args.timing, {"chapters": chapters, "models": ai_models}):
+            logger.info(f"Замеры сохранены: {args.timing}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
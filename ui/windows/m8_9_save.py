@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# ui/windows/m8_9_save.py
+import os
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from PySide6.QtCore import QRunnable, QObject, Signal
+from ui.components.stage_timer import timed
+
+logger = logging.getLogger(__name__)
+
+# Качество PNG для QImage.save: -1 - сжатие Qt по умолчанию,
+# 80 - zlib уровень 1 (быстро, файл крупнее; для промежуточных этапов)
+PNG_QUALITY_DEF = -1
+PNG_QUALITY_FAST = 80
+
+
+def write_json_atomic(path, data):
+    """Запись JSON через временный файл"""
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+    os.replace(tmp, path)
+
+
+@timed("save.encode")
+def save_qimage_atomic(img, path, quality=PNG_QUALITY_DEF):
+    """Кодирует QImage в PNG во временный файл и атомарно заменяет path"""
+    tmp = f"{path}.tmp"
+    if not img.save(tmp, "PNG", quality):
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise IOError(f"Не удалось закодировать {os.path.basename(path)}")
+    os.replace(tmp, path)
+
+
+class PageSaveSignals(QObject):
+    """Сигналы сохранения страниц клининга"""
+    page_saved = Signal(int, str)  # page_idx, путь
+    page_failed = Signal(int, str)  # page_idx, сообщение
+    finished = Signal(dict)  # итоговая статистика
+
+
+class PageSaveWorker(QRunnable):
+    """
+    Сохранение страниц клининга: QImage кодируются в PNG параллельно
+    в пуле потоков, каждый файл пишется атомарно (временный файл + замена).
+    """
+
+    def __init__(self, jobs, quality=PNG_QUALITY_DEF, max_workers=None):
+        """
+        Args:
+            jobs: Список (page_idx, QImage, путь назначения)
+            quality: Качество PNG для QImage.save (PNG_QUALITY_FAST - быстрое сжатие)
+        """
+        super().__init__()
+        self.jobs = jobs
+        self.quality = quality
+        self.max_workers = max_workers or min(8, os.cpu_count() or 2)
+        self.signals = PageSaveSignals()
+
+    def run(self):
+        stats = {"total": len(self.jobs), "saved": 0, "errors": []}
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="page_save") as pool:
+                futures = {pool.submit(save_qimage_atomic, img, path, self.quality): (page_idx, path)
+                           for page_idx, img, path in self.jobs}
+                for future in as_completed(futures):
+                    page_idx, path = futures[future]
+                    try:
+                        future.result()
+                        stats["saved"] += 1
+                        self.signals.page_saved.emit(page_idx, path)
+                    except Exception as e:
+                        error_msg = f"Ошибка сохранения {os.path.basename(path)}: {e}"
+                        logger.error(error_msg)
+                        stats["errors"].append(error_msg)
+                        self.signals.page_failed.emit(page_idx, str(e))
+        except Exception as e:
+            logger.error(f"Ошибка в PageSaveWorker: {repr(e)}")
+            stats["errors"].append(str(e))
+        self.signals.finished.emit(stats)
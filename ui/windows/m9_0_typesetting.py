@@ -20,6 +20,7 @@ from PySide6.QtGui import QPainter
 from PySide6.QtWidgets import QStyle
 # Импортируем наши модули
 from ui.components.gradient_widget import GradientBackgroundWidget
+from ui.components.thumb_cache import get_thumb_cache, THUMB_W, THUMB_H
 from ui.windows.m9_1_image_viewer import (ImageViewer, TextBlockModifiedSignal,
                                           TextBlockItem)
 from ui.windows.m9_2_utils import (get_images_from_folder, show_message, PageChangeSignal)
@@ -1136,12 +1137,9 @@ class TypesettingWindow(QDialog):
             if self.viewer.current_page == idx:
                 self.viewer.displayCurrentPage()
 
-            # Обновляем миниатюру
+            # Миниатюра из уже загруженной страницы, без повторного чтения файла
             if self.preview_scroll_area and 0 <= idx < len(self.thumbnail_labels):
-                tw = 150
-                th = tw * 2
-                scaled_pix = pixmap.scaled(tw, th, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                self.thumbnail_labels[idx].setPixmap(scaled_pix)
+                get_thumb_cache().set_label_pixmap(self.thumbnail_labels[idx], self.image_paths[idx], pixmap)
 
         # Отправляем событие об успешной загрузке
         QApplication.postEvent(self, ImageLoadedEvent(idx))
@@ -1289,8 +1287,9 @@ class TypesettingWindow(QDialog):
         self.thumbnail_labels = []
         self.index_labels = []
 
-        thumbnail_width = 150
-        thumbnail_height = thumbnail_width * 2
+        thumbnail_width = THUMB_W
+        thumbnail_height = THUMB_H
+        thumbs = get_thumb_cache()
 
         for i, path in enumerate(self.image_paths):
             thumb_container = QWidget()
@@ -1299,14 +1298,9 @@ class TypesettingWindow(QDialog):
             thumb_layout.setSpacing(0)
 
             thumb_label = QLabel()
-            pm = QPixmap(path)
-            if not pm.isNull():
-                scaled_pix = pm.scaled(
-                    thumbnail_width, thumbnail_height,
-                    Qt.KeepAspectRatio, Qt.SmoothTransformation
-                )
-                thumb_label.setPixmap(scaled_pix)
-                thumb_label.setAlignment(Qt.AlignCenter)
+            # Миниатюра из кэша или фоновая генерация
+            thumbs.set_label_thumb(thumb_label, path, thumbnail_width, thumbnail_height)
+            thumb_label.setAlignment(Qt.AlignCenter)
 
             thumb_label.setStyleSheet("""
                 QLabel {